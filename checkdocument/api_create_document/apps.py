@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiCreateDocumentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api_create_document'
+
+    def ready(self):
+        # Warm the PDF stack before the worker takes traffic (see warmup.py)
+        from . import warmup
+        if warmup.should_warm_up():
+            warmup.warm_up_once()
@@ -0,0 +1,223 @@
+"""
+Upload-once asset store.
+
+Card photos and PDFs are uploaded as soon as they are picked in the UI and
+stored by content hash under MEDIA_ROOT/assets/<sha256>/. Images are
+preprocessed in the background right away (downscale and a compressed JPEG
+derivative that keeps the EXIF orientation), so generate calls that reference the asset id
+only pay for composition.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image
+
+from .quality import quality_setting
+from .workers import DiskUpload
+
+ASSET_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+ALLOWED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff", ".heic")
+# stored and served as uploaded: PDFs, and TIFFs whose further frames (and G4
+# data) a single JPEG derivative would lose
+PASSTHROUGH_EXTENSIONS = (".pdf", ".tif", ".tiff")
+DERIVATIVE_NAME = "derived.jpg"
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "ASSET_PREPROCESS_WORKERS", 2),
+    thread_name_prefix="asset-preprocess",
+)
+_pending = {}
+_lock = threading.Lock()
+
+
+class AssetNotFound(Exception):
+    pass
+
+
+class AssetRejected(Exception):
+    """An upload the store does not take; the message is safe to return to the client."""
+
+
+# -----------------------
+# Paths
+# -----------------------
+
+def asset_root():
+    return os.path.join(settings.MEDIA_ROOT, "assets")
+
+
+def asset_dir(asset_id):
+    if not asset_id or not ASSET_ID_RE.match(asset_id):
+        raise AssetNotFound(asset_id)
+    return os.path.join(asset_root(), asset_id)
+
+
+def original_path(asset_id):
+    """Return the stored original (original.<ext>) or raise AssetNotFound."""
+    folder = asset_dir(asset_id)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.startswith("original"):
+                return os.path.join(folder, name)
+    raise AssetNotFound(asset_id)
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else ".bin"
+
+
+def accepted_extensions():
+    """ALLOWED_EXTENSIONS this server can read: PDFs and what Pillow has a decoder for."""
+    readable = Image.registered_extensions()
+    return [ext for ext in ALLOWED_EXTENSIONS if ext == ".pdf" or ext in readable]
+
+
+def check_upload(filename, size):
+    """Raise AssetRejected for a file type the server cannot read or a size over ASSET_UPLOAD_MAX_SIZE."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in accepted_extensions():
+        raise AssetRejected(f"{ext or 'files without an extension'} not accepted, use one of "
+                            f"{' '.join(accepted_extensions())}")
+    max_size = getattr(settings, "ASSET_UPLOAD_MAX_SIZE", 64 * 1024 * 1024)
+    if size > max_size:
+        raise AssetRejected(f"file is over {max_size} bytes, send it as a chunked upload")
+
+
+# -----------------------
+# Store + preprocess
+# -----------------------
+
+def store_asset(uploaded_file):
+    """
+    Hash and store an uploaded file, then start preprocessing in the background.
+    Returns the asset id (sha256 hex). Uploading the same bytes twice is a no-op.
+    Raises AssetRejected (see check_upload) before anything is written.
+    """
+    check_upload(getattr(uploaded_file, "name", ""), getattr(uploaded_file, "size", 0) or 0)
+    os.makedirs(asset_root(), exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=asset_root(), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            chunks = uploaded_file.chunks() if hasattr(uploaded_file, "chunks") else [uploaded_file.read()]
+            for chunk in chunks:
+                digest.update(chunk)
+                tmp.write(chunk)
+        asset_id = digest.hexdigest()
+        adopt_file(asset_id, tmp_path, getattr(uploaded_file, "name", ""))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return asset_id
+
+
+def adopt_file(asset_id, path, filename):
+    """
+    Move an already hashed file into the store (no copy) and schedule preprocessing.
+    If the asset already exists the file is left where it is for the caller to discard.
+    """
+    folder = asset_dir(asset_id)
+    try:
+        original_path(asset_id)
+    except AssetNotFound:
+        os.makedirs(folder, exist_ok=True)
+        os.replace(path, os.path.join(folder, "original" + _extension(filename)))
+    schedule_preprocess(asset_id)
+
+
+def schedule_preprocess(asset_id):
+    """Queue the derivative build unless it exists or is already running."""
+    if is_ready(asset_id):
+        return None
+    with _lock:
+        future = _pending.get(asset_id)
+        if future is None:
+            future = _executor.submit(_preprocess, asset_id)
+            _pending[asset_id] = future
+            future.add_done_callback(lambda _f: _forget(asset_id))
+    return future
+
+
+def _forget(asset_id):
+    with _lock:
+        _pending.pop(asset_id, None)
+
+
+def _preprocess(asset_id):
+    """Downscale and JPEG-compress an image asset. PDFs and TIFFs are stored as-is."""
+    from .views import compress_image, load_image
+
+    path = original_path(asset_id)
+    if path.endswith(PASSTHROUGH_EXTENSIONS):
+        return None
+
+    with open(path, "rb") as fh:
+        buf = compress_image(load_image(fh), quality=quality_setting("asset_jpeg_quality"))
+    if buf is None:
+        return None
+
+    target = os.path.join(asset_dir(asset_id), DERIVATIVE_NAME)
+    tmp_path = target + ".part"
+    with open(tmp_path, "wb") as out:
+        out.write(buf.getbuffer())
+    os.replace(tmp_path, target)
+    return target
+
+
+def is_ready(asset_id):
+    return os.path.exists(os.path.join(asset_dir(asset_id), DERIVATIVE_NAME))
+
+
+def asset_status(asset_id):
+    path = original_path(asset_id)
+    if path.endswith(PASSTHROUGH_EXTENSIONS) or is_ready(asset_id):
+        return "ready"
+    with _lock:
+        future = _pending.get(asset_id)
+    return "processing" if future is not None else "original"
+
+
+# -----------------------
+# Resolve for generation
+# -----------------------
+
+def open_asset(asset_id, wait=True):
+    """
+    Return a django File for the asset, usable wherever an upload is accepted.
+    Images resolve to their preprocessed derivative (marked ``preprocessed``),
+    waiting for a running preprocess job when ``wait`` is True. PDFs and TIFFs
+    are opened in place as a DiskUpload, so large ones are read by path (see
+    prepare_multipage) like uploads Django spooled to disk. The caller closes
+    the file (views.close_job_files).
+    """
+    path = original_path(asset_id)
+    if path.endswith(PASSTHROUGH_EXTENSIONS):
+        return DiskUpload(open(path, "rb"), name=os.path.basename(path))
+
+    if not is_ready(asset_id) and wait:
+        future = schedule_preprocess(asset_id)
+        if future is not None:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("Asset preprocessing failed for %s: %s", asset_id, e)
+
+    derived = os.path.join(asset_dir(asset_id), DERIVATIVE_NAME)
+    if os.path.exists(derived):
+        with open(derived, "rb") as fh:
+            asset = File(BytesIO(fh.read()), name=asset_id + ".jpg")
+        asset.preprocessed = True
+        return asset
+
+    return DiskUpload(open(path, "rb"), name=os.path.basename(path))
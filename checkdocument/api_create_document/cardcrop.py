@@ -0,0 +1,131 @@
+"""
+Optional ID-card auto-crop (settings.CARD_AUTO_CROP).
+
+Phone photos of ID cards are mostly desk. detect_card finds the card on a
+small grayscale copy of the photo (or of a PDF page) with NumPy only:
+
+    1. gradient magnitude from central differences, thresholded at a
+       percentile into an edge mask
+    2. per-row / per-column edge counts; the card is the span holding the
+       central EDGE_MASS of them (printed card vs plain background)
+    3. each side is grown outward while the lines beyond it still carry edges,
+       out to the card border; for a tilted card this is the bounding box of
+       its quadrilateral
+    4. the box is only trusted if it is clearly a part of the frame, its edge
+       density stands out from the background, and its sides separate the
+       card's tone from the desk's
+
+The result is in fractions of the image, so it applies unchanged to the full
+resolution photo or, as a fitz clip, to a PDF page.
+"""
+import numpy as np
+
+# long side of the copy the detector works on
+DETECT_SIZE = 400
+EDGE_PERCENTILE = 88
+MIN_EDGE_STRENGTH = 12.0
+EDGE_MASS = 0.96
+# accepted card share of the frame, and inside/outside edge density ratio
+MIN_AREA = 0.08
+MAX_AREA = 0.85
+MIN_CONTRAST = 2.5
+# border check: outside strip width and inside band inset (fractions of the
+# box), and the gray step needed between them
+STRIP = 0.03
+INSET = 0.1
+MIN_STEP = 16
+# margin kept around the card, as a fraction of its size
+PAD = 0.02
+
+
+def detect_card(gray):
+    """(x0, y0, x1, y1) of the card as fractions of a uint8 (h, w) array, or None."""
+    height, width = gray.shape
+    if min(height, width) < 32:
+        return None
+
+    g = gray.astype(np.float32)
+    gx = np.zeros_like(g)
+    gy = np.zeros_like(g)
+    gx[:, 1:-1] = g[:, 2:] - g[:, :-2]
+    gy[1:-1, :] = g[2:, :] - g[:-2, :]
+    magnitude = np.hypot(gx, gy)
+    edges = magnitude > max(np.percentile(magnitude, EDGE_PERCENTILE), MIN_EDGE_STRENGTH)
+    if edges.sum() < 0.001 * edges.size:
+        return None
+
+    y0, y1 = _mass_span(edges.sum(axis=1))
+    x0, x1 = _mass_span(edges.sum(axis=0))
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    # the trimmed span sits just inside the card; grow each side outward while
+    # the rows / columns beyond it still carry more edges than the background
+    rows = edges[:, x0:x1].sum(axis=1)
+    y0, y1 = _grow(rows, y0, y1)
+    cols = edges[y0:y1, :].sum(axis=0)
+    x0, x1 = _grow(cols, x0, x1)
+    if x1 - x0 < 16 or y1 - y0 < 16:
+        return None
+
+    area = (x1 - x0) * (y1 - y0) / float(width * height)
+    if not MIN_AREA <= area <= MAX_AREA:
+        return None
+    inside = edges[y0:y1, x0:x1].mean()
+    outside = (edges.sum() - edges[y0:y1, x0:x1].sum()) / float(edges.size - (x1 - x0) * (y1 - y0))
+    if inside < MIN_CONTRAST * max(outside, 1e-4):
+        return None
+    # busy print on a plain card (a card that already fills the frame) passes the
+    # checks above; a real card also differs in tone from what lies around it
+    if not _has_border(g, x0, y0, x1, y1):
+        return None
+
+    pad_x, pad_y = PAD * (x1 - x0), PAD * (y1 - y0)
+    return (
+        max(0.0, (x0 - pad_x) / width),
+        max(0.0, (y0 - pad_y) / height),
+        min(1.0, (x1 + pad_x) / width),
+        min(1.0, (y1 + pad_y) / height),
+    )
+
+
+def _mass_span(profile):
+    """Indexes bounding the central EDGE_MASS of a 1-D edge-count profile."""
+    cumulative = np.cumsum(profile, dtype=np.float64)
+    total = cumulative[-1]
+    tail = (1.0 - EDGE_MASS) / 2 * total
+    start = int(np.searchsorted(cumulative, tail))
+    stop = int(np.searchsorted(cumulative, total - tail)) + 1
+    return start, min(stop, len(profile))
+
+
+def _grow(profile, start, stop):
+    """Widen [start, stop) while the neighbouring lines are above the background level."""
+    outside = np.concatenate([profile[:start], profile[stop:]])
+    level = max(2.0, 2.0 * outside.mean()) if outside.size else 2.0
+    while start > 0 and profile[start - 1] > level:
+        start -= 1
+    while stop < len(profile) and profile[stop] > level:
+        stop += 1
+    return start, stop
+
+
+def _has_border(g, x0, y0, x1, y1):
+    """
+    True when every side of the box that is not at the frame edge separates two
+    different tones: the median of a band inside the card (set in far enough to
+    clear the desk corners of a tilted card) vs a strip just outside the side.
+    """
+    height, width = g.shape
+    dx, dy = max(2, int(STRIP * (x1 - x0))), max(2, int(STRIP * (y1 - y0)))
+    ix, iy = int(INSET * (x1 - x0)), int(INSET * (y1 - y0))
+    sides = (
+        (y0 >= dy, g[y0 + iy:y0 + 2 * iy, x0:x1], g[max(0, y0 - 2 * dy):y0, x0:x1]),
+        (y1 <= height - dy, g[y1 - 2 * iy:y1 - iy, x0:x1], g[y1:y1 + 2 * dy, x0:x1]),
+        (x0 >= dx, g[y0:y1, x0 + ix:x0 + 2 * ix], g[y0:y1, max(0, x0 - 2 * dx):x0]),
+        (x1 <= width - dx, g[y0:y1, x1 - 2 * ix:x1 - ix], g[y0:y1, x1:x1 + 2 * dx]),
+    )
+    return all(
+        abs(float(np.median(inner)) - float(np.median(outer))) >= MIN_STEP
+        for open_side, inner, outer in sides if open_side
+    )
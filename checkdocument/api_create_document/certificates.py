@@ -0,0 +1,155 @@
+"""
+Compiled notary certificate templates.
+
+The certificate wording is one template per notary profile. Profile fields
+(name, address, jurisdiction) are filled in once at compile time, leaving only
+the per-request fields ({document_type}, {customer_name}, {schedule_date}).
+A compiled certificate keeps:
+
+    prefix_lines  the lines before the first variable word, laid out once
+    middle        the words from the last prefix line to the last variable word,
+                  re-flowed per request (variable words are set in bold)
+    suffix        the static words after that; the re-flow stops at the first
+                  line that starts inside the suffix and the (cached) layout of
+                  the rest of the suffix from that word on is reused
+
+Greedy line breaking only looks backwards, so the result is identical to laying
+out the whole paragraph each time.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+
+from .textlayout import FONT_BOLD, FONT_REGULAR, break_lines, coalesce_runs, draw_lines
+
+CERTIFICATE_TEXT = (
+    "I, {notary_name} OF {notary_address}, "
+    "A DULY AUTHORISED NOTARY PUBLIC OF {jurisdiction} CERTIFY THAT THIS IS A TRUE COPY OF THE DOCUMENT "
+    "{{document_type}} OF {{customer_name}} PRODUCED TO ME THIS {{schedule_date}} "
+    "AND I FURTHER CERTIFY THAT THE INDIVIDUAL THAT APPEARED BEFORE ME VIA VIDEO CONFERENCE CALL IS INDEED "
+    "AND BEARS THE TRUE LIKENESS OF {{customer_name}}."
+)
+
+# Extra or replacement profiles go in settings.NOTARY_PROFILES (same keys)
+NOTARY_PROFILES = {
+    "JOHN_OLATUNJI": {
+        "notary_name": "JOHN OLATUNJI",
+        "notary_address": "ONE LONDON SQUARE, CROSS LANES, GUILDFORD, GU1 1UN",
+        "jurisdiction": "ENGLAND AND WALES",
+    },
+}
+
+
+class UnknownNotary(Exception):
+    pass
+
+
+def notary_profiles():
+    return {**NOTARY_PROFILES, **getattr(settings, "NOTARY_PROFILES", {})}
+
+
+def default_notary():
+    return getattr(settings, "DEFAULT_NOTARY_PROFILE", "JOHN_OLATUNJI")
+
+
+class CompiledCertificate:
+
+    def __init__(self, text, max_width, font_size):
+        self.text = text
+        self.max_width = max_width
+        self.font_size = font_size
+
+        tokens = text.split()
+        variable = [index for index, token in enumerate(tokens) if "{" in token]
+        first, last = variable[0], variable[-1]
+
+        # prefix: complete lines before the first variable word; the last one
+        # may still take the variable word, so it is re-flowed with the middle
+        prefix_words = [(FONT_REGULAR, token) for token in tokens[:first]]
+        self.prefix_lines = []
+        head = 0
+        for line, next_index in break_lines(prefix_words, max_width, font_size):
+            if next_index is None or next_index >= len(prefix_words):
+                break
+            self.prefix_lines.append(coalesce_runs(line))
+            head = next_index
+
+        self.middle = tokens[head:last + 1]
+        self.suffix = [(FONT_REGULAR, token) for token in tokens[last + 1:]]
+        self._tails = {}
+
+    def suffix_tail(self, start):
+        """Layout of the suffix from word `start` on, starting on a fresh line (cached)."""
+        tail = self._tails.get(start)
+        if tail is None:
+            words = self.suffix[start:]
+            tail = [coalesce_runs(line) for line, _ in break_lines(words, self.max_width, self.font_size)]
+            self._tails[start] = tail
+        return tail
+
+    def layout(self, **values):
+        """Lines of (font, text) runs for one request's document_type / customer_name / schedule_date."""
+        words = []
+        for token in self.middle:
+            if "{" in token:
+                words.extend((FONT_BOLD, word) for word in token.format(**values).split())
+            else:
+                words.append((FONT_REGULAR, token))
+        reflowed = len(words)
+        words.extend(self.suffix)
+
+        lines = list(self.prefix_lines)
+        for line, next_index in break_lines(words, self.max_width, self.font_size):
+            lines.append(coalesce_runs(line))
+            if next_index is not None and reflowed <= next_index < len(words):
+                return lines + self.suffix_tail(next_index - reflowed)
+        return lines
+
+
+def profile_text(profile):
+    """Certificate template of a notary profile, profile fields filled in; raises UnknownNotary."""
+    try:
+        fields = notary_profiles()[profile]
+    except KeyError:
+        raise UnknownNotary(profile)
+    return CERTIFICATE_TEXT.format(**fields)
+
+
+def compile_certificate(profile, max_width, font_size=10):
+    """
+    Compile the certificate of a notary profile for a column width / font size.
+    The profile is resolved on every call and the cache is keyed on its text, so
+    changed NOTARY_PROFILES settings never get a stale template.
+    """
+    return _compile(profile_text(profile), max_width, font_size)
+
+
+@lru_cache(maxsize=64)
+def _compile(text, max_width, font_size):
+    return CompiledCertificate(text, max_width, font_size)
+
+
+def certificate_text(profile, document_type, customer_name, schedule_date):
+    """The full certificate paragraph as plain text."""
+    return profile_text(profile).format(**certificate_values(document_type, customer_name, schedule_date))
+
+
+def certificate_values(document_type, customer_name, schedule_date):
+    # missing values render as empty text (the old f-string printed "None")
+    return {
+        "document_type": document_type or "",
+        "customer_name": customer_name or "",
+        "schedule_date": schedule_date or "",
+    }
+
+
+def draw_certificate(c, start_x, start_y, document_type, customer_name, schedule_date,
+                     profile=None, width=None, font_size=10):
+    """Draw the certificate paragraph of a notary profile; variable parts in bold."""
+    if width is None:
+        width = c._pagesize[0] - 2 * start_x
+    compiled = compile_certificate(profile or default_notary(), width, font_size)
+    text_obj = c.beginText(start_x, start_y)
+    lines = compiled.layout(**certificate_values(document_type, customer_name, schedule_date))
+    draw_lines(text_obj, lines, font_size)
+    c.drawText(text_obj)
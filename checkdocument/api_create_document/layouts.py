@@ -0,0 +1,269 @@
+"""
+Declarative card-slot layout rules.
+
+Each layout lists rules in priority order; the first rule whose slots are all
+present wins (same as the old if/elif chains in generate_document). A rule
+gives per-slot size limits plus optional follow-ups:
+
+    shrink_above / shrink_limits -> if the tallest image exceeds the threshold,
+                                    refit every slot with the tighter limits
+    stack_within                 -> scale the group down so the stacked heights
+                                    (plus gaps) fit into this height
+
+Sizes are solved in one pass from header-probed pixel dimensions and memoized,
+so images are never re-opened for layout.
+"""
+import math
+from functools import lru_cache
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 50
+GAP = 20
+MIN_SIZE = (50, 50)
+
+SLOTS = ("front", "back", "front2", "back2")
+
+# every layout render_document knows; the ones without their own LAYOUT_RULES use "default"
+LAYOUT_NAMES = ("ONENOTARY", "UK88", "UK88_MULTIPAGE", "us_multipage", "non_multipage", "default")
+# layouts made of the certificate/template page and the multipage upload only; they draw no cards
+CARDLESS_LAYOUTS = ("UK88_MULTIPAGE", "us_multipage", "non_multipage")
+
+EXIF_ORIENTATION = 0x0112
+
+# ONENOTARY safe area (below template header, above footer/QR)
+_ON_AVAIL_W = PAGE_WIDTH - 2 * MARGIN
+_ON_AVAIL_H = max(100, (PAGE_HEIGHT - 160) - (MARGIN + 60))
+_ON_HALF_W = (_ON_AVAIL_W - GAP) / 2
+
+# UK88 full-width column
+_UK_AVAIL_W = PAGE_WIDTH - 2 * MARGIN
+
+# Default layout area
+_DF_AVAIL_W = PAGE_WIDTH - 2 * MARGIN
+_DF_AVAIL_H = max(100, (PAGE_HEIGHT - MARGIN) - (MARGIN + 40))
+_DF_COL_W = (_DF_AVAIL_W - GAP) / 2
+_DF_CELL_H = (_DF_AVAIL_H - GAP) / 2
+
+
+LAYOUT_RULES = {
+    "ONENOTARY": [
+        {
+            "slots": ("front", "back"),
+            "limits": [(_ON_HALF_W, _ON_AVAIL_H)] * 2,
+            "shrink_above": 230,
+            "shrink_limits": [(min(_ON_HALF_W, 180), 220)] * 2,
+        },
+        {
+            "slots": ("front",),
+            "limits": [(_ON_AVAIL_W, _ON_AVAIL_H)],
+            "shrink_above": 230,
+            "shrink_limits": [(min(_ON_AVAIL_W, 380), 220)],
+        },
+    ],
+    "UK88": [
+        {
+            "slots": ("front", "back"),
+            "limits": [(_UK_AVAIL_W, PAGE_HEIGHT * 0.35)] * 2,
+            "shrink_above": 270,
+            "shrink_limits": [(min(_UK_AVAIL_W, 400), 290)] * 2,
+        },
+        {
+            "slots": ("front",),
+            "limits": [(_UK_AVAIL_W, PAGE_HEIGHT * 0.6)],
+            "shrink_above": 355,
+            "shrink_limits": [(min(_UK_AVAIL_W, 380), 300)],
+        },
+    ],
+    "default": [
+        # 2x2 grid
+        {
+            "slots": ("front", "back", "front2", "back2"),
+            "limits": [(_DF_COL_W, _DF_CELL_H)] * 4,
+        },
+        # one big, two below
+        {
+            "slots": ("front", "front2", "back2"),
+            "limits": [(_DF_AVAIL_W, _DF_AVAIL_H * 0.55)] + [(_DF_COL_W, _DF_AVAIL_H * 0.4)] * 2,
+        },
+        # two on top, one below
+        {
+            "slots": ("front", "back", "front2"),
+            "limits": [(_DF_COL_W, _DF_AVAIL_H * 0.55)] * 2 + [(12222, 255)],
+        },
+        # two stacked
+        {
+            "slots": ("front", "back"),
+            "limits": [(_DF_AVAIL_W, _DF_AVAIL_H * 0.6)] * 2,
+            "stack_within": _DF_AVAIL_H,
+        },
+        {
+            "slots": ("front", "front2"),
+            "limits": [(_DF_AVAIL_W, _DF_AVAIL_H * 0.6)] * 2,
+            "stack_within": _DF_AVAIL_H,
+        },
+        {
+            "slots": ("front",),
+            "limits": [(_DF_AVAIL_W, _DF_AVAIL_H)],
+        },
+    ],
+}
+
+
+# -----------------------
+# Probing + fitting
+# -----------------------
+
+def exif_orientation(img):
+    """EXIF orientation tag (1-8) of an opened image; 1 when absent. Header only."""
+    try:
+        return int(img.getexif().get(EXIF_ORIENTATION, 1) or 1)
+    except Exception:
+        return 1
+
+
+def oriented_size(img):
+    """
+    Pixel size as displayed, i.e. swapped for the 90/270 degree EXIF orientations.
+    Pillow already reports TIFFs at their displayed size.
+    """
+    width, height = img.size
+    if img.format != "TIFF" and exif_orientation(img) in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def probe_size(img_input):
+    """
+    Return the displayed (width, height) in pixels from the image header only, or None.
+    Accepts PIL.Image or a file-like/BytesIO; the stream position is restored.
+    """
+    if img_input is None:
+        return None
+    if isinstance(img_input, Image.Image):
+        return oriented_size(img_input)
+    try:
+        img_input.seek(0)
+        with Image.open(img_input) as img:
+            size = oriented_size(img)
+        img_input.seek(0)
+        return size
+    except Exception:
+        return None
+
+
+def max_card_box(layout):
+    """
+    Largest (width, height) in points any card slot of a layout can be drawn at,
+    over all its rules; an upper bound for the upload pixels worth keeping.
+    """
+    rules = LAYOUT_RULES.get(layout, LAYOUT_RULES["default"])
+    limits = [limit for rule in rules for limit in rule["limits"] + rule.get("shrink_limits", [])]
+    return min(max(w for w, _ in limits), PAGE_WIDTH), min(max(h for _, h in limits), PAGE_HEIGHT)
+
+
+def box_to_pixels(box, dpi):
+    """Pixels needed to fill a (width, height) box in points at the given effective DPI."""
+    width, height = box
+    return max(1, math.ceil(width * dpi / 72.0)), max(1, math.ceil(height * dpi / 72.0))
+
+
+def fit_box(aspect_ratio, native_size, max_width, max_height, min_width=MIN_SIZE[0], min_height=MIN_SIZE[1]):
+    """
+    Fit an image of the given aspect ratio into max_width x max_height without
+    upscaling past its native pixel size. Returns (width, height) as ints (points).
+    """
+    if not aspect_ratio or native_size is None:
+        return int(min_width), int(min_height)
+
+    original_width, original_height = native_size
+    if aspect_ratio >= 1:  # landscape or square
+        width = min(max_width, original_width)
+        height = width / aspect_ratio
+        if height > max_height:
+            height = max_height
+            width = height * aspect_ratio
+    else:  # portrait
+        height = min(max_height, original_height)
+        width = height * aspect_ratio
+        if width > max_width:
+            width = max_width
+            height = width / aspect_ratio
+
+    # enforce minimums so tiny images stay readable
+    if width < min_width:
+        width = min_width
+        height = max(min_height, width / max(aspect_ratio, 0.0001))
+    if height < min_height:
+        height = min_height
+        width = max(min_width, height * aspect_ratio)
+
+    return int(round(width)), int(round(height))
+
+
+# -----------------------
+# Solver
+# -----------------------
+
+def select_rule(layout, present):
+    """Pick the first rule of the layout whose slots are all present."""
+    rules = LAYOUT_RULES.get(layout, LAYOUT_RULES["default"])
+    for index, rule in enumerate(rules):
+        if all(slot in present for slot in rule["slots"]):
+            return index, rule
+    return None, None
+
+
+def _slot_key(size, rule):
+    """
+    Cache key for one slot: aspect ratio plus native size clamped to the largest
+    limit in the rule. Images bigger than every limit only differ by aspect ratio.
+    The ratio is kept exact; rounding it moves boxes by a point.
+    """
+    if size is None or not size[0] or not size[1]:
+        return None
+    limits = rule["limits"] + rule.get("shrink_limits", [])
+    cap_w = max(w for w, _ in limits)
+    cap_h = max(h for _, h in limits)
+    return size[0] / float(size[1]), min(size[0], cap_w), min(size[1], cap_h)
+
+
+@lru_cache(maxsize=1024)
+def _solve(layout, rule_index, keys):
+    rule = LAYOUT_RULES.get(layout, LAYOUT_RULES["default"])[rule_index]
+
+    def fit_all(limits):
+        return [
+            fit_box(key[0] if key else None, key[1:] if key else None, max_w, max_h)
+            for key, (max_w, max_h) in zip(keys, limits)
+        ]
+
+    boxes = fit_all(rule["limits"])
+
+    if "shrink_above" in rule and max(h for _, h in boxes) > rule["shrink_above"]:
+        boxes = fit_all(rule["shrink_limits"])
+
+    if "stack_within" in rule:
+        total_needed = sum(h for _, h in boxes) + GAP * (len(boxes) - 1)
+        if total_needed > rule["stack_within"]:
+            scale = rule["stack_within"] / float(total_needed)
+            boxes = [(int(w * scale), int(h * scale)) for w, h in boxes]
+
+    return tuple(boxes)
+
+
+def solve_layout(layout, sizes):
+    """
+    Solve every slot of a layout in one pass.
+    sizes: dict slot -> (width, height) pixel size (missing/None = empty slot).
+    Returns dict slot -> (width, height) in points for the slots the chosen rule
+    places; empty dict when nothing can be placed.
+    """
+    present = {slot for slot, size in sizes.items() if size}
+    index, rule = select_rule(layout, present)
+    if rule is None:
+        return {}
+    keys = tuple(_slot_key(sizes[slot], rule) for slot in rule["slots"])
+    return dict(zip(rule["slots"], _solve(layout, index, keys)))
@@ -0,0 +1,200 @@
+"""
+Offline batch generation, without going through the HTTP view.
+
+The manifest is JSON Lines, one document per line, using the form field names
+of /api/generate-pdf/ (file fields hold paths relative to the manifest):
+
+    {"id": "cert-0001", "layout": "UK88", "front_image": "scans/0001.jpg",
+     "document_type": "PASSPORT", "customer_name": "JANE DOE",
+     "schedule_date": "01/01/2025", "output": "0001.pdf"}
+
+multi_page_pdf may be a path or a list of paths; "id" defaults to the line
+number and "output" to "<id>.pdf", which must stay inside the output directory.
+Finished ids are appended to a checkpoint file in the output directory, and a
+rerun skips them unless --restart is given.
+
+    python manage.py batch_generate jobs.jsonl --output-dir out/ --workers 8
+
+--sign signs every output (see signing.py; entries may also carry "sign").
+The key is loaded once in this process before the pool starts, so forked
+workers share that one signer instead of reading the key per document.
+
+    python manage.py batch_generate jobs.jsonl --output-dir out/ --sign
+"""
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...workers import DiskUpload, init_process
+
+CHECKPOINT_NAME = ".batch_checkpoint.jsonl"
+
+# manifest key -> job key, for the file fields
+FILE_KEYS = (
+    ("front_image", "first_image"),
+    ("back_image", "back_image"),
+    ("front_image2", "first_image_2"),
+    ("back_image2", "back_image_2"),
+)
+
+
+def read_manifest(path):
+    entries = []
+    with open(path) as fh:
+        for number, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise CommandError(f"{path}:{number}: {e}")
+            entry["id"] = str(entry.get("id", number))
+            entries.append(entry)
+
+    ids = [entry["id"] for entry in entries]
+    if len(set(ids)) != len(ids):
+        raise CommandError("manifest ids must be unique")
+    return entries
+
+
+def read_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path) as fh:
+            content = fh.read()
+        for line in content.splitlines():
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                pass  # a line cut short by an interrupted run
+        if content and not content.endswith("\n"):
+            # terminate the cut line so the next record starts on its own
+            with open(path, "a") as fh:
+                fh.write("\n")
+    return done
+
+
+def output_path(output_dir, entry):
+    """Where an entry's PDF goes; raises CommandError when it resolves outside output_dir."""
+    root = os.path.realpath(output_dir)
+    target = os.path.realpath(os.path.join(root, entry.get("output") or f"{entry['id']}.pdf"))
+    if target == root or os.path.commonpath([root, target]) != root:
+        raise CommandError(f"{entry['id']}: output {target} is outside {root}")
+    return target
+
+
+def render_entry(entry, base_dir, output_dir, sign=False):
+    """Render one manifest entry in a pool worker; returns (id, output path, bytes, seconds)."""
+    from ...views import JOB_DEFAULTS, close_job_files, render_generate_job, validate_job
+
+    started = time.perf_counter()
+
+    def upload(relative):
+        path = os.path.join(base_dir, relative)
+        return DiskUpload(open(path, "rb"), name=os.path.basename(path))
+
+    multi = entry.get("multi_page_pdf") or []
+    job = {key: entry.get(key, default) for key, default in JOB_DEFAULTS.items()}
+    job.update({key: None for _, key in FILE_KEYS}, multi_page_files=[])
+    if sign:
+        job["sign"] = True
+
+    try:
+        # opened one by one into the job, so a missing path closes the ones before it
+        for field, key in FILE_KEYS:
+            if entry.get(field):
+                job[key] = upload(entry[field])
+        for path in [multi] if isinstance(multi, str) else multi:
+            job["multi_page_files"].append(upload(path))
+
+        buffer, _ = render_generate_job(validate_job(job))
+        target = output_path(output_dir, entry)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        buffer.seek(0)
+        with open(target + ".part", "wb") as out:
+            size = out.write(buffer.read())
+        os.replace(target + ".part", target)
+    finally:
+        close_job_files(job)
+
+    return entry["id"], target, size, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Generate documents from a JSON Lines manifest across a process pool, resumably."
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest")
+        parser.add_argument("--output-dir", default="batch_output")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+        parser.add_argument("--checkpoint", help=f"default: <output-dir>/{CHECKPOINT_NAME}")
+        parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and redo everything")
+        parser.add_argument("--sign", action="store_true", help="PAdES-sign every output (PDF_SIGNING_KEY/CERT)")
+
+    def handle(self, *args, **options):
+        if options["sign"]:
+            from ...signing import SigningUnavailable, pdf_signer
+            try:
+                pdf_signer()
+            except SigningUnavailable as e:
+                raise CommandError(f"--sign: {e}")
+
+        entries = read_manifest(options["manifest"])
+        base_dir = os.path.dirname(os.path.abspath(options["manifest"]))
+        output_dir = os.path.abspath(options["output_dir"])
+        os.makedirs(output_dir, exist_ok=True)
+        # refuse the whole manifest up front rather than write anywhere
+        for entry in entries:
+            output_path(output_dir, entry)
+
+        checkpoint_path = options["checkpoint"] or os.path.join(output_dir, CHECKPOINT_NAME)
+        if options["restart"] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        done = read_checkpoint(checkpoint_path)
+        pending = [entry for entry in entries if entry["id"] not in done]
+        self.stdout.write(f"{len(entries)} jobs, {len(entries) - len(pending)} already done, {len(pending)} to run")
+
+        started = time.perf_counter()
+        completed, failed, written, busy = 0, [], 0, 0.0
+        # keep a couple of jobs per worker in flight instead of submitting the whole manifest
+        in_flight_limit = options["workers"] * 2
+        queue = iter(pending)
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_process) as pool, \
+                open(checkpoint_path, "a") as checkpoint:
+            futures = {}
+            while True:
+                for entry in queue:
+                    futures[pool.submit(render_entry, entry, base_dir, output_dir, options["sign"])] = entry["id"]
+                    if len(futures) >= in_flight_limit:
+                        break
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job_id = futures.pop(future)
+                    try:
+                        _, target, size, seconds = future.result()
+                    except Exception as e:
+                        failed.append((job_id, e))
+                        self.stderr.write(f"{job_id}: {e}")
+                        continue
+                    checkpoint.write(json.dumps({"id": job_id, "output": target, "bytes": size}) + "\n")
+                    checkpoint.flush()
+                    completed += 1
+                    written += size
+                    busy += seconds
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"done {completed}, failed {len(failed)} in {elapsed:.1f}s "
+            f"({completed / elapsed if elapsed else 0:.1f} docs/s, {options['workers']} workers); "
+            f"{written / (1024 * 1024):.1f} MB written, "
+            f"{busy / completed if completed else 0:.3f}s per document"
+        )
+        if failed:
+            raise CommandError(f"{len(failed)} jobs failed; rerun to retry them")
@@ -0,0 +1,243 @@
+"""
+Load generator for /api/generate-pdf/ with a worker-count sweep.
+
+Every (processes, threads) pair of the sweep is one run: that many client
+processes with that many threads each replay a weighted mix of layouts with
+synthetic card uploads, either through an in-process Django test client (the
+default; the render runs inside the client processes, which is what the sweep
+measures) or against a running server with --url. With --rate the requests are
+paced open-loop and latency counts from the scheduled send time, so a saturated
+server shows up as latency instead of a silently lower request rate. The
+max RSS column is the client processes' (so the renderer's in-process only).
+
+    python manage.py loadtest --duration 20 --threads 1,2,4 --processes 1,2
+    python manage.py loadtest --url http://127.0.0.1:8000 --rate 10 --mix UK88:3,ONENOTARY:1
+"""
+import io
+import itertools
+import multiprocessing
+import random
+import resource
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+MULTIPAGE_LAYOUTS = ("UK88_MULTIPAGE", "us_multipage", "non_multipage")
+
+
+def parse_mix(text):
+    mix = []
+    for item in text.split(","):
+        layout, _, weight = item.partition(":")
+        mix.append((layout.strip(), float(weight or 1)))
+    return mix
+
+
+def synthetic_uploads(image_size, pdf_pages):
+    from ...warmup import dummy_card, dummy_pdf
+
+    return {
+        "front_image": ("front.jpg", dummy_card(image_size).getvalue()),
+        "back_image": ("back.jpg", dummy_card(image_size, color=(40, 40, 180)).getvalue()),
+        "multi_page_pdf": ("doc.pdf", dummy_pdf(pdf_pages).getvalue()),
+    }
+
+
+def request_fields(layout, number):
+    return {
+        "layout": layout,
+        "document_type": "PASSPORT",
+        "customer_name": f"LOAD TEST {number}",
+        "schedule_date": "01/01/2025",
+        "qr_text": f"loadtest-{number}",
+    }
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode()
+        )
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+class InProcessTarget:
+    """Posts through django.test.Client; one per thread."""
+
+    def __init__(self, endpoint):
+        from django.test import Client
+
+        self.client = Client(SERVER_NAME="localhost")
+        self.endpoint = endpoint
+
+    def post(self, fields, files):
+        payload = dict(fields)
+        for name, (filename, data) in files.items():
+            upload = io.BytesIO(data)
+            upload.name = filename
+            payload[name] = upload
+        response = self.client.post(self.endpoint, payload)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+
+
+class HTTPTarget:
+
+    def __init__(self, url, endpoint, timeout):
+        self.url = url.rstrip("/") + endpoint
+        self.timeout = timeout
+
+    def post(self, fields, files):
+        body, content_type = encode_multipart(fields, files)
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def run_client_process(config):
+    """One client process: config["threads"] threads until the deadline; returns raw samples."""
+    uploads = synthetic_uploads(config["image_size"], config["pdf_pages"])
+    layouts, weights = zip(*config["mix"])
+    deadline = time.perf_counter() + config["warmup"] + config["duration"]
+    measure_from = time.perf_counter() + config["warmup"]
+    # open-loop pacing: every thread owns an equal share of the target rate
+    interval = config["threads"] * config["processes"] / config["rate"] if config["rate"] else 0
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+
+    def client_thread(seed):
+        rng = random.Random(seed)
+        if config["url"]:
+            target = HTTPTarget(config["url"], config["endpoint"], config["timeout"])
+        else:
+            target = InProcessTarget(config["endpoint"])
+        next_send = time.perf_counter() + rng.random() * interval
+        for number in itertools.count():
+            now = time.perf_counter()
+            if interval:
+                if next_send > now:
+                    time.sleep(next_send - now)
+                scheduled, next_send = next_send, next_send + interval
+            else:
+                scheduled = now
+            if scheduled >= deadline:
+                return
+
+            layout = rng.choices(layouts, weights)[0]
+            files = {name: uploads[name] for name in ("front_image", "back_image")}
+            if layout in MULTIPAGE_LAYOUTS:
+                files["multi_page_pdf"] = uploads["multi_page_pdf"]
+            try:
+                status = target.post(request_fields(layout, number), files)
+            except Exception as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - scheduled
+
+            if scheduled >= measure_from:
+                with lock:
+                    latencies.append(latency)
+                    statuses[status] += 1
+
+    threads = [
+        threading.Thread(target=client_thread, args=(config["seed"] * 1000 + index,))
+        for index in range(config["threads"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "latencies": latencies,
+        "statuses": dict(statuses),
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+class Command(BaseCommand):
+    help = "Replay a layout mix against generate-pdf and sweep client process/thread counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="running server to target, e.g. http://127.0.0.1:8000 (default: in-process)")
+        parser.add_argument("--endpoint", default="/api/generate-pdf/")
+        parser.add_argument("--mix", default="ONENOTARY:2,UK88:2,default:2,UK88_MULTIPAGE:1,us_multipage:1",
+                            help="layout:weight,...")
+        parser.add_argument("--threads", default="1,2,4", help="thread counts to sweep")
+        parser.add_argument("--processes", default="1", help="process counts to sweep")
+        parser.add_argument("--rate", type=float, default=0, help="target requests/s per run (0: closed loop)")
+        parser.add_argument("--duration", type=float, default=10, help="measured seconds per run")
+        parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before each run")
+        parser.add_argument("--image-size", default="1600x1000", help="synthetic card size in pixels")
+        parser.add_argument("--pdf-pages", type=int, default=3)
+        parser.add_argument("--timeout", type=float, default=60)
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options["mix"])
+            image_size = tuple(int(v) for v in options["image_size"].lower().split("x"))
+        except ValueError as e:
+            raise CommandError(f"bad --mix or --image-size: {e}")
+
+        target = options["url"] or "in-process client"
+        self.stdout.write(f"{options['endpoint']} via {target}, mix {options['mix']}, "
+                          f"{options['duration']:.0f}s per run" + (f" at {options['rate']} req/s" if options["rate"] else ""))
+        self.stdout.write(f"{'procs':>5} {'threads':>7} {'reqs':>6} {'err%':>6} {'req/s':>7} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max RSS MB':>10}")
+
+        # fork: clients start with Django already set up by manage.py
+        context = multiprocessing.get_context("fork")
+        for processes, threads in itertools.product(int_list(options["processes"]), int_list(options["threads"])):
+            configs = [
+                {
+                    "url": options["url"], "endpoint": options["endpoint"], "mix": mix,
+                    "threads": threads, "processes": processes, "rate": options["rate"],
+                    "duration": options["duration"], "warmup": options["warmup"],
+                    "image_size": image_size, "pdf_pages": options["pdf_pages"],
+                    "timeout": options["timeout"], "seed": seed,
+                }
+                for seed in range(processes)
+            ]
+            with context.Pool(processes) as pool:
+                results = pool.map(run_client_process, configs)
+
+            latencies = [value for result in results for value in result["latencies"]]
+            statuses = sum((Counter(result["statuses"]) for result in results), Counter())
+            total = sum(statuses.values())
+            errors = total - statuses.get(200, 0)
+            self.stdout.write(
+                f"{processes:>5} {threads:>7} {total:>6} {100.0 * errors / total if total else 0:>6.1f} "
+                f"{total / options['duration']:>7.2f} "
+                f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+                f"{max(result['max_rss_kib'] for result in results) / 1024:>10.1f}"
+            )
+            if errors:
+                self.stdout.write(f"      statuses: {dict(statuses)}")
@@ -0,0 +1,113 @@
+"""
+Signing overhead per document: renders a job the way generate-pdf does, then
+times sign_pdf on the result, once cold (key and certificate loaded, signer
+built) and then warm (the cached signer, as every later request sees it).
+
+Uses the configured PDF_SIGNING_KEY / PDF_SIGNING_CERT, or a throwaway
+self-signed RSA key when none is set.
+
+    python manage.py sign_benchmark --runs 20 --layout UK88
+    python manage.py sign_benchmark --layout UK88_MULTIPAGE --pages 50
+"""
+import datetime
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def throwaway_credentials(folder):
+    """Write a self-signed RSA-2048 key and certificate (PEM) into folder; returns their paths."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "sign_benchmark")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=True, key_encipherment=False, data_encipherment=False,
+            key_agreement=False, key_cert_sign=False, crl_sign=False, encipher_only=False, decipher_only=False,
+        ), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    key_path, cert_path = os.path.join(folder, "key.pem"), os.path.join(folder, "cert.pem")
+    with open(key_path, "wb") as fh:
+        fh.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+        ))
+    with open(cert_path, "wb") as fh:
+        fh.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+
+class Command(BaseCommand):
+    help = "Measure the per-document cost of PAdES signing generated PDFs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument("--layout", default="UK88")
+        parser.add_argument("--pages", type=int, default=10, help="multipage upload size for multipage layouts")
+
+    def handle(self, *args, **options):
+        from ...signing import pdf_signer, sign_pdf, signers
+
+        if signers is None:
+            raise CommandError("pyhanko is not installed (pip install pyhanko)")
+
+        with tempfile.TemporaryDirectory() as folder:
+            if not (getattr(settings, "PDF_SIGNING_KEY", None) and getattr(settings, "PDF_SIGNING_CERT", None)):
+                settings.PDF_SIGNING_KEY, settings.PDF_SIGNING_CERT = throwaway_credentials(folder)
+                settings.PDF_SIGNING_CHAIN = ()
+                settings.PDF_SIGNING_KEY_PASSPHRASE = None
+                self.stdout.write("no signing key configured, using a throwaway self-signed RSA-2048 key")
+            pdf_signer.cache_clear()
+
+            render_times = []
+            for _ in range(options["runs"]):
+                started = time.perf_counter()
+                buffer = self.render(options["layout"], options["pages"])
+                render_times.append(time.perf_counter() - started)
+            unsigned = buffer.getvalue()
+
+            started = time.perf_counter()
+            signed = sign_pdf(io.BytesIO(unsigned)).getvalue()
+            cold = time.perf_counter() - started
+
+            sign_times = []
+            for _ in range(options["runs"]):
+                started = time.perf_counter()
+                sign_pdf(io.BytesIO(unsigned))
+                sign_times.append(time.perf_counter() - started)
+
+        render = statistics.median(render_times)
+        warm = statistics.median(sign_times)
+        self.stdout.write(f"layout {options['layout']}, median of {options['runs']} runs")
+        self.stdout.write(f"render (unsigned)   {render * 1000:8.1f} ms   {len(unsigned) / 1024:8.1f} KB")
+        self.stdout.write(f"sign, first         {cold * 1000:8.1f} ms   (key load + signer setup)")
+        self.stdout.write(f"sign, cached signer {warm * 1000:8.1f} ms   +{(len(signed) - len(unsigned)) / 1024:.1f} KB")
+        self.stdout.write(f"signing overhead    {warm / render * 100:8.1f} % of a render")
+
+    def render(self, layout, pages):
+        from ...views import JOB_DEFAULTS, render_generate_job, validate_job
+        from ...warmup import dummy_card, dummy_pdf
+        from django.core.files import File
+
+        job = dict(JOB_DEFAULTS, layout=layout, document_type="PASSPORT", customer_name="JANE DOE",
+                   schedule_date="01/01/2025", sign=False)
+        job["first_image"] = File(dummy_card(), name="front.jpg")
+        job["back_image"] = File(dummy_card(color=(40, 40, 180)), name="back.jpg")
+        job["first_image_2"] = job["back_image_2"] = None
+        job["multi_page_files"] = [File(dummy_pdf(pages), name="doc.pdf")] if "multipage" in layout.lower() else []
+        buffer, _ = render_generate_job(validate_job(job))
+        return buffer
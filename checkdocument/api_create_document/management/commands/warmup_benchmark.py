@@ -0,0 +1,76 @@
+"""
+Cold vs warm worker startup: each run is a fresh interpreter that sets Django up
+(with or without warmup.warm_up), then times the first and second requests to
+/api/generate-pdf/ through the test client.
+
+    python manage.py warmup_benchmark --runs 5 --layout UK88
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+RUN_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from django.conf import settings
+settings.WARMUP_ON_READY = sys.argv[1] == "warm"
+import django
+django.setup()
+ready = time.perf_counter()
+
+from django.test import Client
+from api_create_document.warmup import dummy_card
+client = Client(SERVER_NAME="localhost")
+settings.ALLOWED_HOSTS = ["localhost"]
+
+def request():
+    t = time.perf_counter()
+    response = client.post("/api/generate-pdf/", {
+        "front_image": dummy_card(), "back_image": dummy_card(color=(40, 40, 180)),
+        "layout": sys.argv[2], "document_type": "PASSPORT", "customer_name": "JANE DOE",
+        "schedule_date": "01/01/2025",
+    })
+    b"".join(response.streaming_content)
+    assert response.status_code == 200, response.status_code
+    return time.perf_counter() - t
+
+first = request()
+second = request()
+print(json.dumps({"startup": ready - started, "first": first, "second": second}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Compare first-request latency of cold and warmed-up worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="fresh processes per mode")
+        parser.add_argument("--layout", default="ONENOTARY")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "checkdocument.settings"))
+        results = {}
+        for mode in ("cold", "warm"):
+            runs = []
+            for _ in range(options["runs"]):
+                proc = subprocess.run(
+                    [sys.executable, "-c", RUN_SCRIPT, mode, options["layout"]],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                )
+                if proc.returncode != 0:
+                    self.stderr.write(proc.stderr)
+                    return
+                runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            results[mode] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+        self.stdout.write(f"layout {options['layout']}, median of {options['runs']} fresh processes (ms)")
+        self.stdout.write(f"{'':6} {'startup':>9} {'1st req':>9} {'2nd req':>9}")
+        for mode, row in results.items():
+            self.stdout.write(f"{mode:6} {row['startup'] * 1000:9.1f} {row['first'] * 1000:9.1f} {row['second'] * 1000:9.1f}")
+        saved = results["cold"]["first"] - results["warm"]["first"]
+        self.stdout.write(f"warm-up saves {saved * 1000:.1f} ms on the first request")
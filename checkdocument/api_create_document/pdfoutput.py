@@ -0,0 +1,86 @@
+"""
+Final serialization of generated PDFs.
+
+optimize_pdf is a lossless rewrite run on every response: merge_overlay and
+PdfMerger leave one copy of the template fonts and resource dictionaries per
+page and per appended PDF, which MuPDF's garbage collection merges back into one.
+
+Linearized ("fast web view") PDFs put the first page's objects and the hint
+tables first, so a browser or mail previewer can show page one while the rest
+of a long scan streams in. optimize_pdf(linearize=True) leaves the object
+streams to that same final save, linearize_pdf linearizes on its own. Both need
+pikepdf (qpdf, in requirements.txt); without it documents are served as they are.
+"""
+import logging
+from io import BytesIO
+
+import fitz
+from django.conf import settings
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def parse_flag(value):
+    """
+    A job flag: a form value ("1"/"true"/..., "0"/"false"/...) or a bool from a
+    batch manifest; None when unset or unrecognised (use the default).
+    """
+    if isinstance(value, bool):
+        return value
+    if value is not None and str(value).strip().lower() in TRUE_VALUES:
+        return True
+    if value is not None and str(value).strip().lower() in FALSE_VALUES:
+        return False
+    return None
+
+
+def wants_linearized(value, layout):
+    """The linearize flag of a job (see parse_flag), by default PDF_LINEARIZE_LAYOUTS."""
+    flag = parse_flag(value)
+    return layout in getattr(settings, "PDF_LINEARIZE_LAYOUTS", ()) if flag is None else flag
+
+
+def optimize_pdf(buffer, linearize=False):
+    """
+    Losslessly rewritten copy of a PDF buffer (rewound): identical objects and
+    streams (fonts, images, resource dictionaries) deduplicated, uncompressed
+    streams flate-compressed, small objects packed into object streams with a
+    compressed xref. Streams that are already compressed (JPEG images) are
+    copied as they are. With `linearize` (and pikepdf) MuPDF only deduplicates,
+    and the object streams are written by the linearizing save.
+    """
+    linearize = linearize and _has_pikepdf()
+    buffer.seek(0)
+    doc = fitz.open(stream=buffer.read(), filetype="pdf")
+    try:
+        out = BytesIO(doc.tobytes(garbage=4, deflate=True, use_objstms=0 if linearize else 1))
+    finally:
+        doc.close()
+    return linearize_pdf(out) if linearize else out
+
+
+def linearize_pdf(buffer):
+    """Linearized copy of a PDF buffer (rewound) with object streams, or the buffer itself without pikepdf."""
+    buffer.seek(0)
+    if not _has_pikepdf():
+        return buffer
+
+    out = BytesIO()
+    with pikepdf.open(buffer) as pdf:
+        pdf.save(out, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    out.seek(0)
+    return out
+
+
+def _has_pikepdf():
+    if pikepdf is None:
+        logger.warning("pikepdf not installed; serving the PDF without linearization")
+    return pikepdf is not None
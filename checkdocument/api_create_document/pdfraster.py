@@ -0,0 +1,415 @@
+"""
+Page rasterization helpers for compress_pdf_multipage.
+
+Every rendered page is classified with NumPy and gets the cheapest encoding
+that keeps it legible:
+
+    color   -> RGB JPEG
+    gray    -> 8-bit gray JPEG
+    bilevel -> 1-bit CCITT G4 (1-bit Flate if Pillow was built without libtiff)
+
+Pages are also classified by content (blank / text / photo) from a cheap
+probe render, which picks each page's resolution and JPEG quality
+(CONTENT_PROFILES) and lets blank separator pages be dropped.
+
+In MRC (mixed raster content) mode color/gray pages are split instead into a
+high-resolution 1-bit text mask and a low-resolution background (mrc_layers).
+
+Encoded images are plain dicts (see image_spec) and are written into the
+output as raw image XObjects, so fitz never decodes/re-encodes them. CCITT G4
+frames of TIFF uploads become specs directly (g4_frame_spec), without a decode.
+"""
+import zlib
+from io import BytesIO
+
+import fitz
+import numpy as np
+from PIL import Image, features
+
+from .layouts import exif_orientation
+
+# A page is "color" when more than COLOR_FRACTION of its pixels have a
+# channel spread above CHROMA_THRESHOLD (scanner noise stays well below it).
+CHROMA_THRESHOLD = 24
+COLOR_FRACTION = 0.005
+# A gray page is "bilevel" when almost nothing sits between ink and paper.
+MIDTONE_RANGE = (64, 192)
+MIDTONE_FRACTION = 0.06
+# Content: "blank" has (almost) no ink, "photo" has lots of midtones.
+BLANK_INK_LEVEL = 160
+BLANK_INK_FRACTION = 0.002
+PHOTO_MIDTONE_FRACTION = 0.2
+# Pages are classified from a render at this resolution (~0.5 MP for A4)
+PROBE_DPI = 72
+# Per-content resolution/quality, relative to the caller's dpi and quality
+CONTENT_PROFILES = {
+    "blank": {"dpi_scale": 0.5, "max_quality": 40},
+    "text": {"dpi_scale": 1.0, "max_quality": 100},
+    "photo": {"dpi_scale": 1.0, "max_quality": 70},
+}
+# MRC segmentation: a block is text-like when it has ink, is mostly paper and
+# has few in-between tones (photos are the opposite).
+MRC_BLOCK = 16
+MRC_MIN_PAPER = 0.4
+MRC_MAX_MIDTONES = 0.35
+
+
+# -----------------------
+# Pixmap access
+# -----------------------
+
+def pixmap_array(pix):
+    """Zero-copy (height, width, n) uint8 view of a fitz.Pixmap."""
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+
+def luminance(arr):
+    """Integer Rec.601 luma of an (h, w, 3) RGB array, or the array itself if gray."""
+    if arr.ndim == 2:
+        return arr
+    if arr.shape[2] == 1:
+        return arr[:, :, 0]
+    r, g, b = (arr[:, :, i].astype(np.uint16) for i in range(3))
+    return ((r * 77 + g * 150 + b * 29) >> 8).astype(np.uint8)
+
+
+# -----------------------
+# Classification
+# -----------------------
+
+def classify_page(arr, step=2):
+    """
+    Classify an (h, w, n) page render, straight from the pixmap samples.
+    Returns (kind, content):
+        kind    -> "color", "gray" or "bilevel" (how the page can be encoded)
+        content -> "blank", "text" or "photo" (how much resolution/quality it needs)
+    Works on every `step`-th pixel; that is plenty for a page-level decision.
+    """
+    sample = arr[::step, ::step]
+
+    colorful = False
+    if sample.ndim == 3 and sample.shape[2] >= 3:
+        rgb = sample[:, :, :3]
+        chroma = rgb.max(axis=2) - rgb.min(axis=2)
+        colorful = np.count_nonzero(chroma > CHROMA_THRESHOLD) > COLOR_FRACTION * chroma.size
+
+    luma = luminance(sample)
+    low, high = MIDTONE_RANGE
+    midtones = np.count_nonzero((luma > low) & (luma < high))
+    ink = np.count_nonzero(luma < BLANK_INK_LEVEL)
+
+    if colorful:
+        kind = "color"
+    elif midtones <= MIDTONE_FRACTION * luma.size:
+        kind = "bilevel"
+    else:
+        kind = "gray"
+
+    if ink <= BLANK_INK_FRACTION * luma.size and not colorful:
+        content = "blank"
+    elif midtones > PHOTO_MIDTONE_FRACTION * luma.size:
+        content = "photo"
+    else:
+        content = "text"
+    return kind, content
+
+
+def page_settings(content, dpi, quality):
+    """(dpi, quality) to encode a page with, from CONTENT_PROFILES."""
+    profile = CONTENT_PROFILES[content]
+    return max(1, int(round(dpi * profile["dpi_scale"]))), min(quality, profile["max_quality"])
+
+
+def otsu_threshold(gray):
+    """Otsu's threshold of a uint8 gray array (vectorized over the 256-bin histogram)."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 128
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * levels)
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between)) + 1
+
+
+# -----------------------
+# MRC segmentation
+# -----------------------
+
+def mrc_layers(rgb, factor, block=MRC_BLOCK):
+    """
+    Split an (h, w, 3) high-resolution page render into MRC layers.
+
+    Returns (text_mask, background):
+        text_mask  -> bool (h, w), True where a pixel is ink inside a text-like block
+        background -> uint8 (h // factor, w // factor, 3), the page with the ink
+                      removed and each factor x factor cell averaged down
+    Everything is block-wise NumPy; no per-pixel Python loops.
+    """
+    height, width = rgb.shape[:2]
+    luma = luminance(rgb)
+    threshold = otsu_threshold(luma)
+    paper_level = (threshold + 255) // 2
+
+    # --- text mask: per-block ink / paper / midtone statistics ---
+    pad_h, pad_w = -height % block, -width % block
+    padded = np.pad(luma, ((0, pad_h), (0, pad_w)), constant_values=255)
+    blocks = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block)
+    dark = blocks < threshold
+    n = float(block * block)
+    dark_frac = dark.sum(axis=(1, 3)) / n
+    paper_frac = (blocks >= paper_level).sum(axis=(1, 3)) / n
+    midtone_frac = 1.0 - dark_frac - paper_frac
+    text_block = (dark_frac > 0) & (paper_frac >= MRC_MIN_PAPER) & (midtone_frac <= MRC_MAX_MIDTONES)
+    text_mask = (dark & text_block[:, None, :, None]).reshape(padded.shape)[:height, :width]
+
+    # --- background: average the non-ink pixels of each factor x factor cell ---
+    # (summed over the factor**2 strided offsets; much faster than reducing
+    # over the non-contiguous axes of a 5-d reshape)
+    crop_h, crop_w = height - height % factor, width - width % factor
+    ink = text_mask[:crop_h, :crop_w, None]
+    paper_only = np.where(ink, 0, rgb[:crop_h, :crop_w, :3])
+    sums = np.zeros((crop_h // factor, crop_w // factor, 3), dtype=np.uint32)
+    counts = np.zeros((crop_h // factor, crop_w // factor, 1), dtype=np.uint32)
+    for dy in range(factor):
+        for dx in range(factor):
+            sums += paper_only[dy::factor, dx::factor]
+            counts += ~ink[dy::factor, dx::factor]
+
+    # cells that are all ink take the page's paper colour
+    paper_pixels = rgb[::4, ::4, :3][luma[::4, ::4] >= paper_level]
+    paper = paper_pixels.mean(axis=0) if len(paper_pixels) else np.full(3, 255.0)
+    background = np.where(counts > 0, sums / np.maximum(counts, 1), paper)
+
+    return text_mask, np.clip(background, 0, 255).astype(np.uint8)
+
+
+# -----------------------
+# Encoders -> image specs
+# -----------------------
+
+def image_spec(width, height, data, filter_name, colorspace="DeviceGray", bpc=8, decode_parms=None, image_mask=False,
+               orientation=1):
+    """
+    Describe an already-encoded image stream (all that a PDF image XObject needs).
+    width/height are the stored pixels; orientation is their EXIF/TIFF
+    orientation (1-8), applied when the image is placed (see orientation_matrix).
+    """
+    return {
+        "width": width,
+        "height": height,
+        "data": data,
+        "filter": filter_name,
+        "colorspace": colorspace,
+        "bpc": bpc,
+        "decode_parms": decode_parms,
+        "image_mask": image_mask,
+        "orientation": orientation,
+    }
+
+
+def encode_jpeg(img, quality):
+    """JPEG-encode a PIL image (RGB or L) into an image spec."""
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    return image_spec(img.width, img.height, buf.getvalue(), "DCTDecode", colorspace)
+
+
+def encode_pixmap(pix, quality):
+    """
+    JPEG-encode a gray or RGB fitz.Pixmap. PIL only wraps the pixmap samples
+    (frombuffer, no copy) for libjpeg; MuPDF's own JPEG writer came out ~45%
+    larger (no chroma subsampling / Huffman optimization) and several times slower.
+    """
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    return encode_jpeg(img, quality)
+
+
+def jpeg_spec(data):
+    """Image spec for existing gray/RGB JPEG bytes (header and EXIF read only, no decode)."""
+    with Image.open(BytesIO(data)) as img:
+        colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+        return image_spec(img.width, img.height, data, "DCTDecode", colorspace, orientation=exif_orientation(img))
+
+
+def encode_bilevel(gray, threshold=None, image_mask=False):
+    """
+    Threshold a uint8 gray array to 1 bit and encode it as CCITT G4.
+    With image_mask=True the result is a stencil that paints the dark pixels.
+    """
+    if threshold is None:
+        threshold = otsu_threshold(gray)
+    return encode_bitmap(gray >= threshold, image_mask=image_mask)
+
+
+def encode_bitmap(white, image_mask=False):
+    """Encode a bool (h, w) array (True = white/unpainted) as CCITT G4 or 1-bit Flate."""
+    height, width = white.shape
+
+    if features.check("libtiff"):
+        data = _g4_bytes(Image.fromarray(white))
+        if data is not None:
+            parms = f"<< /K -1 /Columns {width} /Rows {height} /BlackIs1 true >>"
+            return image_spec(width, height, data, "CCITTFaxDecode", bpc=1, decode_parms=parms, image_mask=image_mask)
+
+    # Fallback: packed 1-bit rows, Flate compressed (1 = white for DeviceGray;
+    # for a stencil mask the default Decode paints 0 samples, i.e. the ink)
+    data = zlib.compress(np.packbits(white, axis=1).tobytes())
+    return image_spec(width, height, data, "FlateDecode", bpc=1, image_mask=image_mask)
+
+
+def _g4_bytes(bilevel_img):
+    """Raw CCITT G4 stream of a mode "1" image, taken from a single-strip TIFF."""
+    buf = BytesIO()
+    bilevel_img.save(buf, format="TIFF", compression="group4", strip_size=2 ** 31 - 1)
+    with Image.open(BytesIO(buf.getvalue())) as tiff:
+        offsets = tiff.tag_v2.get(273)
+        counts = tiff.tag_v2.get(279)
+    if not offsets or len(offsets) != 1:
+        return None
+    return buf.getvalue()[offsets[0]:offsets[0] + counts[0]]
+
+
+# -----------------------
+# TIFF input
+# -----------------------
+
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*")
+# baseline TIFF tags read for the G4 passthrough
+TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH = 256, 257
+TAG_COMPRESSION, TAG_PHOTOMETRIC, TAG_STRIP_OFFSETS = 259, 262, 273
+TAG_ORIENTATION, TAG_STRIP_BYTE_COUNTS, TAG_FILL_ORDER = 274, 279, 266
+COMPRESSION_G4 = 4
+
+
+def is_tiff(file):
+    """True for .tif/.tiff uploads, or any file starting with a TIFF header."""
+    if getattr(file, "name", "").lower().endswith((".tif", ".tiff")):
+        return True
+    try:
+        file.seek(0)
+        head = file.read(4)
+        file.seek(0)
+    except Exception:
+        return False
+    return head in TIFF_MAGIC
+
+
+def tiff_frames(file):
+    """
+    Yield the frames of a (multi-page) TIFF one at a time. It is the same PIL
+    image seeked to the next directory, so only the current frame is ever decoded.
+    """
+    file.seek(0)
+    with Image.open(file) as img:
+        for index in range(getattr(img, "n_frames", 1)):
+            img.seek(index)
+            yield img
+
+
+def g4_frame_spec(frame, file):
+    """
+    Image spec reusing a TIFF frame's CCITT G4 data as-is (no decode), or None
+    when the frame is not a single-strip, MSB-first G4 bitmap stored upright or
+    rotated (mirrored orientations need a decode).
+    """
+    tags = frame.tag_v2
+    if tags.get(TAG_COMPRESSION) != COMPRESSION_G4:
+        return None
+    offsets, counts = tags.get(TAG_STRIP_OFFSETS), tags.get(TAG_STRIP_BYTE_COUNTS)
+    if not offsets or len(offsets) != 1 or not counts:
+        return None
+    orientation = tags.get(TAG_ORIENTATION, 1)
+    if tags.get(TAG_FILL_ORDER, 1) != 1 or orientation not in ORIENTATION_ROTATION:
+        return None
+
+    file.seek(offsets[0])
+    data = file.read(counts[0])
+    # stored size; frame.size is already the displayed one for orientations 5-8
+    width, height = tags[TAG_IMAGE_WIDTH], tags[TAG_IMAGE_LENGTH]
+    # the codec codes 1 bits as black runs: 1 is ink for WhiteIsZero (0),
+    # paper for BlackIsZero (1)
+    black_is_1 = "true" if tags.get(TAG_PHOTOMETRIC, 0) == 1 else "false"
+    parms = f"<< /K -1 /Columns {width} /Rows {height} /BlackIs1 {black_is_1} >>"
+    return image_spec(width, height, data, "CCITTFaxDecode", bpc=1, decode_parms=parms, orientation=orientation)
+
+
+# -----------------------
+# Output
+# -----------------------
+
+def image_keys(spec):
+    """Image XObject dictionary entries for a spec, minus the stream keys."""
+    keys = [
+        "/Type /XObject",
+        "/Subtype /Image",
+        f"/Width {spec['width']}",
+        f"/Height {spec['height']}",
+    ]
+    if spec["image_mask"]:
+        keys.append("/ImageMask true")
+    else:
+        keys.append(f"/ColorSpace /{spec['colorspace']}")
+        keys.append(f"/BitsPerComponent {spec['bpc']}")
+    return keys
+
+
+def add_image(doc, spec):
+    """Write an image spec into a fitz document as a raw image XObject; returns its xref."""
+    keys = image_keys(spec)
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<< " + " ".join(keys) + " >>")
+    # update_stream drops any filter keys, so they are set afterwards
+    doc.update_stream(xref, spec["data"], compress=0)
+    doc.xref_set_key(xref, "Filter", "/" + spec["filter"])
+    if spec["decode_parms"]:
+        doc.xref_set_key(xref, "DecodeParms", spec["decode_parms"])
+    return xref
+
+
+# EXIF / TIFF orientations whose displayed width and height are swapped
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+# counter-clockwise rotation that shows stored pixels upright; the mirrored
+# orientations (2, 4, 5, 7) cannot be placed with a rotation alone
+ORIENTATION_ROTATION = {1: 0, 3: 180, 6: 270, 8: 90}
+
+
+def displayed_size(width, height, orientation):
+    """(width, height) of stored pixels as displayed under an EXIF orientation."""
+    return (height, width) if orientation in ROTATED_ORIENTATIONS else (width, height)
+
+
+def orientation_matrix(orientation, x, y, width, height):
+    """
+    PDF matrix (a, b, c, d, e, f) mapping an image's unit square, stored
+    pixels as they are, upright onto the displayed rect at (x, y) of
+    width x height points (PDF user space, origin bottom-left). The image
+    is never rotated in memory; this matrix does the EXIF orientation.
+    """
+    return {
+        2: (-width, 0, 0, height, x + width, y),
+        3: (-width, 0, 0, -height, x + width, y + height),
+        4: (width, 0, 0, -height, x, y + height),
+        5: (0, -height, -width, 0, x + width, y + height),
+        6: (0, -height, width, 0, x, y + height),
+        7: (0, height, width, 0, x, y),
+        8: (0, height, -width, 0, x + width, y),
+    }.get(orientation, (width, 0, 0, height, x, y))
+
+
+def fit_rect(page_rect, width, height):
+    """Largest rect with the image's aspect ratio, centered on the page."""
+    ratio = min(page_rect.width / width, page_rect.height / height)
+    new_width = width * ratio
+    new_height = height * ratio
+    x = page_rect.x0 + (page_rect.width - new_width) / 2
+    y = page_rect.y0 + (page_rect.height - new_height) / 2
+    return fitz.Rect(x, y, x + new_width, y + new_height)
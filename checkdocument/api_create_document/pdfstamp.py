@@ -0,0 +1,151 @@
+"""
+Stamps drawn on every page of multipage outputs (settings.PDF_STAMP_LAYOUTS).
+
+PyPDF2's merge_page copies the stamp's operators and resources into each
+page and rewrites every content stream. Here the stamp (a small one-page PDF
+drawn with reportlab: QR code, seal, ...) is embedded once as a form XObject.
+Each page only gains a name in its XObject resources and two content streams
+that every page of the same size shares:
+
+    q                                     before the page's own content, so
+                                          any graphics state it leaves is undone
+    Q q <a b c d e f> cm /<name> Do Q     after it
+
+so a 200-page document grows by about one stamp. Page numbers ("3 / 20") are
+optional and the only per-page content.
+"""
+from io import BytesIO
+
+import fitz
+
+PAGE_NUMBER_SIZE = 8
+PAGE_NUMBER_MARGIN = (36, 20)
+
+
+def stamp_pages(buffer, stamp, pages=slice(None), page_numbers=False):
+    """
+    Copy of a PDF buffer (rewound) with the one-page PDF `stamp` drawn in the
+    bottom-left corner of `pages` (a slice of the page list, e.g. slice(-1, None)
+    for the last page), upright on rotated pages too. page_numbers adds "n / N"
+    in the bottom-right corner of every page.
+    """
+    buffer.seek(0)
+    doc = fitz.open(stream=buffer.read(), filetype="pdf")
+    try:
+        name, form = _embed_stamp(doc, stamp)
+        font = _new_object(doc, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        opening = _new_stream(doc, b"q")
+        # closing stream per stamp placement (None: no stamp, just the Q)
+        closings = {}
+        stamped = set(range(doc.page_count)[pages])
+        numbered = set(range(doc.page_count) if page_numbers else ())
+
+        for number in sorted(stamped | numbered):
+            page = doc[number]
+            placement = None
+            if number in stamped:
+                _add_resource(doc, page, "XObject", name, form)
+                placement = _placement(page, 0, 0)
+            if placement not in closings:
+                draw = f" q {' '.join(f'{v:.4f}' for v in placement)} cm /{name} Do Q" if placement else ""
+                closings[placement] = _new_stream(doc, ("Q" + draw).encode())
+            streams = [closings[placement]]
+            if number in numbered:
+                _add_resource(doc, page, "Font", name + "F", font)
+                streams.append(_page_number_stream(doc, page, name + "F", number + 1, doc.page_count))
+            _wrap_contents(doc, page, opening, streams)
+
+        out = BytesIO(doc.tobytes(garbage=1))
+    finally:
+        doc.close()
+    return out
+
+
+def _embed_stamp(doc, stamp):
+    """Form XObject of the stamp's first page in doc; returns (resource name, xref)."""
+    src = fitz.open(stream=stamp.getvalue(), filetype="pdf")
+    try:
+        # insert_pdf grafts the page's resources into doc; the page itself is dropped again
+        doc.insert_pdf(src, from_page=0, to_page=0)
+        page = doc[-1]
+        width, height = page.rect.width, page.rect.height
+        content = page.read_contents()
+        resources = doc.xref_get_key(page.xref, "Resources")
+        form = _new_object(doc, (
+            f"<< /Type /XObject /Subtype /Form /BBox [0 0 {width:.4f} {height:.4f}] "
+            f"/Resources {resources[1] if resources[0] != 'null' else '<< >>'} >>"
+        ))
+        doc.update_stream(form, content)
+        doc.delete_page(-1)
+    finally:
+        src.close()
+    return f"Stamp{form}", form
+
+
+def _placement(page, x, y):
+    """
+    Matrix drawing form space upright with its origin at (x, y) from the
+    bottom-left corner of the page as displayed, in the page's own user space
+    (it undoes /Rotate and MediaBox offsets).
+    """
+    shown = fitz.Matrix(1, 0, 0, -1, x, page.rect.height - y)
+    m = shown * ~(page.transformation_matrix * page.rotation_matrix)
+    return (m.a, m.b, m.c, m.d, m.e, m.f)
+
+
+def _page_number_stream(doc, page, font, number, count):
+    text = f"{number} / {count}"
+    width = fitz.get_text_length(text, fontname="helv", fontsize=PAGE_NUMBER_SIZE)
+    x = page.rect.width - PAGE_NUMBER_MARGIN[0] - width
+    matrix = " ".join(f"{v:.4f}" for v in _placement(page, x, PAGE_NUMBER_MARGIN[1]))
+    return _new_stream(doc, f"q {matrix} cm BT /{font} {PAGE_NUMBER_SIZE} Tf 0 0 Td ({text}) Tj ET Q".encode())
+
+
+def _wrap_contents(doc, page, opening, streams):
+    """Set the page's /Contents to [opening, <its own streams>, *streams]."""
+    own = " ".join(f"{xref} 0 R" for xref in page.get_contents())
+    tail = " ".join(f"{xref} 0 R" for xref in streams)
+    doc.xref_set_key(page.xref, "Contents", f"[{opening} 0 R {own} {tail}]")
+
+
+def _add_resource(doc, page, kind, name, xref):
+    """
+    Add /<kind>/<name> to the page's resources. xref_set_key paths cannot pass
+    indirect objects, so shared (indirect) dictionaries are followed by hand
+    and updated in place.
+    """
+    if doc.xref_get_key(page.xref, "Resources")[0] == "null":
+        doc.xref_set_key(page.xref, "Resources", _inherited_resources(doc, page.xref))
+    holder, path = page.xref, "Resources"
+    for key in (None, kind):
+        lookup = f"{path}/{key}" if path and key else (path or key)
+        found, value = doc.xref_get_key(holder, lookup)
+        if found == "xref":
+            holder, path = int(value.split()[0]), ""
+        else:
+            path = lookup
+    doc.xref_set_key(holder, f"{path}/{name}" if path else name, f"{xref} 0 R")
+
+
+def _inherited_resources(doc, xref):
+    """Resources a page inherits from its page tree parents, as PDF source."""
+    while True:
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            return "<< >>"
+        xref = int(parent.split()[0])
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return value
+
+
+def _new_object(doc, source):
+    xref = doc.get_new_xref()
+    doc.update_object(xref, source)
+    return xref
+
+
+def _new_stream(doc, data):
+    xref = _new_object(doc, "<< >>")
+    doc.update_stream(xref, data)
+    return xref
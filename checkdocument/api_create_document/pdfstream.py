@@ -0,0 +1,95 @@
+"""
+Minimal page-at-a-time PDF writer.
+
+compress_pdf_multipage only ever produces pages made of pre-encoded image
+XObjects (see pdfraster.image_spec). This writer emits each page's images,
+content stream and page object to the output file as soon as the page is
+added, so nothing but the xref offsets is kept in memory, whatever the page
+count. The page tree, catalog and xref table are written by close().
+"""
+import zlib
+
+from .pdfraster import image_keys
+
+# object 1 is the catalog, object 2 the page tree; both are written last
+CATALOG_ID = 1
+PAGES_ID = 2
+
+
+class StreamingPDFWriter:
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = PAGES_ID + 1
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.fh.write(data)
+        self.position += len(data)
+
+    def _new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.position
+        self._write(f"{obj_id} 0 obj\n".encode())
+        self._write(body.encode() if isinstance(body, str) else body)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def add_image(self, spec):
+        """Write an image spec as an XObject; returns its object id."""
+        keys = image_keys(spec) + [f"/Filter /{spec['filter']}", f"/Length {len(spec['data'])}"]
+        if spec["decode_parms"]:
+            keys.append(f"/DecodeParms {spec['decode_parms']}")
+        obj_id = self._new_id()
+        self._write_object(obj_id, "<< " + " ".join(keys) + " >>", spec["data"])
+        return obj_id
+
+    def add_page(self, width, height, layers):
+        """
+        Write one page of `width` x `height` points.
+        layers: list of (image spec, fitz.Rect) drawn in order; rects use fitz's
+        top-left origin and are flipped to PDF user space here.
+        """
+        names = []
+        content = []
+        for index, (spec, rect) in enumerate(layers):
+            name = f"Im{index}"
+            names.append(f"/{name} {self.add_image(spec)} 0 R")
+            content.append(
+                f"q {rect.width:.4f} 0 0 {rect.height:.4f} {rect.x0:.4f} {height - rect.y1:.4f} cm /{name} Do Q"
+            )
+
+        data = zlib.compress("\n".join(content).encode())
+        content_id = self._new_id()
+        self._write_object(content_id, f"<< /Filter /FlateDecode /Length {len(data)} >>", data)
+
+        page_id = self._new_id()
+        self._write_object(
+            page_id,
+            f"<< /Type /Page /Parent {PAGES_ID} 0 R /MediaBox [0 0 {width:.4f} {height:.4f}] "
+            f"/Resources << /XObject << {' '.join(names)} >> >> /Contents {content_id} 0 R >>",
+        )
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """Write page tree, catalog, xref and trailer. The file handle stays open."""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._write_object(CATALOG_ID, f"<< /Type /Catalog /Pages {PAGES_ID} 0 R >>")
+
+        xref_position = self.position
+        size = self.next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, size)]
+        self._write("".join(lines).encode())
+        self._write(f"trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode())
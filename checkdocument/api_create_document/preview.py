@@ -0,0 +1,121 @@
+"""
+First-page PNG previews of a generate-pdf job.
+
+A preview runs the same layout code as render_generate_job minus what does not
+show on page one: cards are encoded at PREVIEW_MAX_DPI instead of
+CARD_TARGET_DPI, the multipage appendix is left out (non_multipage keeps it, its
+first page is the upload's own), and there is no size compression, optimisation
+or linearization. Two small LRU caches make repeated previews cheap:
+
+    decoded cards        by content hash, so the same uploads previewed in
+                         another layout skip the image decode
+    page display lists   by job, so the same job at another DPI only
+                         re-rasterizes the recorded page
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import fitz
+from django.conf import settings
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+
+from .layouts import box_to_pixels, oriented_size
+
+CARD_KEYS = ("first_image", "back_image", "first_image_2", "back_image_2")
+TEXT_KEYS = ("document_type", "layout", "customer_name", "qr_text", "schedule_date", "notary")
+
+_cards = OrderedDict()
+_pages = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cached(cache, key, build):
+    """Get-or-build in an LRU dict bounded by PREVIEW_CACHE_SIZE; build runs outside the lock."""
+    with _lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = build()
+    with _lock:
+        cache[key] = value
+        while len(cache) > getattr(settings, "PREVIEW_CACHE_SIZE", 32):
+            cache.popitem(last=False)
+    return value
+
+
+def upload_digest(upload):
+    upload.seek(0)
+    digest = hashlib.sha256(upload.read()).hexdigest()
+    upload.seek(0)
+    return digest
+
+
+def decoded_card(upload):
+    """
+    (PIL.Image, digest) of a card upload; PDF cards are passed through
+    undecoded. Images are kept at most A4 at PREVIEW_MAX_DPI, which is still
+    more pixels than points on the page, so the solved layout does not change.
+    """
+    if upload is None:
+        return None, None
+    if isinstance(upload, Image.Image):  # a further frame of a TIFF card
+        return upload, hashlib.sha256(upload.tobytes()).hexdigest()
+    from .views import load_image
+
+    digest = upload_digest(upload)
+    if upload.name.lower().endswith(".pdf"):
+        return upload, digest
+
+    def decode():
+        cap = box_to_pixels(A4, getattr(settings, "PREVIEW_MAX_DPI", 100))
+        img = load_image(upload, draft_size=cap)
+        if img is not None:
+            # stored pixels: the cap is turned along with a rotated photo
+            img.thumbnail(cap if oriented_size(img) == img.size else cap[::-1], Image.Resampling.LANCZOS)
+        return img
+
+    return _cached(_cards, digest, decode), digest
+
+
+def preview_multipage(files):
+    """The multipage input of a non_multipage preview, without the size compression pass."""
+    from .views import convert_images_to_pdf
+
+    if len(files) == 1 and files[0].name.lower().endswith(".pdf"):
+        return files[0]
+    return convert_images_to_pdf(files, force_compress=False)
+
+
+def render_preview(job, dpi):
+    """PNG bytes of the first page of a job from views.read_generate_request, at dpi (<= PREVIEW_MAX_DPI)."""
+    from .views import expand_card_frames
+
+    cards = [decoded_card(card) for card in expand_card_frames([job[key] for key in CARD_KEYS])]
+    multi_files = job["multi_page_files"] if job["layout"] == "non_multipage" else []
+    key = (
+        tuple(job[name] for name in TEXT_KEYS),
+        tuple(digest for _, digest in cards),
+        tuple(upload_digest(upload) for upload in multi_files),
+    )
+
+    def build():
+        from .views import render_document
+
+        buffer, _ = render_document(
+            *(card for card, _ in cards),
+            job["document_type"], job["layout"], preview_multipage(multi_files) if multi_files else None,
+            job["qr_text"], job["customer_name"], job["schedule_date"], job["notary"],
+            card_dpi=getattr(settings, "PREVIEW_MAX_DPI", 100), compress=False,
+        )
+        doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+        try:
+            return doc[0].get_displaylist()
+        finally:
+            doc.close()
+
+    display_list = _cached(_pages, key, build)
+    zoom = dpi / 72.0
+    pix = display_list.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pix.tobytes("png")
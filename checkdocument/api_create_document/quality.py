@@ -0,0 +1,31 @@
+"""
+Size/quality defaults of every encoder in the app, in one place.
+
+Any key can be overridden with settings.OUTPUT_QUALITY = {"key": value}. The
+regression suite in tests.py (golden renders + per-layout byte budgets) is
+what a change here has to pass.
+"""
+from django.conf import settings
+
+QUALITY_DEFAULTS = {
+    # card photos, encoded for the box they are drawn in (prepare_image)
+    "card_jpeg_quality": 90,
+    # background derivative of an uploaded image asset (assets.py)
+    "asset_jpeg_quality": 90,
+    # multipage pages from images / PDFs (convert_images_to_pdf); "forced" is
+    # the second pass when the first came out above compress_threshold_mb,
+    # which also downscales to PAGE_TARGET_DPI
+    "page_jpeg_quality": 75,
+    "forced_page_jpeg_quality": 90,
+    # an uploaded multipage PDF above compress_threshold_mb (compress_pdf_multipage)
+    "upload_compress_dpi": 100,
+    "upload_compress_quality": 100,
+    # a finished multipage document above compress_threshold_mb
+    "output_compress_dpi": 100,
+    "output_compress_quality": 80,
+    "compress_threshold_mb": 5,
+}
+
+
+def quality_setting(key):
+    return getattr(settings, "OUTPUT_QUALITY", {}).get(key, QUALITY_DEFAULTS[key])
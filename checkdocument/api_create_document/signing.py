@@ -0,0 +1,139 @@
+"""
+PAdES signatures on generated documents.
+
+sign_pdf appends a PAdES baseline (B-B) signature to a finished PDF as an
+incremental update. The rendered bytes are kept exactly as they are, and a new
+invisible signature field plus the CMS signature follow them, so it is the
+last step, after optimize_pdf. That update would end a linearized file's fast
+web view, so jobs that get signed are not linearized (views.validate_job).
+
+The key and certificate chain are read from disk once per process, and the
+configured pyhanko PdfSigner is cached with them, together with the parsed
+private key (LoadedKeySigner) and the signature size (_reserved_bytes). Each
+document then only costs its hash and one private-key operation, and
+batch_generate --sign reuses that one signer for every document of a worker.
+It needs pyhanko (requirements.txt); without it, or without PDF_SIGNING_KEY /
+PDF_SIGNING_CERT, documents are served unsigned.
+"""
+import asyncio
+import logging
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+
+from .pdfoutput import parse_flag
+
+logger = logging.getLogger(__name__)
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding
+    from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+    from pyhanko.sign import fields, signers
+    from pyhanko.sign.general import get_pyca_cryptography_hash
+except ImportError:
+    signers = None
+
+
+if signers is not None:
+    class LoadedKeySigner(signers.SimpleSigner):
+        """
+        SimpleSigner parses its private key from DER again for every signature
+        (about 50 ms for RSA-2048, more than the signature itself). This one
+        keeps the parsed key; mechanisms other than RSA PKCS#1 v1.5 and ECDSA
+        go through SimpleSigner unchanged.
+        """
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.private_key = serialization.load_der_private_key(self.signing_key.dump(), password=None)
+
+        def sign_raw(self, data, digest_algorithm):
+            mechanism = self.get_signature_mechanism_for_digest(digest_algorithm).signature_algo
+            hash_algo = get_pyca_cryptography_hash(digest_algorithm)
+            if mechanism == "rsassa_pkcs1v15":
+                return self.private_key.sign(data, padding.PKCS1v15(), hash_algo)
+            if mechanism == "ecdsa":
+                return self.private_key.sign(data, ec.ECDSA(hash_algo))
+            return super().sign_raw(data, digest_algorithm)
+
+
+class SigningUnavailable(Exception):
+    """Signing was asked for but pyhanko or the key/certificate is missing."""
+
+
+def signing_configured():
+    return bool(getattr(settings, "PDF_SIGNING_KEY", None) and getattr(settings, "PDF_SIGNING_CERT", None))
+
+
+def wants_signed(value, layout):
+    """The sign flag of a job (see pdfoutput.parse_flag), by default PDF_SIGNING_LAYOUTS once a key is configured."""
+    flag = parse_flag(value)
+    if flag is None:
+        return signing_configured() and layout in getattr(settings, "PDF_SIGNING_LAYOUTS", ())
+    return flag
+
+
+@lru_cache(maxsize=1)
+def pdf_signer():
+    """
+    The process-wide (PdfSigner, bytes reserved for the signature): key,
+    certificate chain and signature metadata, loaded on first use. Raises
+    SigningUnavailable when signing is not set up.
+    """
+    if signers is None:
+        raise SigningUnavailable("pyhanko not installed")
+    if not signing_configured():
+        raise SigningUnavailable("PDF_SIGNING_KEY and PDF_SIGNING_CERT are not set")
+
+    passphrase = getattr(settings, "PDF_SIGNING_KEY_PASSPHRASE", None)
+    signer = signers.SimpleSigner.load(
+        settings.PDF_SIGNING_KEY, settings.PDF_SIGNING_CERT,
+        ca_chain_files=tuple(getattr(settings, "PDF_SIGNING_CHAIN", ())) or None,
+        key_passphrase=passphrase.encode() if isinstance(passphrase, str) else passphrase,
+    )
+    if signer is None:
+        raise SigningUnavailable("could not load the signing key or certificate")
+    signer = LoadedKeySigner(
+        signing_cert=signer.signing_cert, signing_key=signer.signing_key, cert_registry=signer.cert_registry,
+    )
+    meta = signers.PdfSignatureMetadata(
+        field_name=getattr(settings, "PDF_SIGNING_FIELD", "NotarySignature"),
+        md_algorithm="sha256",
+        subfilter=fields.SigSeedSubFilter.PADES,
+        reason=getattr(settings, "PDF_SIGNING_REASON", None),
+        location=getattr(settings, "PDF_SIGNING_LOCATION", None),
+    )
+    return signers.PdfSigner(meta, signer), _reserved_bytes(signer)
+
+
+def _reserved_bytes(signer):
+    """
+    Room for the CMS signature in the /Contents placeholder (hex, so twice its
+    DER size). pyhanko otherwise works this out with a dummy signature before
+    every real one; without a timestamp server the size only depends on the
+    key and certificates, so one dry run is enough. The margin is pyhanko's.
+    """
+    dummy = asyncio.run(signer.async_sign(bytes(32), "sha256", dry_run=True, use_pades=True))
+    length = len(dummy.dump()) * 2
+    return length + 2 * (length // 4)
+
+
+def sign_pdf(buffer):
+    """
+    Signed copy of a PDF buffer (rewound): the original bytes followed by an
+    incremental update carrying the signature. Returns the buffer itself when
+    signing is not available.
+    """
+    buffer.seek(0)
+    try:
+        signer, reserved = pdf_signer()
+    except SigningUnavailable as e:
+        logger.warning("Serving the PDF unsigned: %s", e)
+        return buffer
+
+    out = BytesIO()
+    signer.sign_pdf(IncrementalPdfFileWriter(buffer, strict=False), output=out, bytes_reserved=reserved)
+    out.seek(0)
+    return out
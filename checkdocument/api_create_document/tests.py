@@ -1,3 +1,1004 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+import fitz
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageDraw, ImageFont
 
 # Create your tests here.
+
+# Runs compress_pdf_streaming in a fresh interpreter and prints its peak RSS (KiB)
+COMPRESS_RSS_SCRIPT = """
+import resource, sys
+import django
+django.setup()
+from django.test import override_settings
+from api_create_document.views import compress_pdf_streaming
+# a small spool so the (bounded) in-memory output does not hide growth elsewhere
+with override_settings(PDF_STREAM_SPOOL_SIZE=256 * 1024):
+    out = compress_pdf_streaming(sys.argv[1], dpi=50, bilevel_dpi=100)
+out.close()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def build_scan(path, page_count):
+    """Alternate text-only and color pages, like a mixed scan."""
+    doc = fitz.open()
+    for number in range(page_count):
+        page = doc.new_page()
+        for line in range(30):
+            page.insert_text((50, 60 + line * 24), f"Page {number} line {line} lorem ipsum dolor sit amet", fontsize=11)
+        if number % 2:
+            page.draw_rect(fitz.Rect(100, 400, 500, 700), color=(0.8, 0.2, 0.1), fill=(0.2, 0.5, 0.8))
+    doc.save(path)
+    doc.close()
+
+
+class StreamingCompressionMemoryTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.small = os.path.join(cls.tmpdir.name, "small.pdf")
+        cls.large = os.path.join(cls.tmpdir.name, "large.pdf")
+        build_scan(cls.small, 10)
+        build_scan(cls.large, 500)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+        super().tearDownClass()
+
+    def peak_rss_kib(self, path):
+        result = subprocess.run(
+            [sys.executable, "-c", COMPRESS_RSS_SCRIPT, path],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE="checkdocument.settings"),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return int(result.stdout.split()[-1])
+
+    def test_peak_rss_flat_in_page_count(self):
+        small_peak = self.peak_rss_kib(self.small)
+        large_peak = self.peak_rss_kib(self.large)
+        # 50x the pages may cost the xref offsets and page tree, not the pages themselves
+        self.assertLess(large_peak - small_peak, 12 * 1024, (small_peak, large_peak))
+
+
+# -----------------------
+# Output regression budgets
+# -----------------------
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "testdata", "golden")
+GOLDEN_DPI = 30
+# mean absolute difference per pixel (0-255), and share of pixels off by more
+# than 24 (moved text/cards); JPEG quality 60 cards stay well inside, 5 does not
+GOLDEN_MEAN_TOLERANCE = 0.6
+GOLDEN_OUTLIER_TOLERANCE = 0.005
+
+# Upper bound on output bytes per case, about 15% over what the current
+# encoders produce; tighten it when a change makes a case smaller
+BYTE_BUDGETS = {
+    "ONENOTARY": 117_000,
+    "UK88": 197_000,
+    "UK88_MULTIPAGE": 228_000,
+    "us_multipage": 192_000,
+    "non_multipage": 147_000,
+    "default": 108_000,
+    "compress_auto": 415_000,
+    "compress_mrc": 335_000,
+}
+
+
+def regression_card(seed, size=(1600, 1000)):
+    """Deterministic photo-like card: gradient, shapes and text, as JPEG."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    base = rng.integers(60, 200, 3)
+    pixels = np.stack([(base[c] + 50 * np.sin(x / (90 + 30 * c)) + 40 * np.cos(y / 70)) for c in range(3)], -1)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((80, 80, 500, 600), fill=(235, 225, 210), outline=(20, 20, 20), width=6)
+    for line in range(8):
+        draw.text((600, 120 + line * 90), f"FIELD {seed}-{line} ABCDEFGHIJKLMNOP", fill=(10, 10, 10))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92)
+    buf.seek(0)
+    buf.name = f"card{seed}.jpg"
+    return buf
+
+
+def regression_scan():
+    """Three-page scan: text only, text with a color photo, and a gray gradient page."""
+    doc = fitz.open()
+    for number in range(3):
+        page = doc.new_page()
+        for line in range(30):
+            page.insert_text((50, 60 + line * 24), f"Page {number} line {line} lorem ipsum dolor sit amet", fontsize=11)
+        if number == 1:
+            page.insert_image(fitz.Rect(100, 380, 500, 630), stream=regression_card(7).getvalue())
+        if number == 2:
+            ramp = np.tile(np.linspace(40, 220, 400, dtype=np.uint8), (250, 1))
+            buf = io.BytesIO()
+            Image.fromarray(ramp).save(buf, format="PNG")
+            page.insert_image(fitz.Rect(100, 380, 500, 630), stream=buf.getvalue())
+    buf = io.BytesIO(doc.tobytes())
+    doc.close()
+    buf.name = "scan.pdf"
+    return buf
+
+
+def render_case(case):
+    """PDF bytes of one regression case, from fixed inputs, as render_generate_job serves it."""
+    from .pdfoutput import optimize_pdf
+    from .views import compress_pdf_multipage, render_document
+
+    if case.startswith("compress_"):
+        output = compress_pdf_multipage(regression_scan(), mode=case.split("_", 1)[1])
+    else:
+        output, _ = render_document(
+            regression_card(1), regression_card(2), regression_card(3), regression_card(4),
+            "PASSPORT", case, regression_scan(), "REGRESSION QR", "JANE REGRESSION", "01/01/2025",
+        )
+        output = optimize_pdf(output)
+    output.seek(0)
+    return output.read()
+
+
+def page_renders(data):
+    doc = fitz.open(stream=data, filetype="pdf")
+    try:
+        return [
+            np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width)
+            for pix in (page.get_pixmap(dpi=GOLDEN_DPI, colorspace=fitz.csGRAY) for page in doc)
+        ]
+    finally:
+        doc.close()
+
+
+class OutputRegressionTests(SimpleTestCase):
+    """
+    Every layout (and both compression modes) against committed low-DPI golden
+    renders and a byte budget. After an intended visual change, regenerate the
+    goldens with UPDATE_GOLDEN=1 python manage.py test api_create_document.
+    """
+
+    def check_case(self, case):
+        data = render_case(case)
+        renders = page_renders(data)
+
+        if os.environ.get("UPDATE_GOLDEN"):
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            for name in os.listdir(GOLDEN_DIR):
+                if name.startswith(f"{case}-"):
+                    os.remove(os.path.join(GOLDEN_DIR, name))
+            for number, render in enumerate(renders, 1):
+                Image.fromarray(render).save(os.path.join(GOLDEN_DIR, f"{case}-{number}.png"), optimize=True)
+            print(f"{case}: {len(data)} bytes, {len(renders)} pages")
+            return
+
+        golden_pages = sorted(name for name in os.listdir(GOLDEN_DIR) if name.startswith(f"{case}-"))
+        self.assertEqual(len(renders), len(golden_pages), "page count")
+        for number, render in enumerate(renders, 1):
+            golden = np.asarray(Image.open(os.path.join(GOLDEN_DIR, f"{case}-{number}.png")))
+            self.assertEqual(render.shape, golden.shape, f"page {number} size")
+            diff = np.abs(render.astype(np.int16) - golden.astype(np.int16))
+            self.assertLess(diff.mean(), GOLDEN_MEAN_TOLERANCE, f"page {number} mean difference")
+            self.assertLess((diff > 24).mean(), GOLDEN_OUTLIER_TOLERANCE, f"page {number} changed pixels")
+
+        self.assertLessEqual(len(data), BYTE_BUDGETS[case], "byte budget")
+
+    def test_layouts(self):
+        for case in BYTE_BUDGETS:
+            with self.subTest(case=case):
+                self.check_case(case)
+
+
+# -----------------------
+# Asset store
+# -----------------------
+
+class AssetStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        media = override_settings(MEDIA_ROOT=tmpdir.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, buf):
+        response = self.client.post("/api/assets/", {"file": buf})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["asset_id"]
+
+    def test_same_bytes_are_stored_once(self):
+        from . import assets
+
+        first = self.upload(regression_card(1))
+        second = self.upload(regression_card(1))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, self.upload(regression_card(2)))
+        self.assertEqual(len(os.listdir(assets.asset_root())), 2)
+
+    def test_unknown_asset_is_404(self):
+        self.assertEqual(self.client.get("/api/assets/" + "0" * 64 + "/").status_code, 404)
+        self.assertEqual(self.client.get("/api/assets/not-a-hash/").status_code, 404)
+        response = self.client.post("/api/generate-pdf/", {
+            "front_image_id": "0" * 64, "back_image": regression_card(2), "layout": "UK88",
+            "document_type": "PASSPORT", "customer_name": "JANE DOE", "schedule_date": "01/01/2025",
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_unreadable_or_oversized_files_are_refused(self):
+        from . import assets
+
+        script = io.BytesIO(b"#!/bin/sh\n")
+        script.name = "run.sh"
+        response = self.client.post("/api/assets/", {"file": script})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(".sh", response.json()["error"])
+        with override_settings(ASSET_UPLOAD_MAX_SIZE=1024):
+            response = self.client.post("/api/assets/", {"file": regression_card(1)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("chunked", response.json()["error"])
+        # refused before anything reached the store
+        self.assertFalse(os.path.exists(assets.asset_root()) and os.listdir(assets.asset_root()))
+
+    def test_image_resolves_to_smaller_derivative(self):
+        from . import assets
+
+        asset_id = self.upload(regression_card(1, size=(4000, 2500)))
+        asset = assets.open_asset(asset_id)
+        self.assertTrue(getattr(asset, "preprocessed", False))
+        self.assertEqual(self.client.get(f"/api/assets/{asset_id}/").json()["status"], "ready")
+        derived = Image.open(asset)
+        self.assertEqual(derived.format, "JPEG")
+        self.assertLess(max(derived.size), 4000)
+        self.assertLess(os.path.getsize(os.path.join(assets.asset_dir(asset_id), assets.DERIVATIVE_NAME)),
+                        os.path.getsize(assets.original_path(asset_id)))
+
+
+class UploadProfileTests(SimpleTestCase):
+
+    def test_card_caps_only_for_layouts_with_cards(self):
+        from .layouts import CARDLESS_LAYOUTS, LAYOUT_NAMES
+
+        profile = self.client.get("/api/upload-profile/").json()
+        self.assertEqual(list(profile["layouts"]), list(LAYOUT_NAMES))
+        for layout, cap in profile["layouts"].items():
+            with self.subTest(layout=layout):
+                if layout in CARDLESS_LAYOUTS:
+                    self.assertIsNone(cap)
+                else:
+                    self.assertLessEqual(cap["max_width"], profile["card"]["max_width"])
+                    self.assertLessEqual(cap["max_height"], profile["card"]["max_height"])
+        self.assertIn("image/tiff", profile["formats"])
+
+
+class ChunkedUploadTests(SimpleTestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        media = override_settings(MEDIA_ROOT=tmpdir.name, CHUNKED_UPLOAD_CHUNK_SIZE=64 * 1024)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.data = regression_scan().getvalue()
+
+    def create(self, **extra):
+        response = self.client.post(
+            "/api/uploads/", {"filename": "scan.pdf", "size": len(self.data), **extra}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def put_chunk(self, upload_id, index, data, checksum=None):
+        return self.client.put(
+            f"/api/uploads/{upload_id}/chunks/{index}/", data, content_type="application/octet-stream",
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(data).hexdigest(),
+        )
+
+    def chunk(self, index):
+        return self.data[index * 64 * 1024:(index + 1) * 64 * 1024]
+
+    def complete(self, upload_id, **body):
+        return self.client.post(f"/api/uploads/{upload_id}/complete/", body, content_type="application/json")
+
+    def test_unreadable_file_type_is_refused(self):
+        response = self.client.post(
+            "/api/uploads/", {"filename": "scan.exe", "size": len(self.data)}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_chunk_is_rejected_and_resent(self):
+        upload = self.create()
+        self.assertGreater(upload["chunks"], 2)
+        response = self.put_chunk(upload["upload_id"], 1, self.chunk(1), checksum="0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("checksum", response.json()["error"])
+        self.assertEqual(self.put_chunk(upload["upload_id"], 1, self.chunk(1)[:-1]).status_code, 400)
+
+        status = self.client.get(f"/api/uploads/{upload['upload_id']}/").json()
+        self.assertIn(1, status["missing"])
+        self.assertEqual(self.complete(upload["upload_id"]).status_code, 409)
+
+    def test_resume_and_assemble_out_of_order(self):
+        upload = self.create()
+        upload_id, count = upload["upload_id"], upload["chunks"]
+        # first session: every other chunk, backwards
+        for index in reversed(range(0, count, 2)):
+            self.assertEqual(self.put_chunk(upload_id, index, self.chunk(index)).status_code, 200)
+        # resume: ask what is missing and send only that
+        missing = self.client.get(f"/api/uploads/{upload_id}/").json()["missing"]
+        self.assertEqual(missing, list(range(1, count, 2)))
+        for index in missing:
+            self.put_chunk(upload_id, index, self.chunk(index))
+
+        self.assertEqual(self.complete(upload_id, sha256="0" * 64).status_code, 409)
+        response = self.complete(upload_id, sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(response.status_code, 201, response.content)
+        asset_id = response.json()["asset_id"]
+        self.assertEqual(asset_id, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.client.get(f"/api/uploads/{upload_id}/").status_code, 404)
+
+        # the assembled PDF is compressed in place, by path, like a spooled upload
+        from . import assets, views
+
+        asset = assets.open_asset(asset_id)
+        self.addCleanup(views.close_job_files, {"multi_page_files": [asset]})
+        streaming = mock.patch.object(views, "compress_pdf_streaming", wraps=views.compress_pdf_streaming)
+        with override_settings(OUTPUT_QUALITY={"compress_threshold_mb": 0}), streaming as compress:
+            views.prepare_multipage([asset])
+        self.assertEqual(compress.call_args.args, (assets.original_path(asset_id),))
+
+
+# -----------------------
+# Multi-page TIFF uploads
+# -----------------------
+
+# stored pixels for an upright image shown with EXIF orientation n
+STORED_TRANSPOSE = {1: None, 3: Image.Transpose.ROTATE_180, 6: Image.Transpose.ROTATE_90, 8: Image.Transpose.ROTATE_270}
+
+
+def g4_tiff(orientation, frames=2):
+    """Bilevel portrait page with a black block at its top left, saved as a single-strip G4 TIFF."""
+    page = Image.new("L", (800, 1100), 255)
+    ImageDraw.Draw(page).rectangle((100, 100, 300, 300), fill=0)
+    page = page.convert("1")
+    if STORED_TRANSPOSE[orientation] is not None:
+        page = page.transpose(STORED_TRANSPOSE[orientation])
+    buf = io.BytesIO()
+    page.save(buf, format="TIFF", compression="group4", tiffinfo={274: orientation}, strip_size=1 << 30,
+              save_all=True, append_images=[page] * (frames - 1))
+    buf.seek(0)
+    buf.name = f"scan-{orientation}.tif"
+    return buf
+
+
+def ink_centroid(page):
+    """Centre of the dark pixels of a rendered page, as fractions of its width and height."""
+    pix = page.get_pixmap(dpi=20, colorspace=fitz.csGRAY)
+    gray = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width)
+    ys, xs = np.nonzero(gray < 128)
+    return xs.mean() / pix.width, ys.mean() / pix.height
+
+
+class TiffPageTests(SimpleTestCase):
+
+    def test_g4_frames_pass_through_upright(self):
+        from .views import convert_images_to_pdf
+
+        for orientation in STORED_TRANSPOSE:
+            with self.subTest(orientation=orientation):
+                doc = fitz.open(stream=convert_images_to_pdf([g4_tiff(orientation)]).getvalue(), filetype="pdf")
+                self.addCleanup(doc.close)
+                self.assertEqual(doc.page_count, 2)
+                for page in doc:
+                    (xref, *_), = page.get_images()
+                    self.assertEqual(doc.xref_get_key(xref, "Filter"), ("name", "/CCITTFaxDecode"))
+                    x, y = ink_centroid(page)
+                    self.assertLess(x, 0.5)
+                    self.assertLess(y, 0.5)
+
+
+def rotated_jpeg(orientation):
+    """Landscape card with a black block at its top left, stored turned for an EXIF orientation."""
+    card = Image.new("RGB", (800, 500), (255, 255, 255))
+    ImageDraw.Draw(card).rectangle((50, 50, 200, 150), fill=(0, 0, 0))
+    if STORED_TRANSPOSE[orientation] is not None:
+        card = card.transpose(STORED_TRANSPOSE[orientation])
+    exif = Image.Exif()
+    exif[274] = orientation
+    buf = io.BytesIO()
+    card.save(buf, format="JPEG", quality=90, exif=exif.tobytes())
+    buf.seek(0)
+    buf.name = f"card-{orientation}.jpg"
+    return buf
+
+
+class CardOrientationTests(SimpleTestCase):
+
+    def test_jpeg_cards_land_upright(self):
+        from reportlab.pdfgen import canvas
+
+        from .views import draw_card, prepare_image
+
+        for orientation in STORED_TRANSPOSE:
+            with self.subTest(orientation=orientation):
+                card = prepare_image(rotated_jpeg(orientation), box=(400, 250))
+                buf = io.BytesIO()
+                c = canvas.Canvas(buf, pagesize=(400, 250))
+                draw_card(c, card, 0, 0, 400, 250)
+                c.save()
+                doc = fitz.open(stream=buf.getvalue(), filetype="pdf")
+                self.addCleanup(doc.close)
+                # the block's centre as displayed, not mirrored or turned
+                x, y = ink_centroid(doc[0])
+                self.assertAlmostEqual(x, 125 / 800, delta=0.04)
+                self.assertAlmostEqual(y, 100 / 500, delta=0.04)
+
+
+# -----------------------
+# Card auto-crop
+# -----------------------
+
+def id_card(size=(1600, 1000)):
+    """Card with an ID card's print: header band, outlined photo and readable text lines."""
+    card = Image.new("RGB", size, (222, 230, 240))
+    draw = ImageDraw.Draw(card)
+    draw.rectangle((0, 0, size[0], 150), fill=(30, 70, 140))
+    draw.text((60, 35), "IDENTITY CARD", fill=(255, 255, 255), font=ImageFont.load_default(80))
+    draw.rectangle((80, 220, 520, 800), fill=(200, 180, 160), outline=(20, 20, 20), width=6)
+    for line, text in enumerate(("SURNAME  DOE", "GIVEN NAMES  JANE", "BORN  01.01.1990", "NO  X1234567")):
+        draw.text((600, 240 + line * 110), text, fill=(10, 10, 10), font=ImageFont.load_default(56))
+    return card
+
+
+def jpeg_upload(img, name):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    buf.seek(0)
+    buf.name = name
+    return buf
+
+
+def desk_photo(size=(2000, 1500), card_box=(500, 450, 1500, 1075)):
+    """Phone photo of id_card lying on a plain, slightly noisy desk."""
+    rng = np.random.default_rng(3)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    desk = 90 + 20 * x / size[0] + 10 * y / size[1] + rng.normal(0, 2, (size[1], size[0]))
+    photo = Image.fromarray(np.clip(np.stack([desk, desk * 0.8, desk * 0.6], -1), 0, 255).astype(np.uint8))
+    x0, y0, x1, y1 = card_box
+    photo.paste(id_card().resize((x1 - x0, y1 - y0)), (x0, y0))
+    return jpeg_upload(photo, "desk.jpg")
+
+
+class CardCropTests(SimpleTestCase):
+
+    def test_off_by_default(self):
+        from .views import crop_cards
+
+        card = desk_photo()
+        self.assertIs(crop_cards([card, None], "UK88")[0], card)
+
+    def test_crops_to_the_card(self):
+        from .views import crop_cards
+
+        with override_settings(CARD_AUTO_CROP=True):
+            cropped, empty = crop_cards([desk_photo(), None], "UK88")
+        self.assertIsNone(empty)
+        # the card's shape (1.6), not the photo's (1.33)
+        self.assertAlmostEqual(cropped.width / cropped.height, 1000 / 625, delta=0.1)
+
+        from .cardcrop import DETECT_SIZE, detect_card
+
+        gray = Image.open(desk_photo()).convert("L")
+        gray.thumbnail((DETECT_SIZE, DETECT_SIZE))
+        found = detect_card(np.asarray(gray))
+        for side, expected in zip(found, (0.25, 0.3, 0.75, 0.7167)):
+            self.assertAlmostEqual(side, expected, delta=0.03)
+
+    def test_card_filling_the_frame_is_kept_whole(self):
+        from .views import crop_cards
+
+        with override_settings(CARD_AUTO_CROP=True):
+            kept, _ = crop_cards([jpeg_upload(id_card(), "card.jpg"), None], "UK88")
+        self.assertAlmostEqual(kept.width / kept.height, 1600 / 1000, delta=0.01)
+
+
+# -----------------------
+# Multipage stamping
+# -----------------------
+
+class StampTests(SimpleTestCase):
+
+    def test_stamp_on_every_page(self):
+        from .pdfstamp import stamp_pages
+
+        doc = fitz.open()
+        for number in range(6):
+            page = doc.new_page()
+            page.insert_text((72, 400), f"body of page {number + 1}")
+            if number == 2:
+                page.set_rotation(90)
+        pages = io.BytesIO(doc.tobytes())
+        doc.close()
+        stamp_doc = fitz.open()
+        stamp_doc.new_page(width=90, height=80).draw_rect(fitz.Rect(0, 0, 90, 80), fill=(0, 0, 0))
+        stamp = io.BytesIO(stamp_doc.tobytes())
+        stamp_doc.close()
+
+        out = stamp_pages(pages, stamp, page_numbers=True).getvalue()
+        doc = fitz.open(stream=out, filetype="pdf")
+        self.addCleanup(doc.close)
+        forms = set()
+        for page in doc:
+            with self.subTest(page=page.number + 1):
+                forms.update(xref for xref, *_ in page.get_xobjects())
+                self.assertIn(f"{page.number + 1} / 6", page.get_text())
+                self.assertIn(f"body of page {page.number + 1}", page.get_text())
+                pix = page.get_pixmap(dpi=36, colorspace=fitz.csGRAY)
+                gray = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width)
+                # 90x80pt black box in the bottom-left corner as displayed (rotated page too)
+                self.assertLess(gray[-35:-5, 5:40].mean(), 10)
+                self.assertGreater(gray[5:35, -40:-5].mean(), 245)
+        # one form XObject shared by every page
+        self.assertEqual(len(forms), 1)
+        self.assertLess(len(out) - len(pages.getvalue()), len(stamp.getvalue()) + 6 * 250)
+
+
+# -----------------------
+# Signing
+# -----------------------
+
+class SigningTests(SimpleTestCase):
+
+    def setUp(self):
+        from .management.commands.sign_benchmark import throwaway_credentials
+        from .signing import pdf_signer
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        key, self.cert = throwaway_credentials(tmpdir.name)
+        signing = override_settings(PDF_SIGNING_KEY=key, PDF_SIGNING_CERT=self.cert, PDF_SIGNING_CHAIN=())
+        signing.enable()
+        self.addCleanup(signing.disable)
+        pdf_signer.cache_clear()
+        self.addCleanup(pdf_signer.cache_clear)
+
+    def render(self, **flags):
+        from django.core.files import File
+
+        from .views import JOB_DEFAULTS, render_generate_job, validate_job
+
+        job = dict(JOB_DEFAULTS, layout="UK88_MULTIPAGE", document_type="PASSPORT", customer_name="JANE DOE",
+                   schedule_date="01/01/2025", **flags)
+        job.update(first_image=regression_card(1), back_image=regression_card(2), first_image_2=None, back_image_2=None,
+                   multi_page_files=[File(regression_scan(), name="scan.pdf")])
+        buffer, _ = render_generate_job(validate_job(job))
+        return buffer.getvalue()
+
+    def validate(self, data):
+        from pyhanko.keys import load_cert_from_pemder
+        from pyhanko.pdf_utils.reader import PdfFileReader
+        from pyhanko.sign.validation import validate_pdf_signature
+        from pyhanko_certvalidator import ValidationContext
+
+        signature, = PdfFileReader(io.BytesIO(data)).embedded_signatures
+        context = ValidationContext(trust_roots=[load_cert_from_pemder(self.cert)])
+        return validate_pdf_signature(signature, context)
+
+    def test_signed_output_validates_and_is_not_linearized(self):
+        import pikepdf
+
+        data = self.render()
+        status = self.validate(data)
+        self.assertTrue(status.intact and status.valid and status.trusted)
+        self.assertEqual(status.coverage.name, "ENTIRE_FILE")
+        # a linearized file cannot take the signature's incremental update, so
+        # signing wins and the linearization pass is skipped altogether
+        with pikepdf.open(io.BytesIO(data)) as pdf:
+            self.assertFalse(pdf.is_linearized)
+        self.assertNotIn(b"/Linearized", data[:1024])
+
+        unsigned = self.render(sign="0")
+        with pikepdf.open(io.BytesIO(unsigned)) as pdf:
+            self.assertTrue(pdf.is_linearized)
+
+    def test_signature_appends_to_the_rendered_bytes(self):
+        from .signing import sign_pdf
+
+        unsigned = self.render(sign="0", linearize="0")
+        signed = sign_pdf(io.BytesIO(unsigned)).getvalue()
+        self.assertTrue(signed.startswith(unsigned))
+        self.assertTrue(self.validate(signed).intact)
+
+
+# -----------------------
+# Layout solver
+# -----------------------
+
+def legacy_dynamic_size(size, max_width, max_height, min_width=50, min_height=50):
+    """calculate_dynamic_size as generate_document called it before LAYOUT_RULES, on a pixel size."""
+    original_width, original_height = size
+    aspect_ratio = original_width / float(original_height)
+    if aspect_ratio >= 1:
+        width = min(max_width, original_width)
+        height = width / aspect_ratio
+        if height > max_height:
+            height = max_height
+            width = height * aspect_ratio
+    else:
+        height = min(max_height, original_height)
+        width = height * aspect_ratio
+        if width > max_width:
+            width = max_width
+            height = width / aspect_ratio
+    if width < min_width:
+        width = min_width
+        height = max(min_height, width / max(aspect_ratio, 0.0001))
+    if height < min_height:
+        height = min_height
+        width = max(min_width, height * aspect_ratio)
+    return int(round(width)), int(round(height))
+
+
+def legacy_boxes(layout, front, back=None):
+    """The ONENOTARY and UK88 branches of the old generate_document, boxes only."""
+    from reportlab.lib.pagesizes import A4
+
+    page_width, page_height = A4
+    avail_width = page_width - 2 * 50
+    if layout == "ONENOTARY":
+        avail_height = max(100, (page_height - 160) - (50 + 60))
+        if back:
+            width_each = (avail_width - 20) / 2
+            boxes = [legacy_dynamic_size(size, width_each, avail_height) for size in (front, back)]
+            if max(h for _, h in boxes) > 230:
+                boxes = [legacy_dynamic_size(size, min(width_each, 180), 220) for size in (front, back)]
+            return boxes
+        box = legacy_dynamic_size(front, avail_width, avail_height)
+        if box[1] > 230:
+            box = legacy_dynamic_size(front, min(avail_width, 380), 220)
+        return [box]
+
+    if back:
+        boxes = [legacy_dynamic_size(size, avail_width, page_height * 0.35) for size in (front, back)]
+        if max(h for _, h in boxes) > 270:
+            boxes = [legacy_dynamic_size(size, min(avail_width, 400), 290) for size in (front, back)]
+        return boxes
+    box = legacy_dynamic_size(front, avail_width, page_height * 0.6)
+    if box[1] > 355:
+        box = legacy_dynamic_size(front, min(avail_width, 380), 300)
+    return [box]
+
+
+class LayoutSolverTests(SimpleTestCase):
+
+    def test_matches_the_old_shrink_thresholds(self):
+        from .layouts import solve_layout
+
+        sizes = [(4000, 3000), (3000, 4000), (1600, 1000), (640, 400), (30, 20), (20, 900)]
+        # native heights landing just under, on and just over each threshold
+        for edge in (230, 270, 355):
+            for height in (edge - 1, edge, edge + 1):
+                sizes += [(height, height), (int(height * 1.6), height), (int(height * 0.7), height)]
+
+        for layout in ("ONENOTARY", "UK88"):
+            for front in sizes:
+                for back in [None] + sizes:
+                    with self.subTest(layout=layout, front=front, back=back):
+                        solved = solve_layout(layout, {"front": front, "back": back})
+                        expected = legacy_boxes(layout, front, back)
+                        self.assertEqual([solved[slot] for slot in ("front", "back")[:len(expected)]], expected)
+
+
+# -----------------------
+# Page classification
+# -----------------------
+
+def content_pages(*kinds):
+    """PDF with one page per kind: "text", "photo" (color card), "gray" (gray ramp) or "blank"."""
+    doc = fitz.open()
+    for kind in kinds:
+        page = doc.new_page()
+        if kind == "text":
+            for line in range(30):
+                page.insert_text((50, 60 + line * 24), f"line {line} lorem ipsum dolor sit amet", fontsize=11)
+        elif kind == "photo":
+            page.insert_image(fitz.Rect(40, 40, 555, 800), stream=regression_card(5).getvalue(), keep_proportion=False)
+        elif kind == "gray":
+            ramp = np.tile(np.linspace(40, 220, 400, dtype=np.uint8), (500, 1))
+            buf = io.BytesIO()
+            Image.fromarray(ramp).save(buf, format="PNG")
+            page.insert_image(fitz.Rect(40, 40, 555, 800), stream=buf.getvalue(), keep_proportion=False)
+        elif kind == "blank":
+            # a speck of scanner dust is still a blank page
+            page.draw_rect(fitz.Rect(300, 400, 302, 402), color=(0.3, 0.3, 0.3), fill=(0.3, 0.3, 0.3))
+    buf = io.BytesIO(doc.tobytes())
+    doc.close()
+    return buf
+
+
+class PageClassificationTests(SimpleTestCase):
+
+    def test_classify_page(self):
+        from .pdfraster import PROBE_DPI, classify_page, pixmap_array
+
+        expected = {
+            "text": ("bilevel", "text"),
+            "photo": ("color", "photo"),
+            "gray": ("gray", "photo"),
+            "blank": ("bilevel", "blank"),
+        }
+        doc = fitz.open(stream=content_pages(*expected).getvalue(), filetype="pdf")
+        self.addCleanup(doc.close)
+        for page, (kind, classes) in zip(doc, expected.items()):
+            with self.subTest(kind=kind):
+                self.assertEqual(classify_page(pixmap_array(page.get_pixmap(dpi=PROBE_DPI))), classes)
+
+    def test_blank_pages_dropped(self):
+        from .views import compress_pdf_multipage
+
+        def page_count(scan, **kwargs):
+            doc = fitz.open(stream=compress_pdf_multipage(scan, **kwargs).getvalue(), filetype="pdf")
+            try:
+                return doc.page_count
+            finally:
+                doc.close()
+
+        duplex = content_pages("text", "blank", "photo", "blank")
+        self.assertEqual(page_count(duplex, drop_blank=False), 4)
+        self.assertEqual(page_count(duplex, drop_blank=True), 2)
+        # an all-blank scan keeps its last page rather than becoming empty
+        self.assertEqual(page_count(content_pages("blank", "blank"), drop_blank=True), 1)
+
+
+# -----------------------
+# Async generate endpoint
+# -----------------------
+
+class AsyncGenerateTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import workers
+
+        # a fresh one-worker process pool with no queue, so one held slot makes it busy
+        pool = override_settings(GENERATE_EXECUTOR="process", GENERATE_MAX_WORKERS=1, GENERATE_MAX_QUEUE=0)
+        pool.enable()
+        self.addCleanup(pool.disable)
+        for name in ("_executor", "_slots"):
+            patcher = mock.patch.object(workers, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: workers._executor and workers._executor.shutdown())
+
+    def form(self):
+        return {
+            "front_image": regression_card(1), "back_image": regression_card(2), "layout": "UK88",
+            "document_type": "PASSPORT", "customer_name": "JANE DOE", "schedule_date": "01/01/2025",
+        }
+
+    def post(self):
+        return self.async_client.post("/api/generate-pdf-async/", self.form())
+
+    def page_images(self, data):
+        doc = fitz.open(stream=data, filetype="pdf")
+        try:
+            return [len(page.get_images()) for page in doc]
+        finally:
+            doc.close()
+
+    async def test_renders_on_the_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        from asgiref.sync import sync_to_async
+
+        from . import workers
+
+        response = await self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(workers._executor, ProcessPoolExecutor)
+        data = b"".join(response.streaming_content)
+        self.assertTrue(data.startswith(b"%PDF"))
+        # the same document the sync view renders in-process
+        expected = await sync_to_async(self.client.post)("/api/generate-pdf/", self.form())
+        self.assertEqual(self.page_images(data), self.page_images(b"".join(expected.streaming_content)))
+
+    async def test_busy_when_every_slot_is_taken(self):
+        from . import workers
+
+        workers.get_executor()
+        self.assertTrue(workers._slots.acquire(blocking=False))
+        try:
+            response = await self.post()
+        finally:
+            workers._slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("busy", response.json()["error"])
+        # the slot is free again, so the next request renders
+        self.assertEqual((await self.post()).status_code, 200)
+
+
+# -----------------------
+# Previews
+# -----------------------
+
+class PreviewTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import preview
+
+        for cache in (preview._cards, preview._pages):
+            cache.clear()
+            self.addCleanup(cache.clear)
+
+    def post(self, **extra):
+        return self.client.post("/api/generate-preview/", {
+            "front_image": regression_card(1), "back_image": regression_card(2), "layout": "UK88",
+            "document_type": "PASSPORT", "customer_name": "JANE DOE", "schedule_date": "01/01/2025", **extra,
+        })
+
+    def test_png_of_the_first_page(self):
+        response = self.post(dpi=40)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        img = Image.open(io.BytesIO(response.content))
+        self.assertEqual(img.format, "PNG")
+        # A4 at 40 dpi
+        self.assertEqual(img.size, (331, 468))
+        self.assertEqual(self.post(dpi="many").status_code, 400)
+
+    def test_repeat_is_served_from_the_cache(self):
+        from . import views
+
+        render = mock.patch.object(views, "render_document", wraps=views.render_document)
+        with render as render_document:
+            first = self.post(dpi=40).content
+            self.assertEqual(self.post(dpi=40).content, first)
+            # another DPI re-rasterizes the recorded page, without laying it out again
+            self.assertEqual(Image.open(io.BytesIO(self.post(dpi=80).content)).size, (662, 936))
+            self.assertEqual(render_document.call_count, 1)
+            # a changed field is a new page
+            self.post(dpi=40, customer_name="JOHN DOE")
+            self.assertEqual(render_document.call_count, 2)
+
+        # the same uploads in another layout reuse the decoded cards
+        with mock.patch.object(views, "load_image", wraps=views.load_image) as load_image:
+            self.assertEqual(self.post(dpi=40, layout="ONENOTARY").status_code, 200)
+        load_image.assert_not_called()
+
+
+# -----------------------
+# Certificate text
+# -----------------------
+
+def full_reflow(text, max_width, font_size, **values):
+    """The whole certificate paragraph laid out word by word, without the compiled prefix/suffix."""
+    from .textlayout import FONT_BOLD, FONT_REGULAR, break_lines, coalesce_runs
+
+    words = []
+    for token in text.split():
+        if "{" in token:
+            words.extend((FONT_BOLD, word) for word in token.format(**values).split())
+        else:
+            words.append((FONT_REGULAR, token))
+    return [coalesce_runs(line) for line, _ in break_lines(words, max_width, font_size)]
+
+
+class CertificateTests(SimpleTestCase):
+
+    def test_compiled_layout_matches_a_full_reflow(self):
+        import random
+        import string
+
+        from .certificates import CERTIFICATE_TEXT, _compile, certificate_values
+
+        rng = random.Random(36)
+
+        def word():
+            # mostly name-like words, sometimes a reference number wider than the column
+            length = rng.choice([rng.randint(1, 12)] * 9 + [rng.randint(40, 120)])
+            return "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+        def value():
+            return " ".join(word() for _ in range(rng.randint(0, 5)))
+
+        notaries = [
+            {"notary_name": "JOHN OLATUNJI", "notary_address": "ONE LONDON SQUARE, GUILDFORD, GU1 1UN",
+             "jurisdiction": "ENGLAND AND WALES"},
+            {"notary_name": "A", "notary_address": "B", "jurisdiction": "C"},
+            {"notary_name": word() + " " + word(), "notary_address": value() or "X", "jurisdiction": word()},
+        ]
+        for case in range(1600):
+            text = CERTIFICATE_TEXT.format(**rng.choice(notaries))
+            max_width, font_size = rng.uniform(60, 520), rng.choice((6, 8, 9, 10, 12, 14))
+            values = certificate_values(value(), value(), rng.choice([None, "01/01/2025", value()]))
+            with self.subTest(case=case):
+                self.assertEqual(_compile(text, max_width, font_size).layout(**values),
+                                 full_reflow(text, max_width, font_size, **values))
+
+    def test_changed_profiles_are_recompiled(self):
+        from .certificates import compile_certificate
+
+        first = compile_certificate("JOHN_OLATUNJI", 495)
+        self.assertIs(compile_certificate("JOHN_OLATUNJI", 495), first)
+        moved = {"JOHN_OLATUNJI": {"notary_name": "JOHN OLATUNJI", "notary_address": "TWO HIGH STREET, LEEDS",
+                                   "jurisdiction": "ENGLAND AND WALES"}}
+        with override_settings(NOTARY_PROFILES=moved):
+            self.assertIn("LEEDS", compile_certificate("JOHN_OLATUNJI", 495).text)
+        self.assertIs(compile_certificate("JOHN_OLATUNJI", 495), first)
+
+
+# -----------------------
+# Batch generation
+# -----------------------
+
+class BatchGenerateTests(SimpleTestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = tmpdir.name
+        self.out = os.path.join(self.dir, "out")
+        with open(os.path.join(self.dir, "front.jpg"), "wb") as fh:
+            fh.write(regression_card(1).getvalue())
+
+    def run_manifest(self, *entries):
+        import json
+
+        from django.core.management import call_command
+
+        manifest = os.path.join(self.dir, "jobs.jsonl")
+        with open(manifest, "w") as fh:
+            fh.writelines(json.dumps(entry) + "\n" for entry in entries)
+        call_command("batch_generate", manifest, output_dir=self.out, workers=1, stdout=io.StringIO())
+
+    def test_renders_and_resumes(self):
+        entry = {"id": "a", "layout": "UK88", "front_image": "front.jpg", "output": "nested/a.pdf"}
+        self.run_manifest(entry)
+        with open(os.path.join(self.out, "nested", "a.pdf"), "rb") as fh:
+            self.assertTrue(fh.read(5).startswith(b"%PDF"))
+        # a rerun finds "a" in the checkpoint and leaves it alone
+        os.remove(os.path.join(self.out, "nested", "a.pdf"))
+        self.run_manifest(entry)
+        self.assertFalse(os.path.exists(os.path.join(self.out, "nested", "a.pdf")))
+
+    def test_output_outside_the_directory_is_refused(self):
+        from django.core.management.base import CommandError
+
+        for output in ("../escaped.pdf", os.path.join(self.dir, "escaped.pdf"), "."):
+            with self.subTest(output=output), self.assertRaises(CommandError):
+                self.run_manifest({"id": "a", "front_image": "front.jpg"}, {"id": "b", "front_image": "front.jpg",
+                                                                             "output": output})
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "escaped.pdf")))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "a.pdf")))
+
+    def test_files_closed_when_a_path_is_missing(self):
+        from .management.commands import batch_generate
+        from .workers import DiskUpload
+
+        opened = []
+
+        def tracked(*args, **kwargs):
+            opened.append(DiskUpload(*args, **kwargs))
+            return opened[-1]
+
+        entry = {"id": "a", "front_image": "front.jpg", "back_image": "missing.jpg"}
+        with mock.patch.object(batch_generate, "DiskUpload", side_effect=tracked), \
+                self.assertRaises(FileNotFoundError):
+            batch_generate.render_entry(entry, self.dir, self.out)
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
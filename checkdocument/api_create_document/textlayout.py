@@ -0,0 +1,90 @@
+"""
+Metric-aware paragraph layout for the certificate text.
+
+Lines are broken on real Helvetica / Helvetica-Bold advance widths against the
+column width in points (instead of a character count), and every line is
+returned as runs of consecutive same-font words, so the content stream only
+switches fonts where the text actually changes weight.
+"""
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+FONT_REGULAR = "Helvetica"
+FONT_BOLD = "Helvetica-Bold"
+
+
+@lru_cache(maxsize=8192)
+def text_width(text, font_name, font_size):
+    """Advance width of `text` in points (widths come from reportlab's AFM tables)."""
+    return stringWidth(text, font_name, font_size)
+
+
+def split_long_word(word, font_name, font_size, max_width):
+    """Hard-break a word wider than the column (long names, reference numbers) into pieces."""
+    pieces = []
+    piece = ""
+    for char in word:
+        if piece and text_width(piece + char, font_name, font_size) > max_width:
+            pieces.append(piece)
+            piece = char
+        else:
+            piece += char
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+def break_lines(words, max_width, font_size):
+    """
+    Lazily break (font_name, word) pairs into lines no wider than max_width.
+    Yields (line, next_index): the line's (font, word) pairs and the index of the
+    word the following line starts with (None when it continues a hard-broken word).
+    """
+    space = {font: text_width(" ", font, font_size) for font in (FONT_REGULAR, FONT_BOLD)}
+    line = []
+    line_width = 0.0
+
+    for index, (font, word) in enumerate(words):
+        width = text_width(word, font, font_size)
+        pieces = [word] if width <= max_width else split_long_word(word, font, font_size, max_width)
+
+        for number, piece in enumerate(pieces):
+            width = text_width(piece, font, font_size)
+            # the space before a word is set in the previous word's font
+            gap = space[line[-1][0]] if line else 0.0
+            if line and line_width + gap + width > max_width:
+                yield line, index if number == 0 else None
+                line, line_width, gap = [], 0.0, 0.0
+            line.append((font, piece))
+            line_width += gap + width
+
+    if line:
+        yield line, len(words)
+
+
+def coalesce_runs(words):
+    """Merge consecutive same-font words of one line into (font, text) runs."""
+    runs = []
+    for font, word in words:
+        if runs and runs[-1][0] == font:
+            runs[-1] = (font, runs[-1][1] + " " + word)
+        elif runs:
+            # keep the separating space with the preceding run (same width as before)
+            runs[-1] = (runs[-1][0], runs[-1][1] + " ")
+            runs.append((font, word))
+        else:
+            runs.append((font, word))
+    return runs
+
+
+def draw_lines(text_obj, lines, font_size):
+    """Write laid-out lines into a reportlab text object, setting fonts only on change."""
+    current = None
+    for line in lines:
+        for font, text in line:
+            if font != current:
+                text_obj.setFont(font, font_size)
+                current = font
+            text_obj.textOut(text)
+        text_obj.textLine("")
@@ -0,0 +1,226 @@
+"""
+Resumable chunked uploads into the asset store.
+
+Large multipage scans are sent as fixed-size chunks instead of one multipart
+body, so a dropped connection only costs the chunk in flight:
+
+    POST   uploads/                        {"filename", "size", "sha256"?} -> upload_id, chunk_size
+    PUT    uploads/<id>/chunks/<index>/    raw chunk bytes, X-Chunk-SHA256 header
+    GET    uploads/<id>/                   which chunks arrived (to resume)
+    POST   uploads/<id>/complete/          {"sha256"?} -> asset_id (usable as multi_page_pdf_id)
+
+Chunks are written in place at their offset into one preallocated file under
+MEDIA_ROOT/uploads/<id>/, in any order and in parallel. On completion that file
+is hashed and moved into the asset store (assets.adopt_file), never copied.
+The whole-file sha256 is optional and can be sent at creation or, by clients
+that hash chunk by chunk while sending, at completion.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+
+from . import assets
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+DATA_NAME = "data.part"
+META_NAME = "meta.json"
+# one "<index> <sha256>" (or "<index> rejected") line per chunk request,
+# appended (O_APPEND) so parallel chunk requests never rewrite each other's records
+RECEIVED_NAME = "received.log"
+REJECTED = "rejected"
+READ_SIZE = 1024 * 1024
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class UploadRejected(Exception):
+    """A bad upload request; the message is safe to return to the client."""
+
+
+def upload_root():
+    return os.path.join(settings.MEDIA_ROOT, "uploads")
+
+
+def upload_dir(upload_id):
+    if not upload_id or not UPLOAD_ID_RE.match(upload_id):
+        raise UploadNotFound(upload_id)
+    folder = os.path.join(upload_root(), upload_id)
+    if not os.path.isdir(folder):
+        raise UploadNotFound(upload_id)
+    return folder
+
+
+def read_meta(upload_id):
+    with open(os.path.join(upload_dir(upload_id), META_NAME)) as fh:
+        return json.load(fh)
+
+
+def chunk_count(meta):
+    return max(1, -(-meta["size"] // meta["chunk_size"]))
+
+
+def chunk_length(meta, index):
+    return min(meta["chunk_size"], meta["size"] - index * meta["chunk_size"])
+
+
+# -----------------------
+# Protocol steps
+# -----------------------
+
+def create_upload(filename, size, sha256=None):
+    """Open an assembly area for a file of `size` bytes; returns its meta dict."""
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadRejected("size must be an integer")
+    max_size = getattr(settings, "CHUNKED_UPLOAD_MAX_SIZE", 2 * 1024 ** 3)
+    if not 0 < size <= max_size:
+        raise UploadRejected(f"size must be between 1 and {max_size} bytes")
+    if sha256 and not assets.ASSET_ID_RE.match(sha256):
+        raise UploadRejected("sha256 must be 64 lowercase hex digits")
+    if os.path.splitext(filename or "")[1].lower() not in assets.accepted_extensions():
+        raise UploadRejected(f"filename must end in one of {' '.join(assets.accepted_extensions())}")
+
+    purge_expired()
+    upload_id = uuid.uuid4().hex
+    folder = os.path.join(upload_root(), upload_id)
+    os.makedirs(folder)
+    meta = {
+        "upload_id": upload_id,
+        "filename": os.path.basename(filename or ""),
+        "size": size,
+        "sha256": sha256 or None,
+        "chunk_size": getattr(settings, "CHUNKED_UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024),
+        "created": time.time(),
+    }
+    # sparse on most filesystems; chunks land at their own offsets
+    with open(os.path.join(folder, DATA_NAME), "wb") as fh:
+        fh.truncate(size)
+    with open(os.path.join(folder, META_NAME), "w") as fh:
+        json.dump(meta, fh)
+    return meta
+
+
+def write_chunk(upload_id, index, stream, checksum):
+    """
+    Stream one chunk into place and record it. The chunk must have its exact
+    length and match `checksum` (sha256 hex); a repeated chunk is rewritten.
+    Returns the sorted list of received chunk indexes.
+    """
+    meta = read_meta(upload_id)
+    folder = upload_dir(upload_id)
+    if not 0 <= index < chunk_count(meta):
+        raise UploadRejected(f"chunk index must be below {chunk_count(meta)}")
+    if not checksum:
+        raise UploadRejected("X-Chunk-SHA256 header is required")
+
+    expected = chunk_length(meta, index)
+    digest = hashlib.sha256()
+    written = 0
+    fd = os.open(os.path.join(folder, DATA_NAME), os.O_WRONLY)
+    try:
+        offset = index * meta["chunk_size"]
+        # ask for one byte past the chunk to notice oversized bodies
+        while written <= expected:
+            data = stream.read(min(READ_SIZE, expected + 1 - written))
+            if not data:
+                break
+            written += len(data)
+            if written > expected:
+                break
+            digest.update(data)
+            os.pwrite(fd, data, offset)
+            offset += len(data)
+    finally:
+        os.close(fd)
+
+    # a bad resend has already overwritten the chunk's bytes, so it is
+    # recorded as missing again rather than just refused
+    if written != expected:
+        _record(folder, index, REJECTED)
+        raise UploadRejected(f"chunk {index} must be {expected} bytes, got {'more' if written > expected else written}")
+    if digest.hexdigest() != checksum.lower():
+        _record(folder, index, REJECTED)
+        raise UploadRejected(f"chunk {index} checksum mismatch, resend it")
+
+    _record(folder, index, digest.hexdigest())
+    return received_chunks(upload_id)
+
+
+def _record(folder, index, value):
+    fd = os.open(os.path.join(folder, RECEIVED_NAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, f"{index} {value}\n".encode())
+    finally:
+        os.close(fd)
+
+
+def received_chunks(upload_id):
+    path = os.path.join(upload_dir(upload_id), RECEIVED_NAME)
+    if not os.path.exists(path):
+        return []
+    state = {}
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                index, value = line.split()
+                state[int(index)] = value  # the latest record of a chunk wins
+    return sorted(index for index, value in state.items() if value != REJECTED)
+
+
+def upload_status(upload_id):
+    meta = read_meta(upload_id)
+    received = received_chunks(upload_id)
+    missing = sorted(set(range(chunk_count(meta))) - set(received))
+    return dict(meta, chunks=chunk_count(meta), received=received, missing=missing)
+
+
+def complete_upload(upload_id, sha256=None):
+    """
+    Hash the assembled file and move it into the asset store; returns the asset id.
+    Raises UploadRejected while chunks are missing or when the whole-file sha256
+    (given here or at creation) does not match.
+    """
+    if sha256 and not assets.ASSET_ID_RE.match(sha256):
+        raise UploadRejected("sha256 must be 64 lowercase hex digits")
+    status = upload_status(upload_id)
+    if status["missing"]:
+        raise UploadRejected(f"{len(status['missing'])} chunks missing, first {status['missing'][0]}")
+
+    folder = upload_dir(upload_id)
+    path = os.path.join(folder, DATA_NAME)
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(READ_SIZE), b""):
+            digest.update(block)
+    asset_id = digest.hexdigest()
+    expected = sha256 or status["sha256"]
+    if expected and expected != asset_id:
+        raise UploadRejected("file checksum mismatch; check the chunks and complete again")
+
+    assets.adopt_file(asset_id, path, status["filename"])
+    shutil.rmtree(folder, ignore_errors=True)
+    return asset_id
+
+
+def purge_expired():
+    """Drop assembly areas untouched for CHUNKED_UPLOAD_EXPIRY_HOURS."""
+    root = upload_root()
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - getattr(settings, "CHUNKED_UPLOAD_EXPIRY_HOURS", 24) * 3600
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        try:
+            if os.path.getmtime(folder) < cutoff and os.path.getmtime(os.path.join(folder, DATA_NAME)) < cutoff:
+                shutil.rmtree(folder, ignore_errors=True)
+        except OSError:
+            pass
@@ -1,9 +1,21 @@
 from django.urls import path
-from .views import GeneratePDFView
+from .views import (
+    GeneratePDFView, GeneratePreviewView, AssetUploadView, AssetStatusView, UploadProfileView, generate_pdf_async,
+    ChunkedUploadView, ChunkedUploadStatusView, UploadChunkView, CompleteUploadView,
+)
 from django.conf import settings
 from django.conf.urls.static import static
 urlpatterns = [
     path('generate-pdf/', GeneratePDFView.as_view(), name='generate-pdf'),
+    path('generate-pdf-async/', generate_pdf_async, name='generate-pdf-async'),
+    path('generate-preview/', GeneratePreviewView.as_view(), name='generate-preview'),
+    path('assets/', AssetUploadView.as_view(), name='asset-upload'),
+    path('upload-profile/', UploadProfileView.as_view(), name='upload-profile'),
+    path('uploads/', ChunkedUploadView.as_view(), name='chunked-upload'),
+    path('uploads/<str:upload_id>/', ChunkedUploadStatusView.as_view(), name='chunked-upload-status'),
+    path('uploads/<str:upload_id>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload-chunk'),
+    path('uploads/<str:upload_id>/complete/', CompleteUploadView.as_view(), name='complete-upload'),
+    path('assets/<str:asset_id>/', AssetStatusView.as_view(), name='asset-status'),
 ]
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,143 +1,291 @@
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import FileResponse
+from rest_framework.response import Response
+from rest_framework import status
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.utils import ImageReader
-import textwrap
+from reportlab import rl_config
 
 from PyPDF2 import PdfReader, PdfWriter, PdfMerger
 from io import BytesIO
+import logging
 import os
+import mimetypes
+import tempfile
+from functools import lru_cache
 from PIL import Image, ImageOps
 import qrcode
 import fitz
+import numpy as np
+
+from . import assets, uploads, workers
+from .cardcrop import DETECT_SIZE, detect_card
+from .pdfraster import (
+    ORIENTATION_ROTATION, PROBE_DPI, add_image, classify_page, displayed_size, encode_bilevel,
+    encode_bitmap, encode_jpeg, encode_pixmap, fit_rect, g4_frame_spec, is_tiff, jpeg_spec, luminance, mrc_layers,
+    orientation_matrix, page_settings, pixmap_array, tiff_frames,
+)
+from .pdfoutput import linearize_pdf, optimize_pdf, wants_linearized
+from .pdfstamp import stamp_pages
+from .pdfstream import StreamingPDFWriter
+from .preview import render_preview
+from .quality import quality_setting
+from .signing import sign_pdf, signing_configured, wants_signed
+from .certificates import UnknownNotary, default_notary, draw_certificate, notary_profiles
+from .layouts import (
+    CARDLESS_LAYOUTS, EXIF_ORIENTATION, LAYOUT_NAMES, box_to_pixels, exif_orientation, max_card_box, oriented_size,
+    probe_size, solve_layout,
+)
+
+# Embed reportlab image streams as binary instead of ASCII85 text: the pure-Python
+# encoder was the largest cost of a render, and it grew every card JPEG by a quarter
+rl_config.useA85 = 0
+
+logger = logging.getLogger(__name__)
+
+# Page corner stamped on multipage outputs: add_qr's default placement, 70pt at (20, 10)
+STAMP_SIZE = (90, 80)
 
 # -----------------------
 # Helpers
 # -----------------------
 
 
-def pil_from_buffer_or_image(img_input):
-    """Return a PIL.Image instance from BytesIO/file-like or PIL.Image."""
-    if img_input is None:
-        return None
-    try:
-        if isinstance(img_input, Image.Image):
-            return img_input
-        if hasattr(img_input, "seek"):
-            img_input.seek(0)
-        return Image.open(img_input)
-    except Exception:
+def compress_image(img, max_width=1200, quality=90, max_height=None):
+    """
+    Resize + compress a PIL.Image to JPEG in a BytesIO buffer.
+    Fits inside max_width (and max_height if given), never upscales.
+    Pixels keep their stored orientation: the limits apply to the image as
+    displayed and the EXIF orientation is written along (see draw_card).
+    Accepts PIL.Image. Returns BytesIO or None.
+    """
+    if not isinstance(img, Image.Image):
         return None
 
+    # read once decoded: Pillow uprights TIFFs itself while decoding them
+    img.load()
+    orientation = exif_orientation(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    width, height = displayed_size(img.width, img.height, orientation)
+    ratio = 1.0
+    if width > max_width:
+        ratio = max_width / float(width)
+    if max_height and height * ratio > max_height:
+        ratio = max_height / float(height)
+    if ratio < 1:
+        new_size = (max(1, int(round(img.width * ratio))), max(1, int(img.height * ratio)))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # only the orientation survives from the upload's EXIF
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[EXIF_ORIENTATION] = orientation
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True, exif=exif.tobytes())
+    buf.seek(0)
+    return buf
+
 
-def calculate_dynamic_size(img_input, max_width=400, max_height=300, min_width=50, min_height=50):
+
+
+
+def compress_pdf_multipage(input_pdf, dpi=100, quality=100, bilevel_dpi=200, mode=None, mrc_mask_dpi=300,
+                           drop_blank=None, output=None):
     """
-    Calculate width and height maintaining aspect ratio.
-    Accepts either PIL.Image or file-like/BytesIO containing image.
-    Returns (width, height) as integers (points).
+    Rasterize & recompress each page (fitz), produce a new PDF as BytesIO.
+    Each page is classified from a PROBE_DPI render (see pdfraster.classify_page):
+        color   -> RGB JPEG
+        gray    -> 8-bit gray JPEG
+        bilevel -> 1-bit CCITT G4 at `bilevel_dpi` (text needs the extra resolution,
+                   and is still far smaller than any JPEG)
+    and its content (blank / text / photo) scales `dpi` and caps `quality` per page.
+    mode "mrc" (default: settings.PDF_COMPRESSION_MODE) stores color/gray pages as
+    a G4 text mask at `mrc_mask_dpi` over a JPEG background instead.
+    drop_blank (default: settings.PDF_DROP_BLANK_PAGES) skips blank pages, e.g.
+    the empty backs from duplex scanners.
+
+    input_pdf is a buffer or a filesystem path (opened in place, never read into
+    memory). Pages are rendered, encoded and written one at a time into `output`
+    (a writable binary file, default a new BytesIO), which is returned.
     """
-    img = pil_from_buffer_or_image(img_input)
-    if img is None:
-        return int(min_width), int(min_height)
-
-    original_width, original_height = img.size
-    if original_height == 0 or original_width == 0:
-        return int(min_width), int(min_height)
+    if mode is None:
+        mode = getattr(settings, "PDF_COMPRESSION_MODE", "auto")
+    if drop_blank is None:
+        drop_blank = getattr(settings, "PDF_DROP_BLANK_PAGES", False)
 
-    aspect_ratio = original_width / float(original_height)
+    if isinstance(input_pdf, (str, os.PathLike)):
+        open_doc = lambda: fitz.open(input_pdf)
+    else:
+        input_pdf.seek(0)
+        data = input_pdf.read()
+        open_doc = lambda: fitz.open(stream=data, filetype="pdf")
 
-    if aspect_ratio >= 1:  # landscape or square
-        width = min(max_width, original_width)
-        height = width / aspect_ratio
-        if height > max_height:
-            height = max_height
-            width = height * aspect_ratio
-    else:  # portrait
-        height = min(max_height, original_height)
-        width = height * aspect_ratio
-        if width > max_width:
-            width = max_width
-            height = width / aspect_ratio
+    if output is None:
+        output = BytesIO()
+    writer = StreamingPDFWriter(output)
+    page_width, page_height = A4
 
-    # enforce minimums Yeh code minimum size constraints enforce karta hai. Agar calculated dimensions bahut chote ho jayen, toh image ko minimum readable size mein force karta hai.
-    if width < min_width:
-        width = min_width
-        height = max(min_height, width / max(aspect_ratio, 0.0001))
-    if height < min_height:
-        height = min_height
-        width = max(min_width, height * aspect_ratio)
+    for layers in iter_compressed_pages(open_doc, dpi, quality, bilevel_dpi, mode, mrc_mask_dpi, drop_blank):
+        writer.add_page(page_width, page_height, layers)
+    writer.close()
 
-    return int(round(width)), int(round(height))
+    output.seek(0)
+    return output
 
 
-def compress_image(img, max_width=1200, quality=90):
+def compress_pdf_streaming(path, **kwargs):
     """
-    Resize + compress a PIL.Image to JPEG in a BytesIO buffer.
-    Accepts PIL.Image. Returns BytesIO or None.
+    compress_pdf_multipage for very large PDFs on disk: the output is spooled to a
+    temp file past PDF_STREAM_SPOOL_SIZE bytes, so memory stays flat in page count.
+    Returns the rewound SpooledTemporaryFile; the caller closes it.
     """
-    if not isinstance(img, Image.Image):
-        return None
+    output = tempfile.SpooledTemporaryFile(max_size=getattr(settings, "PDF_STREAM_SPOOL_SIZE", 8 * 1024 * 1024))
+    return compress_pdf_multipage(path, output=output, **kwargs)
 
-    if img.mode != "RGB":
-        img = img.convert("RGB")
 
-    if img.width > max_width:
-        ratio = max_width / float(img.width)
-        new_height = int(img.height * ratio)
-        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+def iter_compressed_pages(open_doc, dpi, quality, bilevel_dpi, mode, mrc_mask_dpi, drop_blank):
+    """
+    Yield the layers (list of (image spec, rect)) of each recompressed A4 page.
+    Only the current page's pixmaps are alive at any time. MuPDF's object store
+    is trimmed after every page, and the input (open_doc() returns a fresh
+    fitz.Document) is reopened every PDF_STREAM_REOPEN_PAGES pages, since MuPDF
+    keeps every object it has parsed until the document is closed.
+    """
+    reopen_every = getattr(settings, "PDF_STREAM_REOPEN_PAGES", 100)
+    page_rect = fitz.Rect(0, 0, *A4)
+    kept = 0
 
-    buf = BytesIO()
-    img.save(buf, format="JPEG", quality=quality, optimize=True)
-    buf.seek(0)
-    return buf
+    doc = open_doc()
+    page_count = len(doc)
+    try:
+        for number in range(page_count):
+            if number and number % reopen_every == 0:
+                doc.close()
+                doc = open_doc()
+            layers = compress_page(doc[number], page_rect, dpi, quality, bilevel_dpi, mode, mrc_mask_dpi,
+                                   # never drop everything: the last page stays if nothing else was kept
+                                   drop_blank and (kept or number < page_count - 1))
+            if layers is None:
+                continue
+            kept += 1
+            yield layers
+            fitz.TOOLS.store_shrink(100)
+    finally:
+        doc.close()
+
+
+def compress_page(page, page_rect, dpi, quality, bilevel_dpi, mode, mrc_mask_dpi, drop_blank):
+    """Classify and encode one input page into output layers; None if it is dropped as blank."""
+    probe = page.get_pixmap(dpi=PROBE_DPI)
+    kind, content = classify_page(pixmap_array(probe))
+    if content == "blank" and drop_blank:
+        return None
 
+    page_dpi, page_quality = page_settings(content, dpi, quality)
 
+    if kind == "bilevel":
+        gray_pix = page.get_pixmap(dpi=bilevel_dpi if content != "blank" else page_dpi, colorspace=fitz.csGRAY)
+        spec = encode_bilevel(pixmap_array(gray_pix)[:, :, 0])
+    elif mode == "mrc" and content != "blank":
+        return mrc_page_layers(page_rect, page, kind, page_dpi, mrc_mask_dpi, page_quality)
+    else:
+        # PIL encodes straight from the pixmap samples; no intermediate copies
+        colorspace = fitz.csGRAY if kind == "gray" else fitz.csRGB
+        pix = page.get_pixmap(dpi=page_dpi, colorspace=colorspace)
+        spec = encode_pixmap(pix, page_quality)
 
+    # Fit to A4 while maintaining aspect ratio
+    return [(spec, fit_rect(page_rect, spec["width"], spec["height"]))]
 
 
-def compress_pdf_multipage(input_buffer, dpi=100, quality=100):
+def prepare_image(file, box=None, quality=90, dpi=None):
     """
-    Rasterize & recompress each page (fitz), produce a new PDF as BytesIO.
+    Load + compress a card upload (or an already decoded PIL.Image) into a JPEG
+    BytesIO sized for its layout box. box is the drawn (width, height) in points;
+    pixels are capped at dpi (default CARD_TARGET_DPI).
+    Preprocessed assets that are already small enough pass straight through.
     """
-    input_buffer.seek(0)
-    doc = fitz.open(stream=input_buffer.read(), filetype="pdf")
+    if not file:
+        return None
 
-    compressed_buffer = BytesIO()
-    c = canvas.Canvas(compressed_buffer, pagesize=A4)
-    page_width, page_height = A4
+    max_width, max_height = 1200, None
+    if box:
+        max_width, max_height = box_to_pixels(box, dpi or getattr(settings, "CARD_TARGET_DPI", 200))
 
-    for page_num in range(len(doc)):
-        pix = doc[page_num].get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    if getattr(file, "preprocessed", False):
+        size = probe_size(file)
+        if size and size[0] <= max_width and (max_height is None or size[1] <= max_height):
+            file.seek(0)
+            return BytesIO(file.read())
 
-        # Recompress image
-        buf = BytesIO()
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        buf.seek(0)
+    if isinstance(file, Image.Image):
+        img = file
+    else:
+        img = load_image(file, draft_size=(max_width, max_height or max_width))
+    return compress_image(img, max_width=max_width, max_height=max_height, quality=quality)
 
-        # Fit to A4 while maintaining aspect ratio
-        img_width, img_height = img.size
-        ratio = min(page_width / img_width, page_height / img_height)
-        new_width = img_width * ratio
-        new_height = img_height * ratio
-        x = (page_width - new_width) / 2
-        y = (page_height - new_height) / 2
 
-        c.drawImage(ImageReader(buf), x, y, width=new_width, height=new_height)
-        c.showPage()
+def mrc_page_layers(page_rect, page, kind, dpi, mask_dpi, quality):
+    """
+    Mixed raster content: one high-res render split into a 1-bit text mask
+    (stencil, CCITT G4) drawn over a low-res JPEG background with the ink removed.
+    Returns the page layers, background first.
+    """
+    factor = max(1, int(round(mask_dpi / float(dpi))))
+    pix = page.get_pixmap(dpi=dpi * factor)
+    rgb = pixmap_array(pix)
+    text_mask, background = mrc_layers(rgb, factor)
+
+    # fromarray wraps the (contiguous) background array without copying it
+    bg_spec = encode_jpeg(Image.fromarray(luminance(background) if kind == "gray" else background), quality)
+
+    # both layers cover the same area; the background may be a few pixels short
+    # of the mask (cropped to whole cells), so scale its rect accordingly
+    rect = fit_rect(page_rect, pix.width, pix.height)
+    bg_rect = fitz.Rect(
+        rect.x0, rect.y0,
+        rect.x0 + rect.width * bg_spec["width"] * factor / pix.width,
+        rect.y0 + rect.height * bg_spec["height"] * factor / pix.height,
+    )
+    layers = [(bg_spec, bg_rect)]
 
-    c.save()
-    compressed_buffer.seek(0)
-    return compressed_buffer
+    if text_mask.any():
+        layers.append((encode_bitmap(~text_mask, image_mask=True), rect))
+    return layers
+
+
+def render_pdf_pages(file, dpi=150, fit_to=None):
+    """
+    Yield one RGB fitz.Pixmap per page of a PDF upload.
+    fit_to: (width, height) in points the pages will be drawn into; pages are
+            then rendered at `dpi` for that placement instead of their own size.
+    """
+    pdf_bytes = file.read()
+    file.seek(0)
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    for page in doc:
+        zoom = dpi / 72.0
+        if fit_to:
+            zoom *= min(fit_to[0] / page.rect.width, fit_to[1] / page.rect.height)
+        yield page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
 
 
-def load_image(file):
+def load_image(file, dpi=150, fit_to=None, draft_size=None):
     """
-    Load and auto-orient an image OR convert a PDF into a list of PIL.Image.
+    Load an image OR convert a PDF into a list of PIL.Image.
+    fit_to: (width, height) in points the PDF pages will be drawn into; pages are
+            then rendered at `dpi` for that placement instead of their own size.
+    draft_size: displayed pixel size the image will be reduced to; lets JPEG
+            decoding skip straight to a smaller DCT scale.
     Returns:
         - PIL.Image if normal image
         - list[PIL.Image] if multi-page PDF
@@ -148,77 +296,69 @@ def load_image(file):
 
     filename = getattr(file, "name", "").lower()
 
-    # PDF: render each page with higher DPI
+    # PDF: render each page at the DPI it will actually be shown at.
+    # The PIL image wraps the pixmap samples (no copy) and keeps the pixmap alive;
+    # rendered pages have no EXIF, so there is nothing to transpose.
     if filename.endswith(".pdf"):
         try:
-            pdf_bytes = file.read()
-            file.seek(0)
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
             images = []
-            for page_num in range(len(doc)):
-                pix = doc[page_num].get_pixmap(dpi=150)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                images.append(ImageOps.exif_transpose(img))
+            for pix in render_pdf_pages(file, dpi=dpi, fit_to=fit_to):
+                img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", 0, 1)
+                img.pixmap = pix
+                images.append(img)
             return images
         except Exception:
             return None
 
-    # Normal image
+    # Normal image: left in its stored orientation, the EXIF orientation is
+    # applied when it is placed (draw_card, convert_images_to_pdf)
     try:
         file.seek(0)
-        return ImageOps.exif_transpose(Image.open(file))
+        img = Image.open(file)
+        if draft_size:
+            width, height = draft_size
+            if oriented_size(img) != img.size:
+                width, height = height, width
+            img.draft("RGB", (width, height))
+        return img
     except Exception:
         return None
 
 
+@lru_cache(maxsize=None)
+def template_bytes(name):
+    """Raw bytes of a file in MEDIA_ROOT/templates, read once per process."""
+    with open(os.path.join(settings.MEDIA_ROOT, 'templates', name), "rb") as fh:
+        return fh.read()
+
+
+def template_page(name):
+    """
+    First page of a template PDF, parsed from the cached bytes. A new page object
+    every call, since merging an overlay modifies it in place.
+    """
+    return PdfReader(BytesIO(template_bytes(name))).pages[0]
+
+
 def generate_QR(data, size=70):
     """Generate a small QR as ImageReader (PNG keeps sharp edges; tiny size anyway)."""
+    return ImageReader(BytesIO(qr_png(data or "")))
+
+
+@lru_cache(maxsize=256)
+def qr_png(data):
+    """PNG bytes of the QR for data; previews and batches repeat the same texts."""
     qr = qrcode.QRCode(
         version=5,
         error_correction=qrcode.constants.ERROR_CORRECT_M,
     )
-    qr.add_data(data or "")
+    qr.add_data(data)
     qr.make(fit=True)
     qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
     qr_buffer = BytesIO()
     # PNG is fine for QR (lossless, tiny)
     qr_img.save(qr_buffer, format="PNG", optimize=True)
-    qr_buffer.seek(0)
-    return ImageReader(qr_buffer)
-
-def build_notary_paragraph(document_type, customer_name, schedule_date):
-    return (
-        f"I, JOHN OLATUNJI OF ONE LONDON SQUARE, CROSS LANES, GUILDFORD, GU1 1UN, "
-        f"A DULY AUTHORISED NOTARY PUBLIC OF ENGLAND AND WALES CERTIFY THAT THIS IS A TRUE COPY OF THE DOCUMENT "
-        f"{document_type} OF {customer_name} PRODUCED TO ME THIS {schedule_date} "
-        f"AND I FURTHER CERTIFY THAT THE INDIVIDUAL THAT APPEARED BEFORE ME VIA VIDEO CONFERENCE CALL IS INDEED "
-        f"AND BEARS THE TRUE LIKENESS OF {customer_name}."
-    )
-
-
-def get_bold_words(document_type, customer_name, schedule_date):
-    return [
-        word.upper() for word in (document_type.split() + customer_name.split() + [schedule_date])    
-    ]
-
-
-def draw_paragraph_with_bold(c, paragraph, start_x, start_y, width=80, font_size=10, bold_words=None):
-    """Draw wrapped paragraph with selected words in bold."""
-    wrapper = textwrap.TextWrapper(width=width)
-    lines = wrapper.wrap(paragraph)
-    text_obj = c.beginText(start_x, start_y)
-    text_obj.setFont("Helvetica", font_size)
-    
-    for line in lines:
-        for word in line.split(" "):
-            if word.strip(",.").upper() in bold_words:
-                text_obj.setFont("Helvetica-Bold", font_size)
-            else:
-                text_obj.setFont("Helvetica", font_size)
-            text_obj.textOut(word + " ")
-        text_obj.textLine("")  # New line
-    c.drawText(text_obj)
-
+    return qr_buffer.getvalue()
 
 def add_qr(c, qr_text, x=20, y=10, size=70):
     """Place QR code on canvas."""
@@ -226,6 +366,38 @@ def add_qr(c, qr_text, x=20, y=10, size=70):
     c.drawImage(qr_image, x=x, y=y, width=size, height=size)
 
 
+def stamp_output(buffer, qr_text, pages, numbered=True):
+    """
+    Stamp the QR code on `pages` (a slice) of a finished multipage document,
+    as one shared form XObject (see pdfstamp.py). With PDF_STAMP_PAGE_NUMBERS
+    and `numbered`, every page also gets "n / N".
+    """
+    stamp = BytesIO()
+    c = canvas.Canvas(stamp, pagesize=STAMP_SIZE)
+    add_qr(c, qr_text)
+    c.save()
+    return stamp_pages(buffer, stamp, pages, numbered and getattr(settings, "PDF_STAMP_PAGE_NUMBERS", False))
+
+
+def draw_card(c, card, x, y, width, height):
+    """
+    Draw a prepared card JPEG upright into the (x, y, width, height) box.
+    Its EXIF orientation becomes the placement matrix, so rotated phone
+    photos are never rotated in memory.
+    """
+    card.seek(0)
+    with Image.open(card) as img:
+        orientation = exif_orientation(img)
+    card.seek(0)
+    if orientation == 1:
+        c.drawImage(ImageReader(card), x, y, width=width, height=height)
+        return
+    c.saveState()
+    c.transform(*orientation_matrix(orientation, x, y, width, height))
+    c.drawImage(ImageReader(card), 0, 0, width=1, height=1)
+    c.restoreState()
+
+
 def merge_overlay(base_page, overlay_buffer):
     """Merge overlay page into base page."""
     overlay_pdf = PdfReader(overlay_buffer)
@@ -238,74 +410,248 @@ def convert_images_to_pdf(files, force_compress=False):
     Convert image/file inputs list into a single PDF (BytesIO).
     If force_compress True -> compress images before embedding.
     """
-    pdf_buffer = BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    out = fitz.open()
     page_width, page_height = A4
 
+    # Every page is fitted to A4, so never keep more pixels than A4 at PAGE_TARGET_DPI
+    dpi = getattr(settings, "PAGE_TARGET_DPI", 150)
+    max_width, max_height = box_to_pixels(A4, dpi)
+
     for file in files:
         try:
-            loaded = load_image(file)
-            imgs = loaded if isinstance(loaded, list) else [loaded]
-
-            for img in imgs:
-                if img is None:
-                    continue
-
-                if force_compress:
-                    img_buf = compress_image(img)
-                    comp_img = Image.open(img_buf)
-                else:
-                    img_buf = BytesIO()
-                    if img.mode != "RGB":
-                        img = img.convert("RGB")
-                    img.save(img_buf, format="JPEG")
-                    img_buf.seek(0)
-                    comp_img = Image.open(img_buf)
-
-                img_width, img_height = comp_img.size
-                ratio = min(page_width / img_width, page_height / img_height)
-                new_width = img_width * ratio
-                new_height = img_height * ratio
-                x = (page_width - new_width) / 2
-                y = (page_height - new_height) / 2
-
-                c.drawImage(ImageReader(img_buf), x, y, width=new_width, height=new_height)
-                c.showPage()
+            for spec in page_image_specs(file, dpi, max_width, max_height, force_compress):
+                # JPEG data goes in as-is (DCTDecode); nothing re-parses it
+                # rotated images are turned by the placement, not in memory
+                out_page = out.new_page(width=page_width, height=page_height)
+                size = displayed_size(spec["width"], spec["height"], spec["orientation"])
+                out_page.insert_image(fit_rect(out_page.rect, *size), xref=add_image(out, spec),
+                                      rotate=ORIENTATION_ROTATION[spec["orientation"]])
 
         except Exception as e:
-            print(f"Error processing {getattr(file, 'name', 'unknown')}: {e}")
+            logger.warning("Error processing %s: %s", getattr(file, "name", "unknown"), e)
 
-    c.save()
-    pdf_buffer.seek(0)
+    if out.page_count == 0:
+        out.new_page(width=page_width, height=page_height)
+    pdf_buffer = BytesIO(out.tobytes(garbage=1, deflate=True))
+    out.close()
     return pdf_buffer
 
 
+def compress_output(buffer):
+    """Re-encode a finished multipage document above compress_threshold_mb; returns a rewound buffer."""
+    size_mb = len(buffer.getbuffer()) / (1024 * 1024)
+    if size_mb > quality_setting("compress_threshold_mb"):
+        logger.debug("Compressing a %.2f MB PDF (above compress_threshold_mb)", size_mb)
+        buffer = compress_pdf_multipage(
+            buffer,
+            dpi=quality_setting("output_compress_dpi"),
+            quality=quality_setting("output_compress_quality"),
+        )
+    else:
+        logger.debug("Not compressing a %.2f MB PDF (under compress_threshold_mb)", size_mb)
+
+    buffer.seek(0)
+    return buffer
+
+
+def page_image_specs(file, dpi, max_width, max_height, force_compress):
+    """
+    Yield one encoded JPEG image spec per page of an upload.
+    PDF pages are encoded straight from their pixmaps by MuPDF; images go
+    through PIL once (optional downscale, JPEG encode) and keep their stored
+    orientation in the spec, except mirrored ones, which are transposed.
+    """
+    quality = quality_setting("forced_page_jpeg_quality" if force_compress else "page_jpeg_quality")
+    if getattr(file, "name", "").lower().endswith(".pdf"):
+        for pix in render_pdf_pages(file, dpi=dpi, fit_to=A4):
+            yield encode_pixmap(pix, quality)
+        return
+
+    if is_tiff(file):
+        yield from tiff_page_specs(file, max_width, max_height, force_compress, quality)
+        return
+
+    img = load_image(file)
+    if img is None:
+        return
+    orientation = exif_orientation(img)
+    if orientation not in ORIENTATION_ROTATION:
+        img, orientation = ImageOps.exif_transpose(img), 1
+    if force_compress:
+        img_buf = compress_image(img, max_width=max_width, max_height=max_height, quality=quality)
+    else:
+        img_buf = BytesIO()
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(img_buf, format="JPEG", quality=quality)
+    spec = jpeg_spec(img_buf.getvalue())
+    spec["orientation"] = orientation
+    yield spec
+
+
+def tiff_page_specs(file, max_width, max_height, force_compress, quality):
+    """
+    One image spec per frame of a (multi-page) TIFF, frame by frame. CCITT G4
+    frames (scanners, faxes) are embedded as they are, rotated ones turned by
+    the placement; other frames are decoded one at a time (Pillow uprights
+    them while decoding) and encoded like image uploads (bitmaps as G4).
+    """
+    for frame in tiff_frames(file):
+        spec = g4_frame_spec(frame, file)
+        if spec is None:
+            img = ImageOps.exif_transpose(frame)
+            if img.mode == "1":
+                spec = encode_bitmap(np.asarray(img))
+            elif force_compress:
+                spec = jpeg_spec(compress_image(img, max_width=max_width, max_height=max_height, quality=quality).getvalue())
+            else:
+                spec = encode_jpeg(img, quality)
+        yield spec
+
+
+def expand_card_frames(cards):
+    """
+    Fill the empty card slots after a multi-page TIFF card upload with its
+    further frames (front and back scanned into one file). The upload itself
+    keeps frame one; other frames are decoded only for a slot they fill.
+    """
+    cards = list(cards)
+    for index, card in enumerate(cards):
+        if card is None or isinstance(card, Image.Image) or not is_tiff(card):
+            continue
+        empty = [slot for slot in range(index + 1, len(cards)) if cards[slot] is None]
+        if not empty:
+            continue
+        frames = tiff_frames(card)
+        try:
+            next(frames)
+            for slot, frame in zip(empty, frames):
+                cards[slot] = ImageOps.exif_transpose(frame)
+        except Exception as e:
+            logger.warning("Error reading TIFF frames of %s: %s", getattr(card, "name", "unknown"), e)
+        finally:
+            frames.close()
+    return cards
+
+
+def crop_cards(cards, layout, dpi=None):
+    """
+    With CARD_AUTO_CROP, cut each card upload down to the card detected in it
+    (see cardcrop.py) before the layout is solved, so the slot is filled by the
+    card instead of the desk around it. Images are decoded once, capped at the
+    layout's largest slot at dpi (default CARD_TARGET_DPI); PDF cards render
+    their first page clipped to the card. Uploads without a detected card are
+    kept whole.
+    """
+    if not getattr(settings, "CARD_AUTO_CROP", False):
+        return list(cards)
+    cap = box_to_pixels(max_card_box(layout), dpi or getattr(settings, "CARD_TARGET_DPI", 200))
+    cropped = []
+    for card in cards:
+        try:
+            cropped.append(crop_card(card, cap) if card is not None else None)
+        except Exception as e:
+            logger.warning("Error cropping card %s: %s", getattr(card, "name", "frame"), e)
+            cropped.append(card)
+    return cropped
+
+
+def crop_card(card, cap):
+    """PIL.Image of one card upload cropped to the detected card, within cap pixels."""
+    if not isinstance(card, Image.Image) and getattr(card, "name", "").lower().endswith(".pdf"):
+        return crop_pdf_card(card, cap)
+
+    img = card if isinstance(card, Image.Image) else load_image(card, draft_size=cap)
+    if img is None:
+        return card
+    small = img.copy()
+    small.thumbnail((DETECT_SIZE, DETECT_SIZE))
+    found = detect_card(np.asarray(small.convert("L")))
+    if found is None:
+        return img
+    x0, y0, x1, y1 = found
+    return img.crop((
+        int(x0 * img.width), int(y0 * img.height),
+        int(round(x1 * img.width)), int(round(y1 * img.height)),
+    ))
+
+
+def crop_pdf_card(card, cap):
+    """First page of a PDF card upload rendered clipped to the detected card."""
+    card.seek(0)
+    doc = fitz.open(stream=card.read(), filetype="pdf")
+    card.seek(0)
+    try:
+        page = doc[0]
+        rect = page.rect
+        probe_zoom = DETECT_SIZE / float(max(rect.width, rect.height))
+        probe = page.get_pixmap(matrix=fitz.Matrix(probe_zoom, probe_zoom), colorspace=fitz.csGRAY, alpha=False)
+        found = detect_card(pixmap_array(probe)[:, :, 0])
+        if found is not None:
+            x0, y0, x1, y1 = found
+            rect = fitz.Rect(
+                rect.x0 + x0 * rect.width, rect.y0 + y0 * rect.height,
+                rect.x0 + x1 * rect.width, rect.y0 + y1 * rect.height,
+            )
+        zoom = min(cap[0] / rect.width, cap[1] / rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, alpha=False)
+    finally:
+        doc.close()
+    img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", 0, 1)
+    img.pixmap = pix
+    return img
+
+
 # -----------------------
 # Main Document Generator
 # -----------------------
 
 def generate_document(first_image, back_image, first_image_2, back_image_2,
                       document_type, layout, multiPagePdf,
-                      qr_text, customer_name, schedule_date=None):
+                      qr_text, customer_name, schedule_date=None, notary=None):
+    """Main generator that returns a FileResponse (PDF) for given layout and images."""
+    buffer, filename = render_document(
+        first_image, back_image, first_image_2, back_image_2,
+        document_type, layout, multiPagePdf, qr_text, customer_name, schedule_date, notary,
+    )
+    return FileResponse(buffer, as_attachment=True, filename=filename)
+
+
+def render_document(first_image, back_image, first_image_2, back_image_2,
+                    document_type, layout, multiPagePdf,
+                    qr_text, customer_name, schedule_date=None, notary=None,
+                    card_dpi=None, compress=True):
     """
-    Main generator that returns a FileResponse (PDF) for given layout and images.
-    Images are normalized early to BytesIO objects.
+    Render the PDF for given layout and images; returns (rewound buffer, filename).
+    Images are normalized early to BytesIO objects. notary selects the certificate
+    profile of the UK88 layouts (default: settings.DEFAULT_NOTARY_PROFILE).
+    card_dpi overrides CARD_TARGET_DPI and compress=False skips the size
+    compression of multipage outputs (both for previews, see preview.py).
     """
     overlay_buffer = BytesIO()
     c = canvas.Canvas(overlay_buffer, pagesize=A4)
     page_width, page_height = A4
 
-    # Load inputs (each returns PIL.Image or list or None)
-    front_image = load_image(first_image)
-    back_image = load_image(back_image)
-    front_image_2 = load_image(first_image_2)
-    back_image_2 = load_image(back_image_2)
+    first_image, back_image, first_image_2, back_image_2 = crop_cards(
+        expand_card_frames([first_image, back_image, first_image_2, back_image_2]), layout, card_dpi,
+    )
 
-    # Compress only if we got a PIL image (lists mean PDF pages; not used here)
-    front_image = compress_image(front_image, quality=90)  # Better quality
-    back_image = compress_image(back_image, quality=90)
-    front_image_2 = compress_image(front_image_2, quality=90)
-    back_image_2 = compress_image(back_image_2, quality=90)
+    # Solve every card slot once from header-probed upload sizes (see layouts.py)
+    boxes = solve_layout(layout, {
+        "front": probe_size(first_image),
+        "back": probe_size(back_image),
+        "front2": probe_size(first_image_2),
+        "back2": probe_size(back_image_2),
+    })
+
+    # Then decode + compress only the placed cards, each for its own box
+    # (PDF card uploads give page lists and are skipped here, unless crop_cards
+    # already rendered them)
+    card_quality = quality_setting("card_jpeg_quality")
+    front_image = prepare_image(first_image, boxes.get("front"), card_quality, card_dpi)  # Better quality
+    back_image = prepare_image(back_image, boxes.get("back"), card_quality, card_dpi)
+    front_image_2 = prepare_image(first_image_2, boxes.get("front2"), card_quality, card_dpi)
+    back_image_2 = prepare_image(back_image_2, boxes.get("back2"), card_quality, card_dpi)
 
     # Constants defaults
     margin = 50
@@ -321,40 +667,20 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
         overlay_buffer = BytesIO()
         c = canvas.Canvas(overlay_buffer, pagesize=A4)
 
-        template_path = os.path.join(settings.MEDIA_ROOT, 'templates', 'output_1.pdf')
         try:
-            original_pdf = PdfReader(open(template_path, "rb"))
-            base_page = original_pdf.pages[0]
+            base_page = template_page('output_1.pdf')
         except Exception:
             base_page = None
 
         # Text area (adjust as needed)
         c.drawString(200, 428, document_type or "")
 
-        # Define safe area to avoid template text/header/footer
-        available_top = page_height - 160  # Space from top for header
-        available_bottom = margin + 60     # Space from bottom for footer/QR
-        available_height = max(100, available_top - available_bottom)
-        available_width = page_width - 2 * margin
-
-        # Two images side-by-side
-        if back_image is not None:
-            width_each = (available_width - gap) / 2
-            
-            # Calculate sizes with full available dimensions
-            width1, height1 = calculate_dynamic_size(front_image, max_width=width_each, max_height=available_height, min_width=50, min_height=50)
-            width2, height2 = calculate_dynamic_size(back_image, max_width=width_each, max_height=available_height, min_width=50, min_height=50)
+        # Safe area below the header / above footer+QR is part of LAYOUT_RULES["ONENOTARY"]
+        # Two images side-by-side (sizes shrink above 230pt, see LAYOUT_RULES)
+        if "back" in boxes:
+            width1, height1 = boxes["front"]
+            width2, height2 = boxes["back"]
 
-            max_img_height = max(height1, height2)
-            
-            # NEW CONDITION: If height is greater than 230, use smaller dimensions
-            if max_img_height > 230:
-                max_img_width = min(width_each, 180)  # Limit width per image
-                max_img_height_limit = 220  # Limit height per image
-                
-                width1, height1 = calculate_dynamic_size(front_image, max_width=max_img_width, max_height=max_img_height_limit, min_width=50, min_height=50)
-                width2, height2 = calculate_dynamic_size(back_image, max_width=max_img_width, max_height=max_img_height_limit, min_width=50, min_height=50)
-            
             # Center vertically within available space
             image_y = page_height - 250
 
@@ -362,27 +688,18 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
 
             front_image.seek(0)
             back_image.seek(0)
-            c.drawImage(ImageReader(front_image), start_x, image_y, width=width1, height=height1)
-            c.drawImage(ImageReader(back_image), start_x + width1 + gap, image_y, width=width2, height=height2)
+            draw_card(c, front_image, start_x, image_y, width=width1, height=height1)
+            draw_card(c, back_image, start_x + width1 + gap, image_y, width=width2, height=height2)
 
         # Single image
-        elif front_image is not None:
-            max_w = available_width
-            max_h = available_height
-            
-            width, height = calculate_dynamic_size(front_image, max_width=max_w, max_height=max_h, min_width=50, min_height=50)
-            
-            # NEW CONDITION: If height is greater than 230, use smaller dimensions
-            if height > 230:
-                max_w = min(available_width, 380)  # Limit width
-                max_h = 220  # Limit height
-                width, height = calculate_dynamic_size(front_image, max_width=max_w, max_height=max_h, min_width=50, min_height=50)
-            
+        elif "front" in boxes:
+            width, height = boxes["front"]
+
             x_center = (page_width - width) / 2
             image_y = page_height - 250
 
             front_image.seek(0)
-            c.drawImage(ImageReader(front_image), x_center, image_y, width=width, height=height)
+            draw_card(c, front_image, x_center, image_y, width=width, height=height)
 
         add_qr(c, qr_text)
         c.save()
@@ -395,10 +712,10 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
             result_buffer = BytesIO()
             output.write(result_buffer)
             result_buffer.seek(0)
-            return FileResponse(result_buffer, as_attachment=True, filename="Notary_Format_document.pdf")
+            return result_buffer, "Notary_Format_document.pdf"
         else:
             # fallback: return overlay alone
-            return FileResponse(overlay_buffer, as_attachment=True, filename="Notary_Format_document.pdf")
+            return overlay_buffer, "Notary_Format_document.pdf"
     # -------------------------
     # UK88 Single Page
     # -------------------------
@@ -407,21 +724,10 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
         c = canvas.Canvas(overlay_buffer, pagesize=A4)
 
         # Top placements - tuned to your earlier coordinates but now dynamic sizing
-        if front_image and back_image:
-            width1, height1 = calculate_dynamic_size(front_image, max_width=page_width - 2 * margin, max_height=page_height * 0.35)
-            width2, height2 = calculate_dynamic_size(back_image,  max_width=page_width - 2 * margin, max_height=page_height * 0.35)
-
-            max_img_height = max(height1, height2)
-            print(width1)
-            
-            # NEW CONDITION: If height is greater than 270, use smaller dimensions
-            if max_img_height > 270:
-                max_img_width = min(page_width - 2 * margin, 400)  # Limit width per image
-                max_img_height_limit = 290  # Limit height per image
-                
-                width1, height1 = calculate_dynamic_size(front_image, max_width=max_img_width, max_height=max_img_height_limit, min_width=50, min_height=50)
-                width2, height2 = calculate_dynamic_size(back_image, max_width=max_img_width, max_height=max_img_height_limit, min_width=50, min_height=50)
-                max_img_height = max(height1, height2)
+        if "back" in boxes:
+            # sizes shrink when the taller card exceeds 270pt (see LAYOUT_RULES)
+            width1, height1 = boxes["front"]
+            width2, height2 = boxes["back"]
             x_center1 = (page_width - width1) / 2
             x_center2 = (page_width - width2) / 2
 
@@ -432,43 +738,34 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
             c.drawImage(info_path,100,10,width=120,height=120)
             # place first near top
             top_y = page_height  - height1-45
-            c.drawImage(ImageReader(front_image), x_center1, top_y, width=width1, height=height1-30)
+            draw_card(c, front_image, x_center1, top_y, width=width1, height=height1-30)
             # place second below
             second_y = top_y - height2 - 25
-            c.drawImage(ImageReader(back_image), x_center2, second_y, width=width2, height=height2-30)
+            draw_card(c, back_image, x_center2, second_y, width=width2, height=height2-30)
             
 
-        elif front_image:
-            width, height = calculate_dynamic_size(front_image, max_width=page_width - 2 * margin, max_height=page_height * 0.6)
-            if height > 355:
-                max_w = min(page_width - 2 * margin, 380)  # Limit width
-                max_h = 300  # Limit height
-                width, height = calculate_dynamic_size(front_image, max_width=max_w, max_height=max_h, min_width=50, min_height=50)
+        elif "front" in boxes:
+            width, height = boxes["front"]
             x_center = (page_width - width) / 2
             front_image.seek(0)
             c.drawImage(stamp_path,400,70,width=100,height=60)
             c.drawImage(info_path,100,10,width=120,height=120)
-            print(info_path)
-            c.drawImage(ImageReader(front_image), x_center, page_height - margin - height, width=width, height=height-30)
+            draw_card(c, front_image, x_center, page_height - margin - height, width=width, height=height-30)
 
-        paragraph = build_notary_paragraph(document_type, customer_name, schedule_date)
-        bold_words = get_bold_words(document_type, customer_name, schedule_date)
         # place paragraph a bit lower
-        draw_paragraph_with_bold(c, paragraph, 50, 200, width=80, font_size=10, bold_words=bold_words)
+        draw_certificate(c, 50, 200, document_type, customer_name, schedule_date, profile=notary, font_size=10)
         
         
         add_qr(c, qr_text)
         c.save()
         overlay_buffer.seek(0)
-        return FileResponse(overlay_buffer, as_attachment=True, filename="Notary_Format_document.pdf")
+        return overlay_buffer, "Notary_Format_document.pdf"
 
     elif layout == "UK88_MULTIPAGE":
             overlay_buffer = BytesIO()
             c = canvas.Canvas(overlay_buffer, pagesize=A4)
 
-            paragraph = build_notary_paragraph(document_type, customer_name, schedule_date)
-            bold_words = get_bold_words(document_type, customer_name, schedule_date)
-            draw_paragraph_with_bold(c, paragraph, 50, 800, width=80, font_size=10, bold_words=bold_words)
+            draw_certificate(c, 50, 800, document_type, customer_name, schedule_date, profile=notary, font_size=10)
             c.drawImage(stamp_path,400,70,width=100,height=60)
             c.drawImage(info_path,100,10,width=120,height=120)
             add_qr(c, qr_text)
@@ -498,25 +795,14 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
             merger.write(final_buffer)
             merger.close()
             final_buffer.seek(0)
-            # ---- Conditional Compression ----
-            size_mb = len(final_buffer.getbuffer()) / (1024 * 1024)
-            print(f"PDF size before compression: {size_mb:.2f} MB")
-
-            if size_mb > 5:
-                print("Compressing PDF (size > 5 MB)...")
-                compressed_final = compress_pdf_multipage(final_buffer, dpi=100, quality=80)
-                final_output = compressed_final
-            else:
-                print("Skipping compression (size <= 5 MB).")
-                final_output = final_buffer
-
-            final_output.seek(0)
-            return FileResponse(final_output, as_attachment=True, filename="UK88_Multi_Page_Pdf.pdf")
+            final_output = compress_output(final_buffer) if compress else final_buffer
+            if layout in getattr(settings, "PDF_STAMP_LAYOUTS", ()):
+                # the certificate page carries its own QR code
+                final_output = stamp_output(final_output, qr_text, slice(1, None))
+            return final_output, "UK88_Multi_Page_Pdf.pdf"
 
     elif layout == "us_multipage":
-            template_path = os.path.join(settings.MEDIA_ROOT, 'templates', 'US_MultiPage_format.pdf')
-            original_pdf = PdfReader(open(template_path, "rb"))
-            base_page = original_pdf.pages[0]
+            base_page = template_page('US_MultiPage_format.pdf')
 
             overlay_buffer = BytesIO()
             c = canvas.Canvas(overlay_buffer, pagesize=A4)
@@ -546,55 +832,20 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
             merger.write(final_buffer)
             merger.close()
             final_buffer.seek(0)
-            # ---- Conditional Compression ----
-            size_mb = len(final_buffer.getbuffer()) / (1024 * 1024)
-            print(f"PDF size before compression: {size_mb:.2f} MB")
-
-            if size_mb > 5:
-                print("Compressing PDF (size > 5 MB)...")
-                compressed_final = compress_pdf_multipage(final_buffer, dpi=100, quality=80)
-                final_output = compressed_final
-            else:
-                print("Skipping compression (size <= 5 MB).")
-                final_output = final_buffer
-
-            final_output.seek(0)
+            final_output = compress_output(final_buffer) if compress else final_buffer
             
-            return FileResponse(final_output, as_attachment=True, filename="Multi_Page_Pdf.pdf")
+            return final_output, "Multi_Page_Pdf.pdf"
 
     elif layout == "non_multipage":
-            c = canvas.Canvas(overlay_buffer, pagesize=A4)
-            add_qr(c, qr_text)
-            c.save()
-            overlay_buffer.seek(0)
-
-            base_pdf = PdfReader(multiPagePdf)
-            overlay_pdf = PdfReader(overlay_buffer)
-            total_page = len(base_pdf.pages)
-
-            output = PdfWriter()
-            for i, base_page in enumerate(base_pdf.pages):
-                if i == total_page - 1:
-                    base_page.merge_page(overlay_pdf.pages[0])
-                output.add_page(base_page)
-
-            result_buffer = BytesIO()
-            output.write(result_buffer)
-            result_buffer.seek(0)
-            # ---- Conditional Compression ----
-            size_mb = len(final_buffer.getbuffer()) / (1024 * 1024)
-            print(f"PDF size before compression: {size_mb:.2f} MB")
-
-            if size_mb > 5:
-                print("Compressing PDF (size > 5 MB)...")
-                compressed_final = compress_pdf_multipage(final_buffer, dpi=100, quality=80)
-                final_output = compressed_final
-            else:
-                print("Skipping compression (size <= 5 MB).")
-                final_output = final_buffer
-
-            final_output.seek(0)
-            return FileResponse(final_output, as_attachment=True, filename="multi_Format_document.pdf")
+            multiPagePdf.seek(0)
+            final_buffer = BytesIO(multiPagePdf.read())
+            multiPagePdf.seek(0)
+            final_output = compress_output(final_buffer) if compress else final_buffer
+
+            # the QR code goes on every page, or only the last one as before
+            every_page = layout in getattr(settings, "PDF_STAMP_LAYOUTS", ())
+            final_output = stamp_output(final_output, qr_text, slice(None) if every_page else slice(-1, None), every_page)
+            return final_output, "multi_Format_document.pdf"
     else:
         overlay_buffer = BytesIO()
         c = canvas.Canvas(overlay_buffer, pagesize=A4)
@@ -606,168 +857,417 @@ def generate_document(first_image, back_image, first_image_2, back_image_2,
         avail_width = page_width - 2 * margin
         page_width, page_height = A4
 
-        # Many combinations — each placed with dynamic sizing and vertical centering
+        # Many combinations — sizes come from the "default" rules in LAYOUT_RULES,
+        # placement (centering) stays here
+        placed = tuple(boxes)
         try:
             # Four images present (2x2)
-            if front_image and back_image and front_image_2 and back_image_2:
+            if placed == ("front", "back", "front2", "back2"):
                 # compute each cell width (two columns)
                 col_w = (avail_width - gap) / 2
                 # heights limited to half available height (minus small gap)
                 cell_h = (avail_height - gap) / 2
 
-                width1, height1 = calculate_dynamic_size(front_image, max_width=col_w, max_height=cell_h)
-                width2, height2 = calculate_dynamic_size(back_image,  max_width=col_w, max_height=cell_h)
-                width3, height3 = calculate_dynamic_size(front_image_2, max_width=col_w, max_height=cell_h)
-                width4, height4 = calculate_dynamic_size(back_image_2,  max_width=col_w, max_height=cell_h)
+                width1, height1 = boxes["front"]
+                width2, height2 = boxes["back"]
+                width3, height3 = boxes["front2"]
+                width4, height4 = boxes["back2"]
 
                 top_y = avail_bottom + cell_h + gap  # y position for top row
                 left_x = margin
                 right_x = margin + col_w + gap
 
-                c.drawImage(ImageReader(front_image), left_x + (col_w - width1) / 2, top_y + (cell_h - height1) / 2, width=width1, height=height1)
-                c.drawImage(ImageReader(back_image), right_x + (col_w - width2) / 2, top_y + (cell_h - height2) / 2, width=width2, height=height2)
-                c.drawImage(ImageReader(front_image_2), left_x + (col_w - width3) / 2, avail_bottom + (cell_h - height3) / 2, width=width3, height=height3)
-                c.drawImage(ImageReader(back_image_2), right_x + (col_w - width4) / 2, avail_bottom + (cell_h - height4) / 2, width=width4, height=height4)
+                draw_card(c, front_image, left_x + (col_w - width1) / 2, top_y + (cell_h - height1) / 2, width=width1, height=height1)
+                draw_card(c, back_image, right_x + (col_w - width2) / 2, top_y + (cell_h - height2) / 2, width=width2, height=height2)
+                draw_card(c, front_image_2, left_x + (col_w - width3) / 2, avail_bottom + (cell_h - height3) / 2, width=width3, height=height3)
+                draw_card(c, back_image_2, right_x + (col_w - width4) / 2, avail_bottom + (cell_h - height4) / 2, width=width4, height=height4)
 
             # Three images (one big, two below)
-            elif front_image and front_image_2 and back_image_2:
-                top_h = avail_height * 0.55
+            elif placed == ("front", "front2", "back2"):
                 col_w = (avail_width - gap) / 2
-                
-                width1, height1 = calculate_dynamic_size(front_image, max_width=avail_width, max_height=top_h)     
-                width2, height2 = calculate_dynamic_size(front_image_2, max_width=col_w, max_height=avail_height * 0.4)
-                width3, height3 = calculate_dynamic_size(back_image_2,  max_width=col_w, max_height=avail_height * 0.4)
+
+                width1, height1 = boxes["front"]
+                width2, height2 = boxes["front2"]
+                width3, height3 = boxes["back2"]
 
                 top_y = avail_bottom + (avail_height - (height1 + gap + max(height2, height3))) / 2 + max(height2, height3)
-                c.drawImage(ImageReader(front_image), (page_width - width1) / 2, top_y, width=width1, height=height1)
+                draw_card(c, front_image, (page_width - width1) / 2, top_y, width=width1, height=height1)
 
                 bottom_y = top_y - gap - max(height2, height3)
-                c.drawImage(ImageReader(front_image_2), margin, bottom_y + (max(height2, height3) - height2) / 2, width=width2, height=height2)
-                c.drawImage(ImageReader(back_image_2), margin + col_w + gap, bottom_y + (max(height2, height3) - height3) / 2, width=width3, height=height3)
+                draw_card(c, front_image_2, margin, bottom_y + (max(height2, height3) - height2) / 2, width=width2, height=height2)
+                draw_card(c, back_image_2, margin + col_w + gap, bottom_y + (max(height2, height3) - height3) / 2, width=width3, height=height3)
 
-            elif front_image and back_image and front_image_2:
+            elif placed == ("front", "back", "front2"):
                 # Two on top, one below
-                top_h = avail_height * 0.4
-                col_w = (avail_width - gap) / 2
-                
-
-                width1, height1 = calculate_dynamic_size(front_image, max_width=col_w, max_height=avail_height * 0.55)
-                width2, height2 = calculate_dynamic_size(back_image,  max_width=col_w, max_height=avail_height * 0.55)
-                width3, height3 = calculate_dynamic_size(front_image_2, max_width=12222, max_height=255)
-
-                top_y = avail_bottom + (avail_height - (height1 + gap + max(height2, height3))) / 2 + max(height2, height3)
-                bottom_y = top_y - gap - max(height2, height3)
-
-
-                c.drawImage(ImageReader(front_image), 40, 550, width=width1, height=height1)
-                c.drawImage(ImageReader(back_image), width1+70, 550, width=width2, height=height2)
-                c.drawImage( ImageReader(front_image_2),(page_width-width3)/2, 250, width3, height3)
-            # Two images stacked vertically centered
-            elif front_image and back_image:
-                width1, height1 = calculate_dynamic_size(front_image, max_width=avail_width, max_height=avail_height * 0.6)
-                width2, height2 = calculate_dynamic_size(back_image,  max_width=avail_width, max_height=avail_height * 0.6)
+                width1, height1 = boxes["front"]
+                width2, height2 = boxes["back"]
+                width3, height3 = boxes["front2"]
+
+                draw_card(c, front_image, 40, 550, width=width1, height=height1)
+                draw_card(c, back_image, width1+70, 550, width=width2, height=height2)
+                draw_card(c, front_image_2, (page_width-width3)/2, 250, width3, height3)
+            # Two images stacked vertically centered (already scaled to fit avail_height)
+            elif placed == ("front", "back"):
+                width1, height1 = boxes["front"]
+                width2, height2 = boxes["back"]
                 total_needed = height1 + height2 + gap
-                
-                if total_needed > avail_height:
-                    
-                    scale = avail_height / float(total_needed)
-                    
-                    
-                    width1, height1 = int(width1 * scale), int(height1 * scale)
-                    width2, height2 = int(width2 * scale), int(height2 * scale)
-                    print(width2,height2)
-                    
-                    total_needed = height1 + height2 + gap
 
                 start_y = avail_bottom + (avail_height - total_needed) / 2
-                c.drawImage(ImageReader(front_image), (page_width - width1) / 2, start_y + height2 + gap, width=width1-30, height=height1-30)
-                c.drawImage(ImageReader(back_image),  (page_width - width2) / 2, start_y, width=width2-30, height=height2-30)
-
-            elif front_image and front_image_2:
-                width1, height1 = calculate_dynamic_size(front_image, max_width=avail_width, max_height=avail_height * 0.6)
-                width2, height2 = calculate_dynamic_size(front_image_2, max_width=avail_width, max_height=avail_height * 0.6)
+                draw_card(c, front_image, (page_width - width1) / 2, start_y + height2 + gap, width=width1-30, height=height1-30)
+                draw_card(c, back_image, (page_width - width2) / 2, start_y, width=width2-30, height=height2-30)
 
+            elif placed == ("front", "front2"):
+                width1, height1 = boxes["front"]
+                width2, height2 = boxes["front2"]
                 total_needed = height1 + height2 + gap
-                if total_needed > avail_height:
-                    scale = avail_height / float(total_needed)
-                    width1, height1 = int(width1 * scale), int(height1 * scale)
-                    width2, height2 = int(width2 * scale), int(height2 * scale)
-                    total_needed = height1 + height2 + gap
 
                 start_y = avail_bottom + (avail_height - total_needed) / 2
 
-                c.drawImage(ImageReader(front_image), (page_width - width1) / 2, start_y + height2 + gap, width=width1-30, height=height1-30)
+                draw_card(c, front_image, (page_width - width1) / 2, start_y + height2 + gap, width=width1-30, height=height1-30)
 
-                c.drawImage(ImageReader(front_image_2), (page_width - width2) / 2, start_y, width=width2-30, height=height2-30)
+                draw_card(c, front_image_2, (page_width - width2) / 2, start_y, width=width2-30, height=height2-30)
 
             # Single image centered
-            elif front_image:
-                width, height = calculate_dynamic_size(front_image, max_width=avail_width, max_height=avail_height)
+            elif placed == ("front",):
+                width, height = boxes["front"]
                 x_center = (page_width - width) / 2
                 y_center = avail_bottom + (avail_height - height) / 2
-                c.drawImage(ImageReader(front_image), x_center, y_center, width=width-30, height=height)
+                draw_card(c, front_image, x_center, y_center, width=width-30, height=height)
 
             # fallback: nothing to draw
         except Exception as e:
-            print("Error in default layout drawing:", e)
+            logger.warning("Error in default layout drawing: %s", e)
 
         add_qr(c, qr_text)
         c.save()
         overlay_buffer.seek(0)
-        return FileResponse(overlay_buffer, as_attachment=True, filename="Notary_Format_document.pdf")
+        return overlay_buffer, "Notary_Format_document.pdf"
 
 
 # -----------------------
 # API View
 # -----------------------
 
-class GeneratePDFView(APIView):
+class AssetUploadView(APIView):
+    """Accept an image/PDF as soon as it is picked and start preprocessing it."""
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
-        first_image = request.FILES.get('front_image')
-        back_image = request.FILES.get('back_image')
-        first_image_2 = request.FILES.get('front_image2')
-        back_image_2 = request.FILES.get('back_image2')
-
-        # multiPagePdf can be a single pdf file or multiple image files
-        multiPagePdf_files = request.FILES.getlist('multi_page_pdf')
-
-        document_type = request.data.get('document_type', 'Default Document Type')
-        layout = request.data.get('layout', 'STANDARD')
-        customer_name = request.data.get('customer_name', 'CUSTOMER NAME REQ.')
-        qr_text = request.data.get('qr_text', 'QR TEXT')
-        schedule_date = request.data.get('schedule_date')
-
-        multiPagePdf = None
-
-        if multiPagePdf_files:
-            if len(multiPagePdf_files) == 1 and multiPagePdf_files[0].name.lower().endswith(".pdf"):
-                multiPagePdf = multiPagePdf_files[0]
-
-                #  size check for direct uploaded PDF
-                size_in_mb = multiPagePdf.size / (1024 * 1024)
-                if size_in_mb > 5:
-                    # Compress if >5MB
-                    buffer = BytesIO(multiPagePdf.read())
-                    multiPagePdf.seek(0)
-                    compressed_pdf = compress_pdf_multipage(buffer)
-                    multiPagePdf = compressed_pdf
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-            else:
-                # Step 1: Make PDF without compression
-                temp_pdf = convert_images_to_pdf(multiPagePdf_files, force_compress=False)
+        try:
+            asset_id = assets.store_asset(upload)
+        except assets.AssetRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"asset_id": asset_id, "status": assets.asset_status(asset_id)},
+            status=status.HTTP_201_CREATED,
+        )
 
-                # Step 2: Check size
-                size_in_mb = len(temp_pdf.getvalue()) / (1024 * 1024)
-                if size_in_mb > 5:  
-                    # Compress only if >5 MB
-                    temp_pdf = convert_images_to_pdf(multiPagePdf_files, force_compress=True)
 
-                multiPagePdf = temp_pdf
+class ChunkedUploadView(APIView):
+    """Open a resumable chunked upload (see uploads.py for the protocol)."""
 
-        response = generate_document(
-            first_image, back_image, first_image_2, back_image_2,
-            document_type, layout, multiPagePdf, qr_text, customer_name, schedule_date
+    def post(self, request, *args, **kwargs):
+        try:
+            meta = uploads.create_upload(
+                request.data.get("filename"), request.data.get("size"), request.data.get("sha256"),
+            )
+        except uploads.UploadRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"upload_id": meta["upload_id"], "chunk_size": meta["chunk_size"], "chunks": uploads.chunk_count(meta)},
+            status=status.HTTP_201_CREATED,
         )
-        return response
+
+
+class ChunkedUploadStatusView(APIView):
+
+    def get(self, request, upload_id, *args, **kwargs):
+        try:
+            return Response(uploads.upload_status(upload_id))
+        except uploads.UploadNotFound:
+            return Response({"error": "unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class UploadChunkView(APIView):
+    """PUT one raw chunk; the body is streamed to disk, never parsed."""
+
+    def put(self, request, upload_id, index, *args, **kwargs):
+        try:
+            received = uploads.write_chunk(
+                upload_id, index, request.stream or BytesIO(), request.headers.get("X-Chunk-SHA256"),
+            )
+        except uploads.UploadNotFound:
+            return Response({"error": "unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        except uploads.UploadRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"index": index, "received": received})
+
+
+class CompleteUploadView(APIView):
+
+    def post(self, request, upload_id, *args, **kwargs):
+        try:
+            asset_id = uploads.complete_upload(upload_id, request.data.get("sha256"))
+        except uploads.UploadNotFound:
+            return Response({"error": "unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        except uploads.UploadRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(
+            {"asset_id": asset_id, "status": assets.asset_status(asset_id)},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class UploadProfileView(APIView):
+    """
+    What is worth uploading: per layout, the largest card size in pixels the
+    server keeps (the biggest slot at CARD_TARGET_DPI; null for the layouts
+    that draw no cards), the cap for multipage images (A4 at PAGE_TARGET_DPI)
+    and the file types it can read. Clients downscale and re-encode to these
+    before sending (see frontend App.jsx).
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(upload_profile())
+
+
+def upload_profile():
+    card_dpi = getattr(settings, "CARD_TARGET_DPI", 200)
+    layouts = {}
+    for layout in LAYOUT_NAMES:
+        if layout in CARDLESS_LAYOUTS:
+            layouts[layout] = None
+            continue
+        width, height = box_to_pixels(max_card_box(layout), card_dpi)
+        layouts[layout] = {"max_width": width, "max_height": height}
+    card_caps = [entry for entry in layouts.values() if entry]
+    page_width, page_height = box_to_pixels(A4, getattr(settings, "PAGE_TARGET_DPI", 150))
+
+    extensions = assets.accepted_extensions()
+    return {
+        "layouts": layouts,
+        # pick-time cap, before a layout is chosen
+        "card": {
+            "max_width": max(entry["max_width"] for entry in card_caps),
+            "max_height": max(entry["max_height"] for entry in card_caps),
+        },
+        "page": {"max_width": page_width, "max_height": page_height},
+        "jpeg_quality": quality_setting("card_jpeg_quality"),
+        "extensions": extensions,
+        "formats": sorted({mimetypes.guess_type("file" + ext)[0] for ext in extensions} - {None}),
+    }
+
+
+class AssetStatusView(APIView):
+
+    def get(self, request, asset_id, *args, **kwargs):
+        try:
+            return Response({"asset_id": asset_id, "status": assets.asset_status(asset_id)})
+        except assets.AssetNotFound:
+            return Response({"error": "unknown asset"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class GeneratePDFView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            job = read_generate_request(request)
+        except assets.AssetNotFound as e:
+            return Response({"error": f"unknown asset {e}"}, status=status.HTTP_404_NOT_FOUND)
+        except UnknownNotary as e:
+            return Response({"error": f"unknown notary {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            buffer, filename = render_generate_job(job)
+        finally:
+            close_job_files(job)
+        return FileResponse(buffer, as_attachment=True, filename=filename)
+
+
+class GeneratePreviewView(APIView):
+    """First page of a generate-pdf request as a small PNG, for checking card placement."""
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            dpi = int(request.data.get("dpi") or getattr(settings, "PREVIEW_DPI", 50))
+        except ValueError:
+            return Response({"error": "dpi must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        dpi = max(10, min(dpi, getattr(settings, "PREVIEW_MAX_DPI", 100)))
+
+        try:
+            job = read_generate_request(request)
+        except assets.AssetNotFound as e:
+            return Response({"error": f"unknown asset {e}"}, status=status.HTTP_404_NOT_FOUND)
+        except UnknownNotary as e:
+            return Response({"error": f"unknown notary {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            return HttpResponse(render_preview(job, dpi), content_type="image/png")
+        finally:
+            close_job_files(job)
+
+
+@csrf_exempt
+@require_POST
+async def generate_pdf_async(request):
+    """
+    Async variant of GeneratePDFView for ASGI servers. The upload is received by
+    the event loop, so slow clients hold no worker; rendering runs on the bounded
+    executor in workers.py (GENERATE_EXECUTOR / GENERATE_MAX_WORKERS), and
+    requests beyond GENERATE_MAX_QUEUE waiting jobs get a 503.
+    """
+    try:
+        # multipart parsing and asset lookups (which may wait on preprocessing) block
+        job = await sync_to_async(read_generate_request, thread_sensitive=False)(request)
+    except assets.AssetNotFound as e:
+        return JsonResponse({"error": f"unknown asset {e}"}, status=404)
+    except UnknownNotary as e:
+        return JsonResponse({"error": f"unknown notary {e}"}, status=400)
+
+    try:
+        buffer, filename = await workers.run_generate_job(job)
+    except workers.GeneratorBusy:
+        return JsonResponse({"error": "server busy, retry later"}, status=503)
+    finally:
+        close_job_files(job)
+    return FileResponse(buffer, as_attachment=True, filename=filename)
+
+
+# -----------------------
+# Request handling
+# -----------------------
+
+# job key -> form field
+FILE_FIELDS = (
+    ("first_image", "front_image"),
+    ("back_image", "back_image"),
+    ("first_image_2", "front_image2"),
+    ("back_image_2", "back_image2"),
+)
+
+
+# form field -> default for the text fields of a job
+JOB_DEFAULTS = {
+    "document_type": "Default Document Type",
+    "layout": "STANDARD",
+    "customer_name": "CUSTOMER NAME REQ.",
+    "qr_text": "QR TEXT",
+    "schedule_date": None,
+    "notary": None,
+    "linearize": None,
+    "sign": None,
+}
+
+
+def read_generate_request(request):
+    """
+    Collect the uploads and form fields of a generate-pdf request (DRF or plain
+    Django request) into a job dict for render_generate_job. Only cheap work here.
+    Every file field can also be sent as "<field>_id" referencing an uploaded asset;
+    raises assets.AssetNotFound for unknown ids and UnknownNotary for unknown notary profiles.
+    """
+    data = request.data if hasattr(request, "data") else request.POST
+    job = {name: file_or_asset(request, data, field) for name, field in FILE_FIELDS}
+
+    # multiPagePdf can be a single pdf file or multiple image files
+    job["multi_page_files"] = request.FILES.getlist('multi_page_pdf') or [
+        assets.open_asset(asset_id) for asset_id in data.getlist('multi_page_pdf_id')
+    ]
+
+    for key, default in JOB_DEFAULTS.items():
+        job[key] = data.get(key, default)
+    return validate_job(job)
+
+
+def validate_job(job):
+    """
+    Fill in the notary profile and check it exists (raises UnknownNotary), and
+    resolve the linearize and sign flags against the layout defaults. Signing
+    wins: the signature is an incremental update, which ends linearization, so
+    jobs that will be signed are not linearized.
+    """
+    job["notary"] = job.get("notary") or default_notary()
+    if job["notary"] not in notary_profiles():
+        raise UnknownNotary(job["notary"])
+    job["sign"] = wants_signed(job.get("sign"), job["layout"])
+    job["linearize"] = wants_linearized(job.get("linearize"), job["layout"]) and not (
+        job["sign"] and signing_configured()
+    )
+    return job
+
+
+def file_or_asset(request, data, field):
+    upload = request.FILES.get(field)
+    if upload is not None:
+        return upload
+    asset_id = data.get(field + '_id')
+    return assets.open_asset(asset_id) if asset_id else None
+
+
+def render_generate_job(job):
+    """CPU-bound part of a generate-pdf request; returns (buffer, filename)."""
+    multiPagePdf = prepare_multipage(job["multi_page_files"])
+    buffer, filename = render_document(
+        job["first_image"], job["back_image"], job["first_image_2"], job["back_image_2"],
+        job["document_type"], job["layout"], multiPagePdf,
+        job["qr_text"], job["customer_name"], job["schedule_date"], job["notary"],
+    )
+    # linearized in the optimizing save itself when both are on
+    if getattr(settings, "PDF_OPTIMIZE_OUTPUT", True):
+        buffer = optimize_pdf(buffer, linearize=job["linearize"])
+    elif job["linearize"]:
+        buffer = linearize_pdf(buffer)
+    # last: the signature covers the final bytes (see validate_job for linearize)
+    if job["sign"]:
+        buffer = sign_pdf(buffer)
+    return buffer, filename
+
+
+def close_job_files(job):
+    """Close a job's uploads once it is rendered (asset files are opened per job)."""
+    for value in [job.get(name) for name, _ in FILE_FIELDS] + list(job.get("multi_page_files") or ()):
+        if value is not None:
+            value.close()
+
+
+def prepare_multipage(multiPagePdf_files):
+    """Turn the multi_page_pdf uploads into one PDF (compressed above compress_threshold_mb), or None."""
+    if not multiPagePdf_files:
+        return None
+
+    threshold_mb = quality_setting("compress_threshold_mb")
+    if len(multiPagePdf_files) == 1 and multiPagePdf_files[0].name.lower().endswith(".pdf"):
+        multiPagePdf = multiPagePdf_files[0]
+        upload_kwargs = {
+            "dpi": quality_setting("upload_compress_dpi"),
+            "quality": quality_setting("upload_compress_quality"),
+        }
+
+        #  size check for direct uploaded PDF
+        size_in_mb = multiPagePdf.size / (1024 * 1024)
+        if size_in_mb > threshold_mb:
+            # Compress above the threshold; uploads Django spooled to disk are compressed
+            # from their path, page by page, instead of being read into memory
+            if hasattr(multiPagePdf, "temporary_file_path"):
+                multiPagePdf = compress_pdf_streaming(multiPagePdf.temporary_file_path(), **upload_kwargs)
+            else:
+                buffer = BytesIO(multiPagePdf.read())
+                multiPagePdf.seek(0)
+                multiPagePdf = compress_pdf_multipage(buffer, **upload_kwargs)
+        return multiPagePdf
+
+    # Step 1: Make PDF without compression
+    temp_pdf = convert_images_to_pdf(multiPagePdf_files, force_compress=False)
+
+    # Step 2: Check size
+    size_in_mb = len(temp_pdf.getvalue()) / (1024 * 1024)
+    if size_in_mb > threshold_mb:
+        # Compress only above the threshold
+        temp_pdf = convert_images_to_pdf(multiPagePdf_files, force_compress=True)
+    return temp_pdf
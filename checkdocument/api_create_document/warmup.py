@@ -0,0 +1,142 @@
+"""
+Worker warm-up.
+
+The first request in a fresh process pays for importing fitz/reportlab/PyPDF2/
+qrcode/Pillow, registering PIL plugins, building reportlab font metrics,
+parsing the PDF templates and MuPDF/libjpeg setup. warm_up() does all of that
+up front, ending with one throwaway render per layout, so a worker is warm
+before it accepts traffic. It is opt-in and only runs from the server
+entrypoints: the gunicorn hooks in gunicorn.conf.py, checkdocument/asgi.py, and
+ApiCreateDocumentConfig.ready when WARMUP_ON_READY is set (e.g. the
+WARMUP_ON_READY=1 environment variable for runserver). Scripts, tests and
+management commands never pay for it.
+"""
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+from django.conf import settings
+
+from .layouts import LAYOUT_NAMES as LAYOUTS
+TEMPLATE_NAMES = ("output_1.pdf", "US_MultiPage_format.pdf", "info.jpeg", "stamp.jpeg")
+
+_warmed = False
+
+logger = logging.getLogger(__name__)
+
+
+def should_warm_up():
+    """
+    True when WARMUP_ON_READY asks for a warm-up in AppConfig.ready, except in
+    runserver's autoreloader parent, which only watches files.
+    """
+    if not getattr(settings, "WARMUP_ON_READY", False):
+        return False
+    return os.environ.get("RUN_MAIN") == "true" or "runserver" not in sys.argv[1:2] or "--noreload" in sys.argv
+
+
+def warm_up(render=True):
+    """Initialise the libraries, templates and (optionally) every layout. Returns step timings in seconds."""
+    global _warmed
+    timings = {}
+
+    def step(name, func):
+        started = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        timings[name] = time.perf_counter() - started
+
+    step("imports", _import_libraries)
+    step("codecs", _init_codecs)
+    step("fonts", _init_fonts)
+    step("templates", _load_templates)
+    if render:
+        for layout in LAYOUTS:
+            step(f"render:{layout}", lambda: _render_dummy(layout))
+
+    _warmed = True
+    return timings
+
+
+def warm_up_once():
+    if not _warmed:
+        warm_up()
+
+
+def _import_libraries():
+    from . import views  # noqa: F401  (imports fitz, reportlab, PyPDF2, qrcode, PIL)
+
+
+def _init_codecs():
+    import fitz
+    from PIL import Image, features
+
+    from .views import compress_image, encode_bilevel, pixmap_array
+
+    Image.init()  # register every plugin now instead of on the first unknown format
+    features.check("libtiff")
+
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "warm-up")
+    gray = pixmap_array(doc[0].get_pixmap(dpi=72, colorspace=fitz.csGRAY))[:, :, 0]
+    encode_bilevel(gray)
+    doc.close()
+    compress_image(Image.new("RGB", (64, 64), (128, 128, 128)))
+
+
+def _init_fonts():
+    from reportlab.pdfbase import pdfmetrics
+
+    for font in ("Helvetica", "Helvetica-Bold"):
+        pdfmetrics.stringWidth("warm-up", font, 10)
+
+
+def _load_templates():
+    from reportlab.lib.pagesizes import A4
+
+    from .certificates import compile_certificate, notary_profiles
+    from .views import template_bytes, template_page
+
+    for name in TEMPLATE_NAMES:
+        template_bytes(name)
+    for name in TEMPLATE_NAMES:
+        if name.endswith(".pdf"):
+            template_page(name)
+    # certificate paragraph of every notary, at the column the UK88 layouts use
+    for profile in notary_profiles():
+        compile_certificate(profile, A4[0] - 2 * 50, 10)
+
+
+def dummy_card(size=(640, 400), color=(180, 40, 40)):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    buf.seek(0)
+    buf.name = "warmup.jpg"
+    return buf
+
+
+def dummy_pdf(pages=2):
+    import fitz
+
+    doc = fitz.open()
+    for number in range(pages):
+        doc.new_page().insert_text((72, 72), f"warm-up page {number + 1}")
+    buf = BytesIO(doc.tobytes())
+    doc.close()
+    buf.name = "warmup.pdf"
+    return buf
+
+
+def _render_dummy(layout):
+    from .views import render_document
+
+    render_document(
+        dummy_card(), dummy_card(color=(40, 40, 180)), dummy_card(), dummy_card(color=(40, 140, 40)),
+        "PASSPORT", layout, dummy_pdf(), "warm-up", "WARM UP", "01/01/2025",
+    )
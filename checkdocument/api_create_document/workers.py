@@ -0,0 +1,129 @@
+"""
+Bounded CPU executor for the async generate endpoint.
+
+Rendering (PIL, reportlab, PyPDF2, MuPDF) is CPU-bound, so the event loop only
+receives uploads and hands each job to one shared executor:
+
+    GENERATE_EXECUTOR    "process" (default) or "thread". Processes sidestep
+                         the GIL for the pure-Python parts (reportlab, PyPDF2)
+                         and give every job its own MuPDF. "thread" is unsafe:
+                         PyMuPDF does not support concurrent use from several
+                         threads, so only use it with GENERATE_MAX_WORKERS = 1
+    GENERATE_MAX_WORKERS jobs rendering at once (default: CPU count)
+    GENERATE_MAX_QUEUE   jobs allowed to wait for a worker; past that callers
+                         get GeneratorBusy instead of piling up memory
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+class GeneratorBusy(Exception):
+    pass
+
+
+class DiskUpload(File):
+    """A file on disk standing in for an upload (e.g. one Django spooled to disk, reopened by path)."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = getattr(settings, "GENERATE_MAX_WORKERS", None) or os.cpu_count() or 2
+            queue = getattr(settings, "GENERATE_MAX_QUEUE", 32)
+            if getattr(settings, "GENERATE_EXECUTOR", "process") == "process":
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=init_process)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generate")
+            _slots = threading.BoundedSemaphore(workers + queue)
+        return _executor
+
+
+def init_process():
+    # forked workers inherit a configured Django; spawned/forkserver ones do not
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+async def run_generate_job(job):
+    """
+    Render a job from views.read_generate_request on the executor.
+    Returns (buffer, filename); raises GeneratorBusy when the queue is full.
+    """
+    executor = get_executor()
+    if not _slots.acquire(blocking=False):
+        raise GeneratorBusy()
+    try:
+        if isinstance(executor, ProcessPoolExecutor):
+            data, filename = await asyncio.wrap_future(executor.submit(_render_snapshot, snapshot_job(job)))
+            return BytesIO(data), filename
+        from .views import render_generate_job
+        return await asyncio.wrap_future(executor.submit(render_generate_job, job))
+    finally:
+        _slots.release()
+
+
+# -----------------------
+# Process pool payloads
+# -----------------------
+
+def snapshot_job(job):
+    """Picklable copy of a job: uploads become (name, bytes or path, flags) tuples."""
+    snapshot = dict(job)
+    for key, value in job.items():
+        if key == "multi_page_files":
+            snapshot[key] = [_snapshot_file(f) for f in value]
+        elif isinstance(value, File):
+            snapshot[key] = _snapshot_file(value)
+    return snapshot
+
+
+def _snapshot_file(upload):
+    preprocessed = getattr(upload, "preprocessed", False)
+    if hasattr(upload, "temporary_file_path"):
+        # the request (and its temp file) outlives the job, pass the path only
+        return upload.name, None, upload.temporary_file_path(), preprocessed
+    upload.seek(0)
+    data = upload.read()
+    upload.seek(0)
+    return upload.name, data, None, preprocessed
+
+
+def _restore_file(snapshot):
+    name, data, path, preprocessed = snapshot
+    upload = DiskUpload(open(path, "rb"), name=name) if path else File(BytesIO(data), name=name)
+    upload.preprocessed = preprocessed
+    return upload
+
+
+def _render_snapshot(snapshot):
+    from .views import close_job_files, render_generate_job
+
+    job = dict(snapshot)
+    for key, value in snapshot.items():
+        if key == "multi_page_files":
+            job[key] = [_restore_file(s) for s in value]
+        elif isinstance(value, tuple):
+            job[key] = _restore_file(value)
+
+    try:
+        buffer, filename = render_generate_job(job)
+    finally:
+        close_job_files(job)
+    buffer.seek(0)
+    return buffer.read(), filename
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'checkdocument.settings')
 
 application = get_asgi_application()
+
+# initialise the PDF stack before the server takes traffic
+from api_create_document.warmup import warm_up_once  # noqa: E402
+
+warm_up_once()
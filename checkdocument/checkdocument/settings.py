@@ -132,4 +132,95 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Uploaded assets are preprocessed in a small background pool
+ASSET_PREPROCESS_WORKERS = 2
+# Largest single-request asset upload (api/assets/); bigger files go through
+# the chunked uploads below
+ASSET_UPLOAD_MAX_SIZE = 64 * 1024 * 1024
+
+# Effective resolution images are encoded at for the box they are drawn in
+CARD_TARGET_DPI = 200
+PAGE_TARGET_DPI = 150
+
+# compress_pdf_multipage: "auto" (per-page JPEG / gray JPEG / G4) or "mrc"
+PDF_COMPRESSION_MODE = "auto"
+# drop blank pages (duplex scanner backs) when compressing multipage PDFs
+PDF_DROP_BLANK_PAGES = False
+
+# compress_pdf_streaming keeps output in memory up to this size, then spills to disk
+PDF_STREAM_SPOOL_SIZE = 8 * 1024 * 1024
+# compress_pdf_multipage reopens the input every N pages (MuPDF caches parsed objects until close)
+PDF_STREAM_REOPEN_PAGES = 100
+
+# Async generate endpoint (api/generate-pdf-async/): executor kind ("process", or
+# "thread" only with one worker since PyMuPDF is not thread-safe), jobs
+# rendering at once and jobs allowed to wait before a 503
+GENERATE_EXECUTOR = "process"
+GENERATE_MAX_WORKERS = os.cpu_count() or 2
+GENERATE_MAX_QUEUE = 32
+
+# Also warm up (initialise libraries/templates, render each layout once) when
+# the app registry is ready; gunicorn.conf.py and asgi.py warm up on their own.
+# Opt-in, e.g. WARMUP_ON_READY=1 python manage.py runserver
+# (api_create_document/warmup.py)
+WARMUP_ON_READY = os.environ.get("WARMUP_ON_READY") == "1"
+
+# Certificate wording profiles (api_create_document/certificates.py); add notaries
+# as {"KEY": {"notary_name": ..., "notary_address": ..., "jurisdiction": ...}}
+DEFAULT_NOTARY_PROFILE = "JOHN_OLATUNJI"
+NOTARY_PROFILES = {}
+
+# Encoder quality/DPI/threshold overrides, e.g. {"output_compress_quality": 70};
+# keys and defaults in api_create_document/quality.py
+OUTPUT_QUALITY = {}
+
+# Layouts served as linearized ("fast web view") PDFs unless the request sends
+# linearize=0; any layout can ask for it with linearize=1. Needs pikepdf
+# (requirements.txt); without it PDFs are served as-is.
+PDF_LINEARIZE_LAYOUTS = ("UK88_MULTIPAGE", "us_multipage")
+
+# Lossless dedupe/flate/object-stream pass over every generated PDF (pdfoutput.optimize_pdf)
+PDF_OPTIMIZE_OUTPUT = True
+
+# api/generate-preview/: default and maximum PNG DPI (cards are encoded at the
+# maximum so one cached page serves every zoom), and entries per preview cache
+PREVIEW_DPI = 50
+PREVIEW_MAX_DPI = 100
+PREVIEW_CACHE_SIZE = 32
+
+# Resumable chunked uploads (api/uploads/, api_create_document/uploads.py):
+# chunk size handed to clients, largest file accepted, and how long an
+# unfinished upload is kept
+CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
+
+# Crop card photos to the ID card found in them (api_create_document/cardcrop.py)
+# before they are placed, so a card shot on a desk fills its slot; PDF cards are
+# rendered clipped to the card
+CARD_AUTO_CROP = False
+
+# Layouts whose multipage outputs carry the QR code on every page (drawn once as
+# a shared form XObject, api_create_document/pdfstamp.py); non_multipage outside
+# this list stamps only its last page. PDF_STAMP_PAGE_NUMBERS adds "n / N" to
+# every page of these layouts.
+PDF_STAMP_LAYOUTS = ("UK88_MULTIPAGE", "non_multipage")
+PDF_STAMP_PAGE_NUMBERS = False
+
+# PAdES signing of generated PDFs (api_create_document/signing.py, needs pyhanko
+# from requirements.txt). Set the PEM key and certificate (plus any
+# intermediate certificates) to enable it; PDF_SIGNING_LAYOUTS are signed by
+# default, any request can ask with sign=1 or opt out with sign=0.
+# Signing wins over PDF_LINEARIZE_LAYOUTS: the signature is appended as an
+# incremental update, which a linearized file cannot take, so once a key is set
+# signed documents (UK88_MULTIPAGE by default) are served without linearization.
+PDF_SIGNING_KEY = None
+PDF_SIGNING_CERT = None
+PDF_SIGNING_CHAIN = ()
+PDF_SIGNING_KEY_PASSPHRASE = None
+PDF_SIGNING_LAYOUTS = ("ONENOTARY", "UK88", "UK88_MULTIPAGE")
+PDF_SIGNING_FIELD = "NotarySignature"
+PDF_SIGNING_REASON = "Notarised document"
+PDF_SIGNING_LOCATION = None
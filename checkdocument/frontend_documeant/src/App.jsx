@@ -1,8 +1,83 @@
 // src/App.js
 import Select from 'react-select';
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './App.css'; // if you use external CSS
 
+// Downscale + re-encode an image to the server's useful size (cap comes from
+// /api/upload-profile/) before it is sent. PDFs, TIFFs (a canvas keeps only
+// their first frame and loses G4 compression; the server stores them as
+// uploaded), images the browser cannot decode and files that would not get
+// smaller go through untouched.
+async function downscaleImage(file, cap, quality) {
+  if (!file || !cap || !file.type.startsWith("image/") || file.type === "image/tiff") return file;
+  let bitmap;
+  try {
+    // EXIF orientation is applied here, the re-encoded JPEG carries none
+    bitmap = await createImageBitmap(file, { imageOrientation: "from-image" });
+  } catch {
+    return file;
+  }
+  const scale = Math.min(1, cap.max_width / bitmap.width, cap.max_height / bitmap.height);
+  if (scale === 1 && file.type === "image/jpeg") {
+    bitmap.close();
+    return file;
+  }
+
+  const canvas = document.createElement("canvas");
+  canvas.width = Math.max(1, Math.round(bitmap.width * scale));
+  canvas.height = Math.max(1, Math.round(bitmap.height * scale));
+  const context = canvas.getContext("2d");
+  context.imageSmoothingQuality = "high";
+  context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+  bitmap.close();
+
+  const blob = await new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg", quality / 100));
+  if (!blob || blob.size >= file.size) return file;
+  return new File([blob], file.name.replace(/\.[^.]+$/, "") + ".jpg", { type: "image/jpeg" });
+}
+
+const sha256Hex = async (blob) => {
+  const digest = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+};
+
+// Resumable upload through /api/uploads/: every chunk carries its sha256 and is
+// retried on its own, so a flaky connection never restarts the whole file. The
+// server hashes the assembled file on completion; that hash is the asset id.
+async function uploadChunked(file, retries = 5) {
+  const api = "http://localhost:8000/api/uploads/";
+  const created = await fetch(api, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  if (!created.ok) throw new Error("Could not start the upload");
+  const { upload_id, chunk_size, chunks } = await created.json();
+
+  for (let index = 0; index < chunks; index++) {
+    const chunk = file.slice(index * chunk_size, (index + 1) * chunk_size);
+    const checksum = await sha256Hex(chunk);
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await fetch(`${api}${upload_id}/chunks/${index}/`, {
+          method: "PUT",
+          headers: { "Content-Type": "application/octet-stream", "X-Chunk-SHA256": checksum },
+          body: chunk,
+        });
+        if (response.ok) break;
+      } catch (error) {
+        console.warn(`Chunk ${index} failed:`, error);
+      }
+      if (attempt >= retries) throw new Error(`Chunk ${index} could not be uploaded`);
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  }
+
+  const completed = await fetch(`${api}${upload_id}/complete/`, { method: "POST" });
+  if (!completed.ok) throw new Error("Could not complete the upload");
+  return (await completed.json()).asset_id;
+}
+
 function App() {
   const [frontImage1, setfrontImage1] = useState(null);
   const [backImage1, setbackImage1] = useState(null);
@@ -10,6 +85,83 @@ function App() {
   const [backImage2, setbackImage2] = useState(null);
   const [MultiPagePdf,setmultipagePdf]= useState(null)
   const [selected, setSelected] = useState('');
+  // asset ids returned by /api/assets/, keyed by form field
+  const [assetIds, setAssetIds] = useState({});
+  // latest pick per form field; an upload or downscale that finishes after a
+  // newer pick of the same field is dropped instead of overwriting it
+  const picks = useRef({});
+  // pixel caps and readable formats from /api/upload-profile/ (null: send files as picked)
+  const [uploadProfile, setUploadProfile] = useState(null);
+
+  useEffect(() => {
+    fetch("http://localhost:8000/api/upload-profile/")
+      .then((response) => (response.ok ? response.json() : null))
+      .then(setUploadProfile)
+      .catch((error) => console.error("Upload profile unavailable:", error));
+  }, []);
+
+  const cardAccept = uploadProfile
+    ? uploadProfile.formats.filter((type) => type.startsWith("image/")).join(",")
+    : "image/*";
+  const pageAccept = uploadProfile ? uploadProfile.formats.join(",") : "application/pdf,image/*";
+
+  const isLatestPick = (field, pick) => picks.current[field] === pick;
+
+  // Upload a file as soon as it is picked so the server can preprocess it early
+  const uploadAsset = async (field, file, pick) => {
+    setAssetIds((prev) => ({ ...prev, [field]: undefined }));
+    if (!file) return;
+    const keep = (asset_id) => {
+      if (isLatestPick(field, pick)) setAssetIds((prev) => ({ ...prev, [field]: asset_id }));
+    };
+    // big multipage scans go up in resumable chunks
+    if (field === "multi_page_pdf" && file.size > 8 * 1024 * 1024) {
+      try {
+        keep(await uploadChunked(file));
+      } catch (error) {
+        console.error("Chunked upload failed:", error);
+      }
+      return;
+    }
+    const body = new FormData();
+    body.append("file", file);
+    try {
+      const response = await fetch("http://localhost:8000/api/assets/", {
+        method: "POST",
+        body,
+      });
+      if (!response.ok) return;
+      keep((await response.json()).asset_id);
+    } catch (error) {
+      // fall back to sending the file itself with the generate call
+      console.error("Asset upload failed:", error);
+    }
+  };
+
+  // Cards are picked before the layout is chosen, so they are capped at the
+  // largest slot of any layout ("card"). The multipage input is sent as picked
+  // (downscale: false): its PDFs and multi-frame TIFFs must keep every page
+  const pickFile = (field, setter, downscale = true) => async (e) => {
+    const pick = (picks.current[field] || 0) + 1;
+    picks.current[field] = pick;
+    const file = await downscaleImage(
+      e.target.files[0],
+      downscale && uploadProfile && uploadProfile.card,
+      uploadProfile && uploadProfile.jpeg_quality,
+    );
+    if (!isLatestPick(field, pick)) return;
+    setter(file);
+    uploadAsset(field, file, pick);
+  };
+
+  // Send the asset id when we have one, the raw file otherwise
+  const appendFile = (formData, field, file) => {
+    if (assetIds[field]) {
+      formData.append(`${field}_id`, assetIds[field]);
+    } else {
+      formData.append(field, file);
+    }
+  };
 
   const options = [
     { value: 'PANCARD', label: 'PAN CARD' },
@@ -26,18 +178,18 @@ function App() {
     }
 
     const formData = new FormData();
-    formData.append("front_image", frontImage1);
+    appendFile(formData, "front_image", frontImage1);
     if (backImage1) {
-      formData.append("back_image", backImage1);
+      appendFile(formData, "back_image", backImage1);
     }
     if(frontImage2){
-      formData.append("front_image2",frontImage2)
+      appendFile(formData, "front_image2", frontImage2)
     }
     if (backImage2){
-      formData.append("back_image2",backImage2)
+      appendFile(formData, "back_image2", backImage2)
     }
     if (MultiPagePdf){
-      formData.append("multi_page_pdf",MultiPagePdf)
+      appendFile(formData, "multi_page_pdf", MultiPagePdf)
     }
 
     formData.append("layout", layoutType);
@@ -86,8 +238,8 @@ function App() {
             <label style={styles.label}>Front Image (optional):</label>
             <input
               type="file"
-              accept="image/*"
-              onChange={(e) => setfrontImage1(e.target.files[0])}
+              accept={cardAccept}
+              onChange={pickFile("front_image", setfrontImage1)}
               style={styles.input}
 
             />
@@ -98,8 +250,8 @@ function App() {
             <label style={styles.label}>Back Image (optional):</label>
             <input
               type="file"
-              accept="image/*"
-              onChange={(e) => setbackImage1(e.target.files[0])}
+              accept={cardAccept}
+              onChange={pickFile("back_image", setbackImage1)}
               style={styles.input}
             />
             {backImage1 && <p style={styles.filename}>📎 {backImage1.name}</p>}
@@ -108,8 +260,8 @@ function App() {
             <label style={styles.label}>Front Image 2(optional):</label>
             <input
               type="file"
-              accept="image/*"
-              onChange={(e) => setfrontImage2(e.target.files[0])}
+              accept={cardAccept}
+              onChange={pickFile("front_image2", setfrontImage2)}
               style={styles.input}
             />
             {frontImage2 && <p style={styles.filename}>📎 {frontImage2.name}</p>}
@@ -119,8 +271,8 @@ function App() {
             <label style={styles.label}>Back Image 2(optional):</label>
             <input
               type="file"
-              accept="image/*"
-              onChange={(e) => setbackImage2(e.target.files[0])}
+              accept={cardAccept}
+              onChange={pickFile("back_image2", setbackImage2)}
               style={styles.input}
             />
             {backImage2 && <p style={styles.filename}>📎 {backImage2.name}</p>}
@@ -130,8 +282,8 @@ function App() {
             <label style={styles.label}>MultiPagePdf(optional):</label>
             <input
               type="file"
-              accept="application/pdf,image/*"
-              onChange={(e) => setmultipagePdf(e.target.files[0])}
+              accept={pageAccept}
+              onChange={pickFile("multi_page_pdf", setmultipagePdf, false)}
               style={styles.input}
             />
 
@@ -0,0 +1,20 @@
+"""
+gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master and warmed up there (when_ready, before
+the first fork); workers fork with modules imported, templates parsed and every
+layout rendered once, and only redo the per-process native library setup.
+"""
+wsgi_app = "checkdocument.wsgi:application"
+preload_app = True
+
+
+def when_ready(server):
+    from api_create_document.warmup import warm_up_once
+    warm_up_once()
+
+
+def post_fork(server, worker):
+    from api_create_document.warmup import warm_up
+    timings = warm_up(render=False)
+    server.log.info("worker %s warmed in %.3fs", worker.pid, sum(timings.values()))